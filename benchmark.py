@@ -0,0 +1,132 @@
+# Measures generation time, simulation speed and peak memory of the headless engine
+# across a few maze sizes and enemy densities.
+# Prints one JSON object per configuration so results can be compared between runs:
+#     python benchmark.py > before.jsonl
+#     python benchmark.py --sizes 250x100,500x200 --enemies 2-5,10-20 --ticks 2000
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from maze_generation import GenerationSettings, generate_maze
+from engine import MazeEngine
+from misc import Direction
+
+DEFAULT_SIZES = '250x100,1000x400,5000x2000'
+DEFAULT_ENEMIES = '2-5,10-20'
+DEFAULT_TICKS = 1000
+# Ticks simulated while measuring peak memory
+MEMORY_TICKS = 100
+# Times every moving enemy in the maze is stepped at once, to time a whole swarm step
+SWARM_STEPS = 10
+
+def parse_pairs(text: str, separator: str):
+    pairs = []
+    for item in text.split(','):
+        first, second = item.split(separator)
+        pairs.append((int(first), int(second)))
+    return pairs
+
+def choose_direction(engine, input_random):
+    player = engine.player
+    safe_directions = [None]
+    for direction in Direction:
+        dx, dy = Direction.offset(direction)
+        new_x = player.x + dx
+        new_y = player.y + dy
+        if player.can_walk_to(new_x, new_y, engine.maze) and \
+            not player.check_if_dead(new_x, new_y, engine.maze):
+            safe_directions.append(direction)
+    return input_random.choice(safe_directions)
+
+def benchmark_configuration(max_x, max_y, min_enemies, max_enemies, tick_count, seed):
+    # Room counts are scaled with the area so bigger maps aren't just emptier
+    settings = GenerationSettings().scaled_to(max_x, max_y)
+    settings.min_enemies_per_room = min_enemies
+    settings.max_enemies_per_room = max_enemies
+    random.seed(seed)
+    input_random = random.Random(seed)
+
+    start_time = time.perf_counter()
+    start_x, start_y, maze = generate_maze(settings)
+    generation_time = time.perf_counter() - start_time
+    engine = MazeEngine(maze, start_x, start_y)
+
+    # Random walk that avoids stepping into walls and death.
+    # If the round ends anyway, carry on from the start of the same maze
+    simulation_time = 0
+    rounds = 1
+    for _ in range(tick_count):
+        if engine.finished:
+            maze.remove_walker(engine.player)
+            engine = MazeEngine(maze, start_x, start_y)
+            rounds += 1
+        start_time = time.perf_counter()
+        engine.tick(choose_direction(engine, input_random))
+        simulation_time += time.perf_counter() - start_time
+
+    # Step every moving enemy together, not just the ones the scheduler would pick
+    # (which means waking the ones on their tracks first)
+    maze.patrollers.wake_all(maze)
+    start_time = time.perf_counter()
+    for _ in range(SWARM_STEPS):
+        maze.patrollers.step(maze)
+    swarm_step_time = (time.perf_counter() - start_time) / SWARM_STEPS
+
+    # Tracing memory slows everything down, so measure it in a separate run
+    tracemalloc.start()
+    start_x, start_y, maze = generate_maze(settings)
+    engine = MazeEngine(maze, start_x, start_y)
+    for _ in range(min(tick_count, MEMORY_TICKS)):
+        if engine.finished:
+            break
+        engine.tick(choose_direction(engine, input_random))
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'max_x': max_x,
+        'max_y': max_y,
+        'min_enemies_per_room': min_enemies,
+        'max_enemies_per_room': max_enemies,
+        'walkers': len(maze.walkers),
+        'moving_enemies': len(maze.patrollers),
+        'swarm_step_seconds': round(swarm_step_time, 6),
+        'generation_seconds': round(generation_time, 6),
+        'ticks': tick_count,
+        'rounds': rounds,
+        'ticks_per_second': round(tick_count / simulation_time, 1) if simulation_time else None,
+        'peak_memory_bytes': peak_memory,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the headless maze engine')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+        help='comma separated WIDTHxHEIGHT map sizes (default: %(default)s)')
+    parser.add_argument('--enemies', default=DEFAULT_ENEMIES,
+        help='comma separated MIN-MAX enemies per room (default: %(default)s)')
+    parser.add_argument('--ticks', type=int, default=DEFAULT_TICKS,
+        help='ticks to simulate per configuration (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout,
+        help='file to write JSON lines to (default: stdout)')
+    args = parser.parse_args()
+
+    for max_x, max_y in parse_pairs(args.sizes, 'x'):
+        for min_enemies, max_enemies in parse_pairs(args.enemies, '-'):
+            result = benchmark_configuration(max_x, max_y, min_enemies, max_enemies,
+                args.ticks, args.seed)
+            args.output.write(json.dumps(result) + '\n')
+            args.output.flush()
+            print(f'{max_x}x{max_y}, {min_enemies}-{max_enemies} enemies/room: ' +
+                f'{result["ticks_per_second"]} ticks/s, ' +
+                f'{result["moving_enemies"]} moving enemies stepped in ' +
+                f'{result["swarm_step_seconds"] * 1000:.1f}ms, ' +
+                f'generated in {result["generation_seconds"]:.3f}s, ' +
+                f'peak {result["peak_memory_bytes"] / 1e6:.1f}MB', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
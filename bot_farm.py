@@ -0,0 +1,268 @@
+# Plays lots of seeded mazes with a bot, on every CPU core, to see how changes to the
+# generation settings and enemy constants affect how hard the game is:
+#     python bot_farm.py --rounds 2000
+#     python bot_farm.py --set death_tile_density=0.02,0.04 --set ChasingEnemy.MOVEMENT_CHANCE=0.3,0.5
+#
+# Every combination of the --set values is a configuration, and each one is played on
+# the same seeds. Results are streamed to a file as rounds finish (see the format below),
+# and statistics for each configuration are printed at the end.
+# The bot heads for the nearest finish tile, keeping away from enemies where it can
+#
+# Results file layout (little endian):
+#     header       magic, version, length of the JSON that follows (see HEADER)
+#     JSON         {"configurations": [...], "death_causes": [...]}
+#     records      one ROUND_RECORD per round, in the order they finished
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import struct
+import sys
+import time
+from dataclasses import fields, replace
+
+from tiles import *
+from terrain import *
+from engine import MazeEngine, Outcome, round_score
+from pathfinding import NearestDistanceField, ORTHOGONAL_OFFSETS
+from maze_generation import GenerationSettings, generate_maze
+
+MAGIC = b'TMBF'
+FORMAT_VERSION = 1
+# magic, version, JSON length
+HEADER = struct.Struct('<4sHI')
+# configuration number, seed, outcome, death cause, move count, score
+ROUND_RECORD = struct.Struct('<HqBBII')
+# Outcome of a round that went on for longer than MAX_ROUND_TICKS
+TIMED_OUT = 255
+MAX_ROUND_TICKS = 3000
+# What killed the player, by number in the results file. 0 is for rounds not lost
+DEATH_CAUSES = ['', 'death tile', 'MovingEnemy', 'ChasingEnemy']
+# Classes whose constants can be changed with --set
+TUNABLE_CLASSES = {cls.__name__: cls for cls in (Player, ChasingEnemy, MovingEnemy)}
+DEFAULT_ROUNDS = 500
+DEFAULT_RESULTS_PATH = 'bot_farm_results.bin'
+# Rounds given to a worker at a time
+CHUNK_SIZE = 8
+
+def apply_overrides(settings: GenerationSettings, overrides: dict):
+    # Returns a copy of settings with overrides applied. Names with a dot
+    # (eg. ChasingEnemy.MOVEMENT_CHANCE) set class constants, in this process only
+    setting_overrides = {}
+    for name, value in overrides.items():
+        if '.' in name:
+            class_name, attribute = name.split('.', 1)
+            setattr(TUNABLE_CLASSES[class_name], attribute, value)
+        else:
+            setting_overrides[name] = value
+    return replace(settings, **setting_overrides)
+
+def is_threatened(maze, x: int, y: int):
+    # Whether an enemy could step onto (x, y) next tick
+    for walker in maze.tile_index.tiles_in_rect(x - 1, y - 1, x + 1, y + 1):
+        if type(walker) in Player.KILLED_BY_WALKERS:
+            return True
+    return False
+
+class FinishSeekingBot:
+    # Heads for the nearest finish tile, only stepping next to an enemy if there is no
+    # other way. Chasers wait at the ends of passages, so after waiting PATIENCE ticks
+    # for the way to clear it risks it anyway, until it is somewhere safe again
+    PATIENCE = 8
+
+    def __init__(self, engine):
+        self.engine = engine
+        terrain = engine.maze.terrain
+        self.finish_field = NearestDistanceField(terrain, list(terrain.find_flags(FINISH)),
+            terrain.width * terrain.height, Player.WALKABLE_TILES, Player.COLLIDES_WITH,
+            ORTHOGONAL_OFFSETS)
+        self.waited = 0
+
+    def choose_direction(self):
+        # The safest step, and of the safe ones the one closest to a finish tile.
+        # Standing still is an option too (None)
+        player = self.engine.player
+        maze = self.engine.maze
+        careful = self.waited < self.PATIENCE
+        here = self.finish_field.get(player.x, player.y)
+        if here is None:
+            here = float('inf')
+        options = [(careful and is_threatened(maze, player.x, player.y), here,
+            len(Direction), None)]
+        for direction in Direction:
+            dx, dy = Direction.offset(direction)
+            new_x = player.x + dx
+            new_y = player.y + dy
+            distance = self.finish_field.get(new_x, new_y)
+            if distance is None or not player.can_walk_to(new_x, new_y, maze) or \
+                player.check_if_dead(new_x, new_y, maze):
+                continue
+            options.append((careful and is_threatened(maze, new_x, new_y), distance,
+                direction.value, direction))
+        _, distance, _, direction = min(options)
+        if distance >= here:
+            self.waited += 1
+        elif careful:
+            self.waited = 0
+        else:
+            dx, dy = Direction.offset(direction)
+            if not is_threatened(maze, player.x + dx, player.y + dy):
+                self.waited = 0
+        return direction
+
+def death_cause(engine, direction: Direction):
+    # Number in DEATH_CAUSES of what killed the player on the last tick
+    player = engine.player
+    positions = [(player.x, player.y)]
+    if direction is not None:
+        dx, dy = Direction.offset(direction)
+        positions.append((player.x + dx, player.y + dy))
+    for x, y in positions:
+        for walker in engine.maze.tile_index.tiles_at(x, y):
+            if type(walker) in Player.KILLED_BY_WALKERS:
+                return DEATH_CAUSES.index(type(walker).__name__)
+    for x, y in positions:
+        if engine.maze.terrain.get(x, y) & Player.KILLED_BY:
+            return DEATH_CAUSES.index('death tile')
+    return 0
+
+def play_round(task):
+    # Run in a worker process. task is (configuration number, seed, settings, overrides),
+    # returns the packed ROUND_RECORD
+    configuration_number, seed, settings, overrides = task
+    settings = apply_overrides(settings, overrides)
+    start_x, start_y, maze = generate_maze(settings, seed)
+    # No tick budget, so rounds don't depend on how busy the machine is
+    engine = MazeEngine(maze, start_x, start_y, tick_budget=None)
+    bot = FinishSeekingBot(engine)
+
+    direction = None
+    for _ in range(MAX_ROUND_TICKS):
+        direction = bot.choose_direction()
+        engine.tick(direction)
+        if engine.finished:
+            break
+
+    if engine.outcome is None:
+        outcome = TIMED_OUT
+    else:
+        outcome = engine.outcome.value
+    cause = death_cause(engine, direction) if engine.outcome == Outcome.LOSE else 0
+    score = 0
+    if engine.outcome == Outcome.WIN:
+        score = round_score(engine.move_count, maze.par)
+    return ROUND_RECORD.pack(configuration_number, seed, outcome, cause, engine.move_count,
+        score)
+
+def configurations_from(set_options: list):
+    # Every combination of the NAME=VALUE,VALUE,... options, as dicts of overrides
+    names = []
+    value_lists = []
+    for option in set_options:
+        name, values = option.split('=', 1)
+        names.append(name)
+        value_lists.append([parse_value(name, value) for value in values.split(',')])
+    return [dict(zip(names, values)) for values in itertools.product(*value_lists)]
+
+def parse_value(name: str, text: str):
+    # Values have the type of whatever they replace
+    if '.' in name:
+        class_name, attribute = name.split('.', 1)
+        current = getattr(TUNABLE_CLASSES[class_name], attribute)
+    else:
+        current = getattr(GenerationSettings(), name)
+    return type(current)(text)
+
+def run_farm(settings: GenerationSettings, configurations: list, seeds: range, path: str,
+    workers: int = None, progress_file=sys.stderr):
+    # Plays every seed with every configuration, writing each round to path as it finishes.
+    # Returns the records as tuples
+    tasks = [(number, seed, settings, overrides)
+        for number, overrides in enumerate(configurations) for seed in seeds]
+    metadata = json.dumps({'configurations': configurations,
+        'death_causes': DEATH_CAUSES}).encode()
+    records = []
+    start_time = time.perf_counter()
+    with open(path, 'wb') as file, multiprocessing.Pool(workers) as pool:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(metadata)) + metadata)
+        for record in pool.imap_unordered(play_round, tasks, CHUNK_SIZE):
+            file.write(record)
+            records.append(ROUND_RECORD.unpack(record))
+            if len(records) % 100 == 0:
+                file.flush()
+                elapsed = time.perf_counter() - start_time
+                print(f'{len(records)}/{len(tasks)} rounds, {len(records) / elapsed:.1f}/s',
+                    file=progress_file, flush=True)
+    return records
+
+def load_results(path: str):
+    # Returns (metadata, list of record tuples). A record cut short at the end is ignored
+    with open(path, 'rb') as file:
+        data = file.read()
+    magic, version, metadata_length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a bot farm results file, or from an incompatible version')
+    metadata = json.loads(data[HEADER.size:HEADER.size + metadata_length])
+    start = HEADER.size + metadata_length
+    whole_records = (len(data) - start) // ROUND_RECORD.size
+    records = [ROUND_RECORD.unpack_from(data, start + idx * ROUND_RECORD.size)
+        for idx in range(whole_records)]
+    return metadata, records
+
+def summarise(configurations: list, records: list):
+    # A line of statistics for each configuration
+    lines = []
+    for number, overrides in enumerate(configurations):
+        rounds = [record for record in records if record[0] == number]
+        if len(rounds) == 0:
+            continue
+        wins = [record for record in rounds if record[2] == Outcome.WIN.value]
+        timeouts = sum(1 for record in rounds if record[2] == TIMED_OUT)
+        causes = {}
+        for record in rounds:
+            if record[2] == Outcome.LOSE.value:
+                causes[DEATH_CAUSES[record[3]]] = causes.get(DEATH_CAUSES[record[3]], 0) + 1
+        name = ', '.join(f'{key}={value}' for key, value in overrides.items()) or 'defaults'
+        line = f'{name}: {len(rounds)} rounds, won {len(wins) / len(rounds):.1%}'
+        if wins:
+            line += f', mean {sum(record[4] for record in wins) / len(wins):.0f} moves' + \
+                f' and score {sum(record[5] for record in wins) / len(wins):.0f} when won'
+        if timeouts:
+            line += f', {timeouts} timed out'
+        if causes:
+            line += ', deaths: ' + ', '.join(f'{cause} {count}'
+                for cause, count in sorted(causes.items(), key=lambda item: -item[1]))
+        lines.append(line)
+    return lines
+
+def main():
+    setting_names = ', '.join(field.name for field in fields(GenerationSettings))
+    parser = argparse.ArgumentParser(description='Play lots of mazes with a bot',
+        epilog=f'Settings that can be changed with --set: {setting_names}, ' +
+            'and constants of ' + ', '.join(TUNABLE_CLASSES) + ' (eg. ChasingEnemy.MOVEMENT_CHANCE)')
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS,
+        help='rounds to play with each configuration (default: %(default)s)')
+    parser.add_argument('--first-seed', type=int, default=0,
+        help='seed of the first maze, the rest follow on from it (default: %(default)s)')
+    parser.add_argument('--width', type=int, default=GenerationSettings().max_x)
+    parser.add_argument('--height', type=int, default=GenerationSettings().max_y)
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE,...',
+        help='values to try for a setting or constant, can be given more than once')
+    parser.add_argument('--workers', type=int,
+        help='worker processes (default: one per CPU)')
+    parser.add_argument('--output', default=DEFAULT_RESULTS_PATH,
+        help='file to write results to (default: %(default)s)')
+    args = parser.parse_args()
+
+    settings = GenerationSettings().scaled_to(args.width, args.height)
+    configurations = configurations_from(args.set)
+    seeds = range(args.first_seed, args.first_seed + args.rounds)
+    start_time = time.perf_counter()
+    records = run_farm(settings, configurations, seeds, args.output, args.workers)
+    print(f'{len(records)} rounds in {time.perf_counter() - start_time:.1f}s')
+    for line in summarise(configurations, records):
+        print(line)
+
+if __name__ == '__main__':
+    main()
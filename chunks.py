@@ -0,0 +1,214 @@
+# An endless world, split into fixed size chunks that are generated from a seed
+# as the player gets near them and thrown away again when they are far behind.
+# A chunk always generates the same way, so it comes back identical if revisited
+
+import random
+from collections import OrderedDict
+
+from tiles import *
+from terrain import *
+from maze import Maze
+from maze_generation import *
+
+CHUNK_WIDTH = 128
+CHUNK_HEIGHT = 64
+
+# Chunks within this distance of the player are kept loaded
+# (enough to cover the largest view distance)
+LOAD_MARGIN_X = 120
+LOAD_MARGIN_Y = 60
+
+# Least recently used chunks beyond this many are evicted
+MAX_LOADED_CHUNKS = 16
+
+def chunk_generation_settings(settings: GenerationSettings = None):
+    # Settings for generating a single chunk, with rooms kept clear of the edges
+    # so that nothing spills into the neighbouring chunks
+    if settings is None:
+        settings = GenerationSettings()
+    chunk_settings = settings.scaled_to(CHUNK_WIDTH, CHUNK_HEIGHT)
+    chunk_settings.max_x = CHUNK_WIDTH - settings.max_room_size - 2
+    chunk_settings.max_y = CHUNK_HEIGHT - settings.max_room_size // 2 - 2
+    return chunk_settings
+
+def chunk_seed(world_seed, chunk_x: int, chunk_y: int):
+    # Seeding with a string hashes it, so this is stable between runs
+    return f'{world_seed}:{chunk_x}:{chunk_y}'
+
+class Chunk:
+    def __init__(self, terrain: Terrain, rooms: list, room_index: RoomIndex, walkers: list,
+        reachable_rooms: list = None):
+        self.terrain = terrain
+        # Rooms are in world coordinates, unlike the terrain
+        self.rooms = rooms
+        self.room_index = room_index
+        # Rooms joined to the neighbouring chunks (and so to the rest of the world)
+        self.reachable_rooms = reachable_rooms if reachable_rooms is not None else rooms
+        # Only used the first time the chunk is loaded,
+        # after that the enemies come from its summary
+        self.walkers = walkers
+
+def generate_chunk(world_seed, chunk_x: int, chunk_y: int, settings: GenerationSettings):
+    rng = random.Random(chunk_seed(world_seed, chunk_x, chunk_y))
+    rooms, room_index = generate_rooms(settings, rng)
+    terrain = generate_terrain(rooms, CHUNK_WIDTH, CHUNK_HEIGHT)
+    components = generate_passages(terrain, rooms, room_index, settings, rng)
+    # Only the biggest group of joined rooms is connected to the neighbours,
+    # so every chunk's group is reachable from every other's
+    reachable_rooms = [rooms[number] for number in components.largest_group()]
+    generate_chunk_connections(terrain, reachable_rooms)
+    generate_finish_tiles(terrain, reachable_rooms, settings, rng, len(rooms))
+    # The world starts in chunk (0, 0), so no death tile or enemy is put on the start
+    keep_clear = []
+    if chunk_x == 0 and chunk_y == 0:
+        keep_clear.append(endless_start_point(world_seed, reachable_rooms))
+    generate_death_tiles(terrain, rooms, settings, rng, keep_clear)
+    walkers = generate_enemies(rooms, settings, rng, keep_clear)
+
+    # Generation works in chunk coordinates, move the enemies and rooms into world coordinates
+    for walker in walkers:
+        walker.x += chunk_x * CHUNK_WIDTH
+        walker.y += chunk_y * CHUNK_HEIGHT
+    room_index = RoomIndex(room_index.bucket_size)
+    for room in rooms:
+        room.x += chunk_x * CHUNK_WIDTH
+        room.y += chunk_y * CHUNK_HEIGHT
+        room_index.add_room(room)
+    return Chunk(terrain, rooms, room_index, walkers, reachable_rooms)
+
+def endless_start_point(world_seed, first_chunk_rooms: list):
+    # Start in the middle of one of the reachable rooms of chunk (0, 0),
+    # where chunk and world coordinates are the same
+    return generate_start_point(first_chunk_rooms, random.Random(world_seed))
+
+def generate_chunk_connections(terrain: Terrain, rooms: list):
+    # Join the chunk to its neighbours by running a passage from the room nearest
+    # to the middle of each edge out to that point.
+    # The neighbour does the same from its side, so the two passages meet
+    if len(rooms) == 0:
+        return
+    edge_midpoints = [
+        (0, CHUNK_HEIGHT // 2),
+        (CHUNK_WIDTH - 1, CHUNK_HEIGHT // 2),
+        (CHUNK_WIDTH // 2, 0),
+        (CHUNK_WIDTH // 2, CHUNK_HEIGHT - 1)
+    ]
+    for edge_x, edge_y in edge_midpoints:
+        room = min(rooms, key=lambda room: distance_squared(room.center_x, room.center_y,
+            edge_x, edge_y))
+        if edge_x in (0, CHUNK_WIDTH - 1):
+            # Line up with the midpoint vertically, then head across to the edge
+            carve_passage_line(terrain, room.center_x, room.center_y, room.center_x, edge_y)
+            carve_passage_line(terrain, room.center_x, edge_y, edge_x, edge_y)
+        else:
+            carve_passage_line(terrain, room.center_x, room.center_y, edge_x, room.center_y)
+            carve_passage_line(terrain, edge_x, room.center_y, edge_x, edge_y)
+
+def carve_passage_line(terrain: Terrain, x1: int, y1: int, x2: int, y2: int):
+    # Passage along a horizontal or vertical line, including both ends
+    if x1 == x2:
+        for y in range(min(y1, y2), max(y1, y2) + 1):
+            terrain.add_flags(x1, y, PASSAGE | PASSAGE_VERTICAL)
+    else:
+        for x in range(min(x1, x2), max(x1, x2) + 1):
+            terrain.add_flags(x, y1, PASSAGE)
+
+class ChunkedTerrain:
+    # Looks like a Terrain to everything else, but is made of the currently loaded chunks.
+    # Cells in chunks that aren't loaded read as solid wall
+
+    def __init__(self):
+        self.chunks = OrderedDict()
+
+    def get(self, x: int, y: int):
+        chunk = self.chunks.get((x // CHUNK_WIDTH, y // CHUNK_HEIGHT))
+        if chunk is None:
+            return 0
+        return chunk.terrain.get(x % CHUNK_WIDTH, y % CHUNK_HEIGHT)
+
+    def run_through(self, x: int, y: int, vertical: bool, table: bytes):
+        # Rooms are kept clear of the chunk edges, so runs never carry on into a neighbour
+        chunk = self.chunks.get((x // CHUNK_WIDTH, y // CHUNK_HEIGHT))
+        if chunk is None:
+            return None
+        run = chunk.terrain.run_through(x % CHUNK_WIDTH, y % CHUNK_HEIGHT, vertical, table)
+        if run is None:
+            return None
+        origin = (y // CHUNK_HEIGHT) * CHUNK_HEIGHT if vertical else \
+            (x // CHUNK_WIDTH) * CHUNK_WIDTH
+        return (origin + run[0], origin + run[1])
+
+class EndlessMaze(Maze):
+    def __init__(self, world_seed, settings: GenerationSettings = None,
+        max_loaded_chunks: int = MAX_LOADED_CHUNKS):
+        super().__init__(ChunkedTerrain(), [], world_seed)
+        self.settings = chunk_generation_settings(settings)
+        self.max_loaded_chunks = max_loaded_chunks
+        # Enemies of evicted chunks, stored as a flat array of
+        # (type number, x, y, direction number) so they take up little space
+        self.enemy_summaries = {}
+
+    @property
+    def chunks(self):
+        return self.terrain.chunks
+
+    def room_at(self, x: int, y: int):
+        chunk = self.chunks.get((x // CHUNK_WIDTH, y // CHUNK_HEIGHT))
+        if chunk is None:
+            return None
+        return chunk.room_index.room_at(x, y)
+
+    def load_around(self, x: int, y: int):
+        needed_chunks = []
+        for chunk_y in range((y - LOAD_MARGIN_Y) // CHUNK_HEIGHT,
+            (y + LOAD_MARGIN_Y) // CHUNK_HEIGHT + 1):
+            for chunk_x in range((x - LOAD_MARGIN_X) // CHUNK_WIDTH,
+                (x + LOAD_MARGIN_X) // CHUNK_WIDTH + 1):
+                needed_chunks.append((chunk_x, chunk_y))
+
+        for chunk_position in needed_chunks:
+            if chunk_position in self.chunks:
+                self.chunks.move_to_end(chunk_position)
+            else:
+                self.__load_chunk(*chunk_position)
+
+        # Evict from the least recently needed end, but never what is needed now
+        for chunk_position in list(self.chunks):
+            if len(self.chunks) <= max(self.max_loaded_chunks, len(needed_chunks)):
+                break
+            if chunk_position not in needed_chunks:
+                self.__evict_chunk(*chunk_position)
+
+    def __load_chunk(self, chunk_x: int, chunk_y: int):
+        chunk = generate_chunk(self.seed, chunk_x, chunk_y, self.settings)
+        self.chunks[(chunk_x, chunk_y)] = chunk
+        self.terrain_version += 1
+
+        summary = self.enemy_summaries.pop((chunk_x, chunk_y), None)
+        if summary is None:
+            walkers = chunk.walkers
+        else:
+            walkers = unpack_enemies(summary)
+        chunk.walkers = None
+        for walker in walkers:
+            self.add_walker(walker)
+
+    def __evict_chunk(self, chunk_x: int, chunk_y: int):
+        del self.chunks[(chunk_x, chunk_y)]
+        self.terrain_version += 1
+        evicted = [walker for walker in self.walkers
+            if walker.x // CHUNK_WIDTH == chunk_x and walker.y // CHUNK_HEIGHT == chunk_y and
+            type(walker) in ENEMY_TYPES]
+        for walker in evicted:
+            self.remove_walker(walker)
+        self.enemy_summaries[(chunk_x, chunk_y)] = pack_enemies(evicted)
+
+def generate_endless_maze(world_seed=None, settings: GenerationSettings = None):
+    if world_seed is None:
+        world_seed = new_seed()
+    maze = EndlessMaze(world_seed, settings)
+
+    first_chunk = generate_chunk(world_seed, 0, 0, maze.settings)
+    start_x, start_y = endless_start_point(world_seed, first_chunk.reachable_rooms)
+    maze.load_around(start_x, start_y)
+    return start_x, start_y, maze
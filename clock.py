@@ -0,0 +1,49 @@
+# Timing for the real-time game loop.
+# The simulation runs at a fixed number of ticks per second whatever the frame rate is:
+# real time is added up, and every whole tick's worth of it is one tick to run
+
+import time
+
+TICK_RATE = 8
+FRAME_RATE = 30
+# If the game falls further behind than this many ticks (eg. a slow tick or the
+# process being suspended), the extra ticks are dropped instead of being caught up on
+MAX_TICKS_PER_FRAME = 4
+
+class FixedTimestep:
+    def __init__(self, tick_rate: float = TICK_RATE,
+        max_ticks_per_frame: int = MAX_TICKS_PER_FRAME, clock=time.perf_counter):
+        self.tick_seconds = 1 / tick_rate
+        self.max_ticks_per_frame = max_ticks_per_frame
+        self.clock = clock
+        # Total ticks skipped because the game fell behind
+        self.dropped_ticks = 0
+        self.reset()
+
+    def reset(self):
+        # Start counting from now, forgetting any time already built up
+        self.last_time = self.clock()
+        self.accumulated = 0
+
+    def due_ticks(self):
+        # Number of ticks to run now
+        now = self.clock()
+        self.accumulated += now - self.last_time
+        self.last_time = now
+
+        ticks = int(self.accumulated // self.tick_seconds)
+        self.accumulated -= ticks * self.tick_seconds
+        if ticks > self.max_ticks_per_frame:
+            self.dropped_ticks += ticks - self.max_ticks_per_frame
+            ticks = self.max_ticks_per_frame
+        return ticks
+
+    def seconds_until_next_tick(self):
+        elapsed = self.accumulated + self.clock() - self.last_time
+        return max(self.tick_seconds - elapsed, 0)
+
+def sleep_until(deadline: float, clock=time.perf_counter):
+    # Sleep until clock() reaches deadline (returns straight away if it already has)
+    remaining = deadline - clock()
+    if remaining > 0:
+        time.sleep(remaining)
@@ -0,0 +1,191 @@
+import random
+import time
+from enum import Enum, unique
+
+from tiles import *
+from misc import *
+from pathfinding import DistanceField
+from fov import FieldOfView, SeenMap
+from scheduler import TickScheduler, TICK_BUDGET_SECONDS
+from maze_generation import GenerationSettings, generate_maze
+from chunks import generate_endless_maze
+from maze_cache import load_or_generate_maze
+from replay import ReplayRecorder
+
+@unique
+class Outcome(Enum):
+    WIN = 0
+    LOSE = 1
+    QUIT = 2
+
+# Moving enemies this close to the player are always awake (see PatrolSwarm), however short
+# the view distance, as ones on their tracks can't block or kill it
+MIN_WAKE_DISTANCE = 3
+
+# Score for a win in par moves (see Maze.par)
+PERFECT_SCORE = 1712
+
+def round_score(move_count: int, par: int = None):
+    # Score for winning a round in move_count moves. It goes by how close to par
+    # the round was, so that a big maze is worth as much as a small one.
+    # Mazes without a par fall back to counting down from 500 moves
+    if par is None:
+        return int(max(500 - move_count, 0) * 3.4253)
+    return PERFECT_SCORE * (par + 1) // (max(move_count, par) + 1)
+
+class MazeEngine:
+    # Runs a round of the game without any terminal attached.
+    # Each call to tick() is one turn: enemies move (see TickScheduler), then the player does.
+    # Anything that needs to draw the round reads maze, player and move_count.
+    # Turns with no direction count as moves unless count_idle_turns is False, which is for
+    # real-time play, where a turn goes by whether or not a key was pressed
+
+    def __init__(self, maze, start_x: int, start_y: int, view_distance: int = 20,
+        tick_budget: float = TICK_BUDGET_SECONDS, count_idle_turns: bool = True):
+        self.maze = maze
+        self.player = Player(start_x, start_y)
+        self.maze.add_walker(self.player)
+        self.scheduler = TickScheduler(maze, view_distance, tick_budget=tick_budget)
+        # Enemies draw from this rather than the global random,
+        # so that a round on the same maze with the same input always goes the same way
+        self.rng = random.Random(f'{maze.seed}:enemies')
+        # If set, a ReplayRecorder that every tick is recorded to
+        self.recorder = None
+        # What the player can see and has seen. Only kept up to date by update_seen(),
+        # which frontends that draw the round call after each tick
+        self.fov = FieldOfView(maze)
+        self.seen = SeenMap()
+        self.__seen_from = None
+        self.move_count = 0
+        self.count_idle_turns = count_idle_turns
+        self.outcome = None
+        self.last_move_blocked = False
+        # Shared path to the player for every chasing enemy,
+        # only rebuilt when the player has moved
+        self.chase_field = None
+        # How many enemies were updated in the last tick, and how long
+        # the enemy and player updates of the last tick took
+        self.enemies_updated = 0
+        self.enemy_update_seconds = 0
+        self.player_update_seconds = 0
+        self.wake_patrollers()
+
+    @property
+    def view_distance(self):
+        # Enemies within this distance of the player are updated every tick
+        return self.scheduler.near_distance
+
+    @view_distance.setter
+    def view_distance(self, view_distance: int):
+        self.scheduler.near_distance = view_distance
+        self.wake_patrollers()
+        if self.recorder is not None:
+            self.recorder.record_view_distance(view_distance)
+
+    @property
+    def finished(self):
+        return self.outcome is not None
+
+    def tick(self, direction: Direction = None):
+        # Advance the round by one turn, with the player trying to step in direction
+        # (or standing still if it is None)
+        start_time = time.perf_counter()
+        self.update_enemies()
+        enemies_done_time = time.perf_counter()
+        self.last_move_blocked = not self.player.player_update(direction, self.maze)
+        self.enemy_update_seconds = enemies_done_time - start_time
+        self.player_update_seconds = time.perf_counter() - enemies_done_time
+        if self.recorder is not None:
+            self.recorder.record_tick(direction, self.scheduler.last_room_cutoff)
+        self.maze.load_around(self.player.x, self.player.y)
+        self.wake_patrollers()
+
+        if not self.player.alive:
+            self.outcome = Outcome.LOSE
+        elif self.player.finished:
+            self.outcome = Outcome.WIN
+        elif direction is not None or self.count_idle_turns:
+            self.move_count += 1
+        if self.finished and self.recorder is not None:
+            self.recorder.record_ending(self)
+
+    def run(self, directions):
+        # Play a scripted list of moves, stopping early if the round ends
+        for direction in directions:
+            if self.finished:
+                break
+            self.tick(direction)
+        return self.outcome
+
+    def quit(self):
+        self.outcome = Outcome.QUIT
+        if self.recorder is not None:
+            self.recorder.record_ending(self)
+
+    def update_enemies(self):
+        # Moving enemies due this tick are collected and then stepped as one batch
+        self.__patrol_batch = []
+        self.enemies_updated = self.scheduler.tick(self.player, self.__update_enemy)
+        self.maze.patrollers.step(self.maze, [enemy.slot for enemy in self.__patrol_batch])
+        # Moving enemies on their tracks have moved on a tick too
+        self.maze.patrollers.clock += 1
+
+    def wake_patrollers(self):
+        # Moving enemies are only awake (see PatrolSwarm) within the near tier of the scheduler,
+        # which is as far as the player can see too
+        self.maze.patrollers.update_awake(self.maze, self.player.x, self.player.y,
+            max(self.view_distance, MIN_WAKE_DISTANCE))
+
+    def __update_enemy(self, enemy):
+        if type(enemy) == MovingEnemy:
+            self.__patrol_batch.append(enemy)
+            return
+        if type(enemy) == ChasingEnemy:
+            self.update_chase_field()
+            # Moving enemies on their track don't get out of its way (see PatrolSwarm)
+            self.maze.patrollers.wake_around(self.maze, enemy.x, enemy.y)
+        enemy.update(None, self.maze, self.player, self.chase_field, self.rng)
+
+    def visible_offsets(self):
+        # (dx, dy) from the player of every cell the player can see
+        return self.fov.visible_offsets(self.player.x, self.player.y, self.view_distance)
+
+    def update_seen(self):
+        # Marks what the player can see as seen (only worked out again if something changed)
+        seen_from = (self.player.x, self.player.y, self.view_distance, self.maze.terrain_version)
+        if seen_from != self.__seen_from:
+            self.seen.mark_offsets(self.player.x, self.player.y, self.visible_offsets())
+            self.__seen_from = seen_from
+
+    def update_chase_field(self):
+        player = self.player
+        if self.chase_field is not None and \
+            (self.chase_field.origin_x, self.chase_field.origin_y) == (player.x, player.y):
+            return
+        self.chase_field = DistanceField(self.maze.terrain, player.x, player.y,
+            ChasingEnemy.PLAYER_DETECTION_DIST, ChasingEnemy.WALKABLE_TILES,
+            ChasingEnemy.COLLIDES_WITH)
+
+def new_engine(view_distance: int = 20, settings: GenerationSettings = None,
+    endless: bool = False, seed: int = None, pregenerator=None, count_idle_turns: bool = True):
+    # Mazes from a chosen seed are cached on disk, so they start instantly next time.
+    # Random mazes come from pregenerator (a MazePregenerator made with the same settings)
+    # if one is given
+    if endless:
+        start_x, start_y, maze = generate_endless_maze(seed, settings)
+    elif seed is not None:
+        start_x, start_y, maze = load_or_generate_maze(seed, settings)
+    elif pregenerator is not None:
+        start_x, start_y, maze = pregenerator.take()
+    else:
+        start_x, start_y, maze = generate_maze(settings)
+    return engine_for_maze(start_x, start_y, maze, view_distance, settings, endless,
+        count_idle_turns)
+
+def engine_for_maze(start_x: int, start_y: int, maze, view_distance: int = 20,
+    settings: GenerationSettings = None, endless: bool = False, count_idle_turns: bool = True):
+    # For a maze that has already been made with settings
+    engine = MazeEngine(maze, start_x, start_y, view_distance, count_idle_turns=count_idle_turns)
+    engine.recorder = ReplayRecorder(maze.seed, settings, endless, view_distance,
+        count_idle_turns)
+    return engine
@@ -0,0 +1,161 @@
+# What the player can see, and what they have seen before.
+# Sight is worked out with recursive shadowcasting: each of the 8 octants around the
+# viewer is scanned row by row moving outwards, and walls cast shadows (ranges of slopes)
+# that cells in later rows are hidden by.
+# Like the view circle (see misc.view_circle_offsets), x distances count half,
+# as characters are twice as tall as they are wide
+
+from collections import OrderedDict
+
+from terrain import *
+
+# Cells that can be seen through
+TRANSPARENT_TILES = FLOOR | PASSAGE
+
+# (xx, xy, yx, yy) of each octant: a cell at (column, row) in the octant is at
+# (column * xx + row * xy, column * yx + row * yy) from the viewer
+OCTANT_TRANSFORMS = [
+    (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+    (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1)
+]
+
+def compute_fov(terrain, origin_x: int, origin_y: int, radius: int):
+    # Tuple of the (dx, dy) of every cell visible from the origin within radius,
+    # including the walls that stop the view
+    visible = {(0, 0)}
+    get_flags = terrain.get
+    radius_squared = radius ** 2
+    for xx, xy, yx, yy in OCTANT_TRANSFORMS:
+        # Rows running along x can go twice as far
+        max_row = radius * 2 if xy != 0 else radius
+        cast_light(get_flags, origin_x, origin_y, 1, 1.0, 0.0, max_row, radius_squared,
+            xx, xy, yx, yy, visible)
+    return tuple(visible)
+
+def cast_light(get_flags, origin_x: int, origin_y: int, row: int, start_slope: float,
+    end_slope: float, max_row: int, radius_squared: int, xx: int, xy: int, yx: int, yy: int,
+    visible: set):
+    # Light the part of an octant between start_slope and end_slope, from row onwards
+    if start_slope < end_slope:
+        return
+    next_start_slope = start_slope
+    for distance in range(row, max_row + 1):
+        blocked = False
+        delta_y = -distance
+        for delta_x in range(-distance, 1):
+            left_slope = (delta_x - 0.5) / (delta_y + 0.5)
+            right_slope = (delta_x + 0.5) / (delta_y - 0.5)
+            if start_slope < right_slope:
+                continue
+            if end_slope > left_slope:
+                break
+
+            dx = delta_x * xx + delta_y * xy
+            dy = delta_x * yx + delta_y * yy
+            if (dx / 2) ** 2 + dy ** 2 < radius_squared:
+                visible.add((dx, dy))
+
+            opaque = not get_flags(origin_x + dx, origin_y + dy) & TRANSPARENT_TILES
+            if blocked:
+                if opaque:
+                    next_start_slope = right_slope
+                else:
+                    blocked = False
+                    start_slope = next_start_slope
+            elif opaque and distance < max_row:
+                # This wall starts a shadow, light what is beside it further out first
+                blocked = True
+                cast_light(get_flags, origin_x, origin_y, distance + 1, start_slope,
+                    left_slope, max_row, radius_squared, xx, xy, yx, yy, visible)
+                next_start_slope = right_slope
+        if blocked:
+            break
+
+class FieldOfView:
+    # Caches compute_fov() results by position and radius.
+    # Walkers don't block sight, so the cache only needs clearing when the terrain
+    # changes, which the maze reports by changing its terrain_version
+    MAX_CACHED = 256
+
+    def __init__(self, maze):
+        self.maze = maze
+        self.cache = OrderedDict()
+        self.terrain_version = maze.terrain_version
+
+    def visible_offsets(self, x: int, y: int, radius: int):
+        if self.maze.terrain_version != self.terrain_version:
+            self.cache.clear()
+            self.terrain_version = self.maze.terrain_version
+        key = (x, y, radius)
+        offsets = self.cache.get(key)
+        if offsets is None:
+            offsets = compute_fov(self.maze.terrain, x, y, radius)
+            self.cache[key] = offsets
+            if len(self.cache) > self.MAX_CACHED:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+        return offsets
+
+class SeenMap:
+    # One byte for each cell the player has seen (1) or not (0),
+    # in square blocks that are only made once something in them is seen,
+    # so it works the same for fixed size and endless mazes
+    BLOCK_SIZE = 64
+
+    def __init__(self):
+        self.blocks = {}
+        # If set to a list, (x, y) of each cell seen for the first time is added to it
+        # (eg. for the minimap to take)
+        self.new_cells = None
+
+    def mark_offsets(self, x: int, y: int, offsets):
+        # Mark every (x + dx, y + dy) as seen
+        block_size = self.BLOCK_SIZE
+        blocks = self.blocks
+        new_cells = self.new_cells
+        for dx, dy in offsets:
+            cell_x = x + dx
+            cell_y = y + dy
+            block_position = (cell_x // block_size, cell_y // block_size)
+            block = blocks.get(block_position)
+            if block is None:
+                block = blocks[block_position] = bytearray(block_size * block_size)
+            index = (cell_y % block_size) * block_size + cell_x % block_size
+            if new_cells is not None and not block[index]:
+                new_cells.append((cell_x, cell_y))
+            block[index] = 1
+
+    def is_seen(self, x: int, y: int):
+        block = self.blocks.get((x // self.BLOCK_SIZE, y // self.BLOCK_SIZE))
+        if block is None:
+            return False
+        return bool(block[(y % self.BLOCK_SIZE) * self.BLOCK_SIZE + x % self.BLOCK_SIZE])
+
+    def seen_in_row(self, y: int, left: int, right: int):
+        # x of each seen cell on row y with left <= x < right, in order
+        block_size = self.BLOCK_SIZE
+        block_y = y // block_size
+        row_start = (y % block_size) * block_size
+        for block_x in range(left // block_size, (right - 1) // block_size + 1):
+            block = self.blocks.get((block_x, block_y))
+            if block is None:
+                continue
+            first_x = block_x * block_size
+            start = row_start + max(left - first_x, 0)
+            end = row_start + min(right - first_x, block_size)
+            # find() skips through the unseen cells without a Python loop
+            position = block.find(1, start, end)
+            while position != -1:
+                yield first_x + position - row_start
+                position = block.find(1, position + 1, end)
+
+    def seen_cells(self):
+        # (x, y) of every seen cell
+        block_size = self.BLOCK_SIZE
+        for (block_x, block_y), block in self.blocks.items():
+            position = block.find(1)
+            while position != -1:
+                yield (block_x * block_size + position % block_size,
+                    block_y * block_size + position // block_size)
+                position = block.find(1, position + 1)
@@ -1,17 +1,23 @@
 from enum import Enum
 import random
-from time import sleep
-import textwrap
+import struct
+import time
 import curses
 
 from tiles import *
-from maze_generation import generate_maze
-
-@unique
-class Outcome(Enum):
-    WIN = 0
-    LOSE = 1
-    QUIT = 2
+from terrain import *
+from renderer import Renderer, STYLE_DIM
+from terrain_pad import TerrainPad
+from view import *
+from minimap import Minimap
+from engine import Outcome, new_engine, round_score
+from maze_generation import GenerationSettings
+from clock import FixedTimestep, TICK_RATE, FRAME_RATE, sleep_until
+from profiling import FrameProfiler
+from replay import save_replay
+from snapshot import save_snapshot, load_snapshot, remove_snapshot
+from score_manager import ScoreManager, Score
+from pregeneration import MazePregenerator
 
 @unique
 class AfterRoundAction(Enum):
@@ -19,87 +25,344 @@ class AfterRoundAction(Enum):
     QUIT = 1
 
 class TerminalMazeGame:
-    # Pan when this close to a screen edge
-    PAN_TRIGGER_DIST_X = 20
-    PAN_TRIGGER_DIST_Y = 10
-
-    # Move this far each time pan is triggered
-    # (may take multiple frames to move fully)
-    PAN_INCREMENT = 1
+    INITIAL_PAN_FRAME_SECONDS = 0.01
 
     VIEW_DISTANCE = 20
-
-    paused = True
-
-    def __init__(self, stdscr):
+    MIN_VIEW_DISTANCE = 5
+    MAX_VIEW_DISTANCE = 60
+    VIEW_DISTANCE_STEP = 5
+
+    # Rounds are saved every this many moves, so they can be resumed
+    # even if the game didn't get to save when quitting
+    AUTOSAVE_MOVES = 5
+
+    KEYBINDS = {
+        'KEY_UP' : Direction.UP,
+        'w' : Direction.UP,
+        'KEY_DOWN' : Direction.DOWN,
+        's' : Direction.DOWN,
+        'KEY_LEFT' : Direction.LEFT,
+        'a' : Direction.LEFT,
+        'KEY_RIGHT' : Direction.RIGHT,
+        'd' : Direction.RIGHT
+    }
+
+    def __init__(self, stdscr, settings: GenerationSettings = None, endless: bool = False,
+        seed: int = None, realtime: bool = False, tick_rate: float = TICK_RATE,
+        profile_path: str = None, resume: bool = False):
         self.stdscr = stdscr
+        self.settings = settings
+        self.endless = endless
+        # If set, every round is played on the maze from this seed
+        self.seed = seed
+        # In real-time mode enemies move tick_rate times a second whether or not
+        # a key is pressed, otherwise the game waits for a key every turn
+        self.realtime = realtime
+        self.tick_rate = tick_rate
+        # If set, the first round carries on from the saved snapshot (if there is one)
+        self.resume = resume
+        self.timestep = None
+        # Frame timings are always recorded, and shown on screen if show_profile is set.
+        # If profile_path is set, their percentiles are appended to it after each round
+        self.profile_path = profile_path
+        self.show_profile = False
+        # M shows a small map of what has been explored in the top right corner
+        self.show_minimap = False
+        self.profiler = FrameProfiler()
+        self.score_manager = ScoreManager()
+        # Random mazes are generated in the background while playing
+        self.pregenerator = None
+        if not endless and seed is None:
+            self.pregenerator = MazePregenerator(settings)
 
         self.__setup_curses()
 
-        self.player = Player(0, 0)
+        self.view_distance = self.VIEW_DISTANCE
+        self.renderer = Renderer()
+        # Made each round if the maze fits in one (see __make_pad)
+        self.pad = None
+        self.hud_window = None
+        # Remembered terrain to draw the renderer's frames over when there is no pad
+        self.remembered = RememberedLayer()
+        # With a pad the minimap has a window and renderer of its own
+        self.minimap_window = None
+        self.minimap_renderer = Renderer()
     
     def mainloop(self):
-        while True:
-            self.play_round()
-            action = self.__show_outcome()
-            if action == AfterRoundAction.QUIT:
-                break
+        try:
+            while True:
+                self.play_round()
+                action = self.__show_outcome()
+                if action == AfterRoundAction.QUIT:
+                    break
+        finally:
+            if self.pregenerator is not None:
+                self.pregenerator.close()
 
     def play_round(self):
         self.__update_screen_size()
-
-        start_x, start_y, self.maze_tiles = generate_maze()
-        self.player = Player(start_x, start_y)
-        self.maze_tiles.append(self.player)
-        self.outcome = Outcome.QUIT
-        self.move_count = 0
-
-        self.paused = True
+        # The outcome screen was drawn directly, so the renderer's copy is stale
+        self.renderer.invalidate()
+
+        # Endless rounds aren't saved, so there is nothing to carry on with
+        snapshot = self.__take_snapshot() if self.resume and not self.endless else None
+        self.resume = False
+        if snapshot is not None:
+            self.engine, pan_x, pan_y = snapshot
+            self.view_distance = self.engine.view_distance
+        else:
+            # In real time, turns go by without the player doing anything,
+            # which shouldn't count against them
+            self.engine = new_engine(self.view_distance, self.settings, self.endless,
+                self.seed, self.pregenerator, count_idle_turns=not self.realtime)
+        self.maze = self.engine.maze
+        self.player = self.engine.player
+        self.engine.update_seen()
+        self.minimap = Minimap(self.engine, self.endless)
+        self.profiler = FrameProfiler()
+        self.__make_pad()
 
         # Area which is visible to player
         self.lit_area_x = 0
         self.lit_area_y = 0
 
-        self.pan_x = self.player.x + random.randint(-50, 50)
-        self.pan_y = self.player.y + random.randint(-25, 25)
-        self.__initial_pan_to_player()
-
-        self.paused = False
-        while True:
-            self.stdscr.erase()
-            self.__update_screen_size()
-
-            self.__draw_tiles()
-
-            self.__draw_hud()
-            # Update player separately after drawing hud,
-            # as it blocks for input and we don't want that in the middle of the drawing loop
-            try:
-                self.player.player_update(self.stdscr, self.maze_tiles)
-            except KeyboardInterrupt:
-                self.outcome == Outcome.QUIT
-                break
+        if snapshot is not None:
+            self.pan_x = pan_x
+            self.pan_y = pan_y
             self.lit_area_x = self.player.x
             self.lit_area_y = self.player.y
-
-            self.__pan_to_player()
-
-            if not self.player.alive:
-                self.outcome = Outcome.LOSE
+        else:
+            self.pan_x = self.player.x + random.randint(-50, 50)
+            self.pan_y = self.player.y + random.randint(-25, 25)
+            self.__initial_pan_to_player()
+
+        self.profiler.begin_frame()
+        if self.realtime:
+            self.__realtime_loop()
+        else:
+            self.__turn_based_loop()
+
+        try:
+            # A round that has ended can't be resumed, but a quit one can
+            if self.engine.outcome == Outcome.QUIT:
+                self.__save_snapshot()
+            else:
+                remove_snapshot()
+        except (OSError, struct.error):
+            pass
+        try:
+            # Every round is recorded, so it can be played back with replay.py
+            save_replay(self.engine.recorder)
+        except (OSError, struct.error):
+            pass
+
+        if self.profile_path is not None:
+            self.profiler.export(self.profile_path, seed=self.maze.seed,
+                outcome=self.engine.outcome.name, move_count=self.engine.move_count,
+                realtime=self.realtime,
+                dropped_ticks=self.timestep.dropped_ticks if self.realtime else 0)
+
+    def __turn_based_loop(self):
+        while True:
+            self.__draw_frame()
+            # Wait for input after drawing everything, as it blocks
+            key = self.__get_key()
+            if key.lower() == 'q':
+                self.engine.quit()
                 break
-            elif self.player.finished:
-                self.outcome = Outcome.WIN
+            # Changing options doesn't use up a turn
+            if self.__option_keybinds(key):
+                continue
+
+            self.__tick(self.__key_to_direction(key))
+            if self.engine.finished:
                 break
 
-            self.stdscr.refresh()
-            self.move_count += 1
+    def __realtime_loop(self):
+        # Input is read whenever it arrives, ticks run on the fixed timestep
+        # and frames are drawn at FRAME_RATE, each independently of the others
+        self.timestep = FixedTimestep(self.tick_rate)
+        frame_seconds = 1 / FRAME_RATE
+        next_frame_time = time.perf_counter()
+        # Direction for the next tick, the most recently pressed one wins
+        direction = None
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= next_frame_time:
+                    self.__draw_frame()
+                    # A frame that runs late pushes the next one back
+                    # rather than making frames bunch up to catch up
+                    next_frame_time = max(next_frame_time + frame_seconds, now)
+
+                key = self.__poll_key(min(next_frame_time - time.perf_counter(),
+                    self.timestep.seconds_until_next_tick()))
+                if key is not None:
+                    if key.lower() == 'q':
+                        self.engine.quit()
+                        break
+                    if not self.__option_keybinds(key):
+                        direction = self.__key_to_direction(key) or direction
+
+                for _ in range(self.timestep.due_ticks()):
+                    self.__tick(direction)
+                    direction = None
+                    if self.engine.finished:
+                        return
+        finally:
+            self.stdscr.timeout(-1)
+
+    def __draw_frame(self, line_of_sight: bool = True, show_hud: bool = True):
+        # Everything since the last frame (including ticks) counts towards this one.
+        # The map is drawn into the terrain pad if there is one, else with the renderer
+        self.__update_screen_size()
+        if self.pad is not None and \
+            self.pad_screen_size != (self.screen_width, self.screen_height):
+            self.__make_pad()
+
+        with self.profiler.timed('tiles'):
+            if self.pad is not None:
+                self.pad.begin_frame()
+                self.__draw_tiles(line_of_sight)
+                self.pad.end_frame()
+            else:
+                self.renderer.begin_frame(self.screen_width, self.screen_height,
+                    self.remembered.update(self.engine, self.pan_x, self.pan_y,
+                    self.screen_width, self.screen_height))
+                self.__draw_tiles(line_of_sight)
+        with self.profiler.timed('minimap'):
+            self.minimap.update()
+            minimap_size = None
+            if self.show_minimap and show_hud:
+                minimap_size = self.minimap.size(self.screen_width, self.screen_height)
+            if self.pad is None and minimap_size is not None:
+                self.minimap.draw(self.renderer, self.screen_width - minimap_size[0], 0,
+                    self.screen_width, self.screen_height)
+        with self.profiler.timed('hud'):
+            hud_lines = self.__hud_lines() if show_hud else []
+            if self.pad is None:
+                for idx, line in enumerate(hud_lines):
+                    self.renderer.put_string(0, self.screen_height - (len(hud_lines) - idx),
+                        line, 0)
+        with self.profiler.timed('refresh'):
+            if self.pad is not None:
+                self.__show_pad(hud_lines, minimap_size)
+            else:
+                self.renderer.flush(self.stdscr)
+                self.stdscr.refresh()
+        self.profiler.end_frame()
+        self.profiler.begin_frame()
+
+    def __make_pad(self):
+        # A terrain pad for the round if the maze isn't too big for one
+        # (see TerrainPad), with room to pan a screen past each edge of the map
+        self.pad = None
+        self.hud_window = None
+        self.pad_screen_size = (self.screen_width, self.screen_height)
+        if self.endless:
+            return
+        terrain = self.maze.terrain
+        if not TerrainPad.fits(terrain.width, terrain.height, self.screen_width,
+            self.screen_height):
+            return
+        self.pad = TerrainPad(terrain.width, terrain.height, self.screen_width,
+            self.screen_height, self.__remembered_appearance, self.engine.seen.seen_cells())
+
+    def __remembered_appearance(self, x: int, y: int):
+        if not self.engine.seen.is_seen(x, y):
+            return None
+        appearance = cell_appearance(self.maze.terrain.get(x, y))
+        if appearance is None:
+            return None
+        char, color_pair_number = appearance
+        return (char, color_pair_number | STYLE_DIM)
+
+    def __show_pad(self, hud_lines: list, minimap_size: tuple):
+        # The map fills the screen above the HUD, which has a window of its own,
+        # and the minimap has one over the top right of the map.
+        # On a screen too short for all of the HUD, its first lines are left off
+        # (as the renderer does) so that at least a line of the map shows
+        hud_lines = hud_lines[max(len(hud_lines) - (self.screen_height - 1), 0):]
+        map_height = self.screen_height - len(hud_lines)
+        if minimap_size is None and self.minimap_window is not None:
+            # The pad only shows the lines of it that changed, which wouldn't
+            # cover up where the minimap was
+            self.pad.touch()
+            self.minimap_window = None
+        self.pad.show(self.pan_x, self.pan_y, 0, self.screen_width, map_height)
+        if minimap_size is not None:
+            self.__show_minimap_window(minimap_size)
+        if len(hud_lines) > 0:
+            if self.hud_window is None or \
+                self.hud_window.getmaxyx() != (len(hud_lines), self.screen_width) or \
+                self.hud_window.getbegyx() != (map_height, 0):
+                self.hud_window = curses.newwin(len(hud_lines), self.screen_width, map_height, 0)
+            self.hud_window.erase()
+            for idx, line in enumerate(hud_lines):
+                try:
+                    self.hud_window.addstr(idx, 0, line)
+                except curses.error:
+                    # A full last line leaves the cursor outside the window
+                    pass
+            self.hud_window.noutrefresh()
+        curses.doupdate()
+
+    def __show_minimap_window(self, minimap_size: tuple):
+        width, height = minimap_size
+        left = self.screen_width - width
+        if self.minimap_window is None or self.minimap_window.getmaxyx() != (height, width) or \
+            self.minimap_window.getbegyx() != (0, left):
+            self.minimap_window = curses.newwin(height, width, 0, left)
+            self.minimap_renderer.invalidate()
+        self.minimap_renderer.begin_frame(width, height)
+        self.minimap.draw(self.minimap_renderer, 0, 0, self.screen_width, self.screen_height)
+        self.minimap_renderer.flush(self.minimap_window)
+        # The pad was just shown under it, so all of it needs showing again
+        self.minimap_window.touchwin()
+        self.minimap_window.noutrefresh()
+
+    def __tick(self, direction: Direction):
+        collision_checks = self.maze.collision_checks
+        self.engine.tick(direction)
+        with self.profiler.timed('fov'):
+            self.engine.update_seen()
+        self.profiler.add_time('enemies', self.engine.enemy_update_seconds)
+        self.profiler.add_time('player', self.engine.player_update_seconds)
+        self.profiler.add_count('ticks')
+        self.profiler.add_count('enemies updated', self.engine.enemies_updated)
+        self.profiler.add_count('collision checks', self.maze.collision_checks - collision_checks)
+        if self.engine.last_move_blocked:
+            curses.beep()
+        self.lit_area_x = self.player.x
+        self.lit_area_y = self.player.y
+        self.__pan_to_player()
+        moved = direction is not None or self.engine.count_idle_turns
+        if moved and not self.engine.finished and \
+            self.engine.move_count % self.AUTOSAVE_MOVES == 0:
+            with self.profiler.timed('snapshot'):
+                try:
+                    self.__save_snapshot()
+                except (OSError, struct.error):
+                    pass
+
+    def __save_snapshot(self):
+        # Endless worlds are too big to save
+        if not self.endless:
+            save_snapshot(self.engine, self.pan_x, self.pan_y)
+
+    def __take_snapshot(self):
+        # (engine, pan_x, pan_y) of the saved round, or None if there isn't one to carry on
+        try:
+            return load_snapshot()
+        except (OSError, ValueError, struct.error):
+            return None
 
     def __setup_curses(self):
         curses.start_color()
-        curses.init_pair(Tile.COLOR_PAIR_NUMBER, curses.COLOR_WHITE, curses.COLOR_BLACK)
-        curses.init_pair(DeathTile.COLOR_PAIR_NUMBER, curses.COLOR_RED, curses.COLOR_WHITE)
+        curses.init_pair(FLOOR_COLOR_PAIR, curses.COLOR_WHITE, curses.COLOR_BLACK)
+        curses.init_pair(DEATH_COLOR_PAIR, curses.COLOR_RED, curses.COLOR_WHITE)
         curses.init_pair(Player.COLOR_PAIR_NUMBER, curses.COLOR_BLUE, curses.COLOR_WHITE)
-        curses.init_pair(FinishTile.COLOR_PAIR_NUMBER, curses.COLOR_GREEN, curses.COLOR_WHITE)
+        curses.init_pair(FINISH_COLOR_PAIR, curses.COLOR_GREEN, curses.COLOR_WHITE)
 
         self.stdscr.keypad(True)
         curses.noecho()
@@ -110,6 +373,7 @@ class TerminalMazeGame:
         target_x = self.player.x - self.screen_width // 2
         target_y = self.player.y - self.screen_height // 2
 
+        next_frame_time = time.perf_counter()
         while True:
             delta_x = self.pan_x - target_x
             delta_y = self.pan_y - target_y
@@ -127,61 +391,109 @@ class TerminalMazeGame:
             self.lit_area_x = self.pan_x + self.screen_width // 2
             self.lit_area_y = self.pan_y + self.screen_height // 2
 
-            self.stdscr.clear()
-            self.__draw_tiles()
-
-            self.stdscr.move(0, 0)
+            self.__draw_frame(line_of_sight=False, show_hud=False)
 
             if abs(delta_x) <= 1 and abs(delta_y) <= 1:
                 break
 
-            sleep(0.01)
-            self.stdscr.refresh()
+            next_frame_time += self.INITIAL_PAN_FRAME_SECONDS
+            sleep_until(next_frame_time)
+
+    def __get_key(self):
+        curses.flushinp()
+        return self.stdscr.getkey()
+
+    def __poll_key(self, max_wait_seconds: float):
+        # The next key, or None if none is pressed within max_wait_seconds
+        self.stdscr.timeout(max(int(max_wait_seconds * 1000), 0))
+        try:
+            return self.stdscr.getkey()
+        except curses.error:
+            return None
+
+    def __key_to_direction(self, key):
+        if key in self.KEYBINDS:
+            return self.KEYBINDS[key]
+        return self.KEYBINDS.get(key.lower())
+
+    def __option_keybinds(self, key):
+        # Keys that change options rather than moving. Returns whether key was one of them
+        return self.__view_distance_keybinds(key) or self.__profile_keybinds(key) or \
+            self.__minimap_keybinds(key)
+
+    def __view_distance_keybinds(self, key):
+        if key in ('+', '='):
+            self.set_view_distance(self.view_distance + self.VIEW_DISTANCE_STEP)
+        elif key in ('-', '_'):
+            self.set_view_distance(self.view_distance - self.VIEW_DISTANCE_STEP)
+        else:
+            return False
+        return True
+
+    def __profile_keybinds(self, key):
+        if key in ('p', 'P'):
+            self.show_profile = not self.show_profile
+            return True
+        return False
+
+    def __minimap_keybinds(self, key):
+        if key in ('m', 'M'):
+            self.show_minimap = not self.show_minimap
+            return True
+        return False
+
+    def set_view_distance(self, view_distance: int):
+        self.view_distance = min(max(view_distance, self.MIN_VIEW_DISTANCE),
+            self.MAX_VIEW_DISTANCE)
+        self.engine.view_distance = self.view_distance
 
     def __update_screen_size(self):
         self.screen_height, self.screen_width = self.stdscr.getmaxyx()
 
-    def __draw_tiles(self):
-        for tile in self.maze_tiles:
-            # We divide by 2 because characters are only half as wide as they are tall,
-            # so this makes a perfect circle
-            if distance_squared(tile.x / 2, tile.y, self.lit_area_x / 2, self.lit_area_y) < \
-                self.VIEW_DISTANCE ** 2:
-                tile.draw(self.stdscr, self.pan_x, self.pan_y)
-                if not self.paused:
-                    tile.update(self.stdscr, self.maze_tiles, self.player)
-
-    def __draw_hud(self):
-        message = 'Arrow keys to move. Q to quit. ' + \
-            'Your goal: get to the green square without dying. ' + \
-            f'Move count: {self.move_count}'
-        lines = textwrap.wrap(message, self.screen_width)
-        for idx, line in enumerate(lines):
-            self.stdscr.move(self.screen_height - (len(lines) - idx), 0)
-        self.stdscr.addstr(line, curses.color_pair(0))
+    def __draw_tiles(self, line_of_sight: bool = True):
+        # What can be seen from the lit area is drawn over the dimmed memory of what
+        # has been seen before (which the terrain pad or the remembered layer already has)
+        if self.pad is not None:
+            tiles_drawn = draw_lit_tiles(self.pad, self.engine, self.lit_area_x,
+                self.lit_area_y, line_of_sight)
+        else:
+            tiles_drawn = draw_lit_tiles(self.renderer, self.engine, self.lit_area_x,
+                self.lit_area_y, line_of_sight, self.pan_x, self.pan_y, self.remembered)
+        self.profiler.add_count('tiles drawn', tiles_drawn)
+
+    def __hud_lines(self):
+        lines = hud_lines(self.engine, self.screen_width)
+        if self.show_profile:
+            # Timings of the previous frame, as this one isn't finished yet
+            lines.insert(0, self.profiler.overlay_text()[:self.screen_width])
+        return lines
 
     def __pan_to_player(self):
-        true_x, true_y = self.player.get_true_pos(self.pan_x, self.pan_y)
-        if true_x < self.PAN_TRIGGER_DIST_X:
-            self.pan_x -= self.PAN_INCREMENT
-        elif true_x >= self.screen_width - self.PAN_TRIGGER_DIST_X:
-            self.pan_x += self.PAN_INCREMENT
-        if true_y < self.PAN_TRIGGER_DIST_Y:
-            self.pan_y -= self.PAN_INCREMENT
-        elif true_y >= self.screen_height - self.PAN_TRIGGER_DIST_Y:
-            self.pan_y += self.PAN_INCREMENT
+        self.pan_x, self.pan_y = pan_to_follow(self.pan_x, self.pan_y, self.player.x,
+            self.player.y, self.screen_width, self.screen_height)
 
     def __show_outcome(self):
         self.stdscr.clear()
 
-        if self.outcome == Outcome.QUIT:
+        if self.engine.outcome == Outcome.QUIT:
             return AfterRoundAction.QUIT
 
         text = 'Haha you died'
-        if self.outcome == Outcome.WIN:
+        if self.engine.outcome == Outcome.WIN:
             text = 'Yay you won. '
-            score = int(max(500 - self.move_count, 0) * 3.4253)
+            score = round_score(self.engine.move_count, self.maze.par)
             text += f'You scored {score}'
+            if self.maze.par is not None:
+                text += f'\n{self.engine.move_count} moves, par was {self.maze.par}'
+            previous_best = self.score_manager.personal_best()
+            try:
+                self.score_manager.add_score(Score(score, seed=self.maze.seed))
+            except (OSError, struct.error):
+                text += '\n(Could not save the score)'
+            if previous_best is None or score > previous_best.value:
+                text += '\nNew personal best!'
+            else:
+                text += f'\nPersonal best: {previous_best.value}'
         
         text += '\nPress Q to exit'
         text += '\nPress R to play again'
@@ -196,11 +508,3 @@ class TerminalMazeGame:
                 return AfterRoundAction.QUIT
             elif key == 'r':
                 return AfterRoundAction.PLAY_AGAIN
-
-def center_text(text: str, total_width: int):
-    lines = []
-    for line in text.split('\n'):
-        padding_total = total_width - len(line)
-        padding_l = padding_total // 2
-        lines.append(' ' * padding_l + line)
-    return '\n'.join(lines)
@@ -1,11 +1,61 @@
+import argparse
 import curses
 
 from game import TerminalMazeGame
+from maze_generation import GenerationSettings
+from clock import TICK_RATE
 
-def main(stdscr):
-    game = TerminalMazeGame(stdscr)
+# Seeds are stored as signed 64 bit numbers (in cached mazes, replays, snapshots and scores)
+MIN_SEED = -2 ** 63
+MAX_SEED = 2 ** 63 - 1
+
+def main(stdscr, settings, endless, seed, realtime, tick_rate, profile_path, resume):
+    game = TerminalMazeGame(stdscr, settings, endless, seed, realtime, tick_rate, profile_path,
+        resume)
     game.mainloop()
 
+def seed_argument(text: str):
+    # argparse reports the error (through parser.error) if this raises
+    try:
+        seed = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not a whole number: {text!r}')
+    if not MIN_SEED <= seed <= MAX_SEED:
+        raise argparse.ArgumentTypeError(f'must be between {MIN_SEED} and {MAX_SEED}')
+    return seed
+
+def add_game_arguments(parser: argparse.ArgumentParser):
+    # Options shared with the server (see server.py)
+    defaults = GenerationSettings()
+    parser.add_argument('--width', type=int, default=defaults.max_x,
+        help='how far across the map rooms can be placed (default: %(default)s)')
+    parser.add_argument('--height', type=int, default=defaults.max_y,
+        help='how far down the map rooms can be placed (default: %(default)s)')
+    parser.add_argument('--endless', action='store_true',
+        help='play in a world with no edges that is generated as you explore it')
+    parser.add_argument('--seed', type=seed_argument,
+        help='play the maze generated from this seed every round')
+    parser.add_argument('--realtime', action='store_true',
+        help='keep enemies moving without waiting for key presses')
+    parser.add_argument('--tick-rate', type=float, default=TICK_RATE,
+        help='turns per second in real-time mode (default: %(default)s)')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Find your way through a maze in the terminal')
+    add_game_arguments(parser)
+    parser.add_argument('--profile', metavar='FILE',
+        help='append frame timing percentiles to FILE after each round')
+    parser.add_argument('--resume', action='store_true',
+        help='carry on with the round that was being played when the game was last quit')
+    args = parser.parse_args()
+    # Endless rounds aren't saved, and a saved round is a fixed size maze
+    if args.resume and args.endless:
+        parser.error('--resume can\'t be used with --endless')
+    return args
+
 if __name__ == '__main__':
+    args = parse_args()
+    settings = GenerationSettings().scaled_to(args.width, args.height)
     stdscr = curses.initscr()
-    curses.wrapper(main)
\ No newline at end of file
+    curses.wrapper(main, settings, args.endless, args.seed, args.realtime, args.tick_rate,
+        args.profile, args.resume)
@@ -0,0 +1,59 @@
+from terrain import *
+from tiles import *
+
+class Maze:
+    # Everything that makes up a round: the static terrain
+    # and the walkers moving around on it (indexed by position)
+
+    def __init__(self, terrain: Terrain, walkers: list, seed: int = None,
+        rooms: list = None, room_index=None, par: int = None):
+        self.terrain = terrain
+        # Seed the maze was generated from, if known
+        self.seed = seed
+        # Move count of the quickest possible win (see maze_generation.find_par),
+        # None if it isn't known
+        self.par = par
+        self.rooms = rooms if rooms is not None else []
+        self.room_index = room_index
+        self.walkers = walkers
+        self.tile_index = TileIndex(walker for walker in walkers if type(walker) != MovingEnemy)
+        # Changed whenever the terrain changes, for anything that caches what it worked out
+        # from the terrain
+        self.terrain_version = 0
+        # Number of times a walker has checked whether it can move somewhere or dies there
+        self.collision_checks = 0
+        # State of every MovingEnemy, so they can be stepped together.
+        # They start on their tracks (or held), the engine wakes the ones near the player
+        self.patrollers = PatrolSwarm()
+        for walker in walkers:
+            if type(walker) == MovingEnemy:
+                self.patrollers.adopt(walker, self)
+
+    def add_walker(self, walker: TileWalker):
+        self.walkers.append(walker)
+        if type(walker) == MovingEnemy:
+            self.patrollers.adopt(walker, self)
+        else:
+            self.tile_index.add_tile(walker)
+            if type(walker) in PatrolSwarm.BLOCKING_WALKERS:
+                self.patrollers.wake_around(self, walker.x, walker.y)
+
+    def remove_walker(self, walker: TileWalker):
+        self.walkers.remove(walker)
+        if type(walker) == MovingEnemy and \
+            walker.swarm.states[walker.slot] == PatrolSwarm.ON_TRACK:
+            # Enemies on their track aren't in the tile index
+            self.patrollers.wake(self, walker)
+        self.tile_index.remove_tile(walker)
+        if type(walker) == MovingEnemy:
+            self.patrollers.release(walker)
+
+    def load_around(self, x: int, y: int):
+        # Called whenever the player moves, for mazes that are generated as they are explored
+        pass
+
+    def room_at(self, x: int, y: int):
+        # The room (x, y) is in, or None if it isn't in one (or rooms aren't known)
+        if self.room_index is None:
+            return None
+        return self.room_index.room_at(x, y)
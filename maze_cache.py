@@ -0,0 +1,140 @@
+# Compact binary file format for generated mazes, and a cache of them keyed by seed.
+#
+# Layout (little endian):
+#     header       see HEADER below
+#     terrain      width * height bytes of terrain flags, row by row
+#     enemies      enemy_count * 4 int32s, as made by pack_enemies()
+#     rooms        room_count * 4 int32s of (x, y, width, height)
+#     connections  connection_count * 2 int32s, the number of a room and of a room it is
+#                  joined to, for each room's connections in order (the order decides which
+#                  enemies the scheduler updates first, so it has to be kept)
+#
+# The file is memory mapped, so the terrain is used straight from the mapping
+# rather than being rebuilt into Python objects
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+
+from terrain import Terrain
+from maze import Maze
+from maze_generation import *
+
+MAGIC = b'TMZE'
+FORMAT_VERSION = 5
+# magic, version, seed, width, height, start x, start y, par (-1 if not known),
+# enemy count, room count, connection count
+HEADER = struct.Struct('<4sHqIIiiiIII')
+ENEMY_RECORD_SIZE = 4 * array('i').itemsize
+ROOM_RECORD_SIZE = 4 * array('i').itemsize
+CONNECTION_RECORD_SIZE = 2 * array('i').itemsize
+
+def maze_to_bytes(maze: Maze, start_x: int, start_y: int):
+    # The maze must be freshly generated (nobody has moved yet),
+    # as only enemies are saved, not the player
+    enemies = pack_enemies([walker for walker in maze.walkers if type(walker) in ENEMY_TYPES])
+    rooms, connections = pack_rooms(maze.rooms)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, maze.seed or 0, maze.terrain.width,
+        maze.terrain.height, start_x, start_y, -1 if maze.par is None else maze.par,
+        len(enemies) // 4, len(rooms) // 4, len(connections) // 2)
+    return header + bytes(maze.terrain.cells) + enemies.tobytes() + rooms.tobytes() + \
+        connections.tobytes()
+
+def pack_rooms(rooms: list):
+    room_numbers = {id(room): number for number, room in enumerate(rooms)}
+    packed_rooms = array('i')
+    connections = array('i')
+    for number, room in enumerate(rooms):
+        packed_rooms.extend((room.x, room.y, room.width, room.height))
+        for other_room in room.connections:
+            connections.extend((number, room_numbers[id(other_room)]))
+    return packed_rooms, connections
+
+def unpack_rooms(packed_rooms: array, connections: array):
+    rooms = []
+    for idx in range(0, len(packed_rooms), 4):
+        rooms.append(Room(*packed_rooms[idx:idx + 4]))
+    for idx in range(0, len(connections), 2):
+        rooms[connections[idx]].connections.append(rooms[connections[idx + 1]])
+    return rooms
+
+def index_rooms(rooms: list):
+    room_index = RoomIndex(max((room.width for room in rooms), default=0) + 1)
+    for room in rooms:
+        room_index.add_room(room)
+    return room_index
+
+def maze_from_buffer(buffer):
+    # Returns (start_x, start_y, maze). The terrain keeps a view of buffer,
+    # so buffer must be writable if the terrain is going to be changed
+    magic, version, seed, width, height, start_x, start_y, par, enemy_count, room_count, \
+        connection_count = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a maze file, or from an incompatible version')
+
+    terrain_start = HEADER.size
+    enemies_start = terrain_start + width * height
+    rooms_start = enemies_start + enemy_count * ENEMY_RECORD_SIZE
+    connections_start = rooms_start + room_count * ROOM_RECORD_SIZE
+    end = connections_start + connection_count * CONNECTION_RECORD_SIZE
+    if len(buffer) < end:
+        raise ValueError('Maze file is truncated')
+
+    terrain = Terrain(width, height, memoryview(buffer)[terrain_start:enemies_start])
+    enemies = array('i', buffer[enemies_start:rooms_start])
+    packed_rooms = array('i', buffer[rooms_start:connections_start])
+    connections = array('i', buffer[connections_start:end])
+
+    rooms = unpack_rooms(packed_rooms, connections)
+    return start_x, start_y, Maze(terrain, unpack_enemies(enemies), seed, rooms,
+        index_rooms(rooms), None if par == -1 else par)
+
+def save_maze(path: str, maze: Maze, start_x: int, start_y: int):
+    # Write to a temporary file first so nothing can ever see a half written maze
+    directory = os.path.dirname(path) or '.'
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file:
+            file.write(maze_to_bytes(maze, start_x, start_y))
+        os.replace(temporary_path, path)
+    except:
+        os.remove(temporary_path)
+        raise
+
+def load_maze(path: str):
+    with open(path, 'rb') as file:
+        # Copy-on-write mapping: pages are only read in when used,
+        # and anything that writes to the terrain doesn't touch the file
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    return maze_from_buffer(mapping)
+
+def cache_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'terminal-maze-game', 'mazes')
+
+def cache_path(seed: int, settings: GenerationSettings):
+    # Different settings (or generator versions) give a different maze from the same seed,
+    # so they are part of the key
+    settings_hash = hashlib.sha1(f'{GENERATION_VERSION}:{settings!r}'.encode()).hexdigest()[:12]
+    return os.path.join(cache_directory(), f'{seed}-{settings_hash}.maze')
+
+def load_or_generate_maze(seed: int, settings: GenerationSettings = None):
+    if settings is None:
+        settings = GenerationSettings()
+    path = cache_path(seed, settings)
+    try:
+        return load_maze(path)
+    except (OSError, ValueError, struct.error):
+        pass
+
+    start_x, start_y, maze = generate_maze(settings, seed)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_maze(path, maze, start_x, start_y)
+    except (OSError, struct.error):
+        # Not being able to cache isn't a reason to stop the game
+        pass
+    return start_x, start_y, maze
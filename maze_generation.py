@@ -1,8 +1,12 @@
 import random
-from dataclasses import dataclass
+from array import array
+from dataclasses import dataclass, field, replace
 
 from tiles import *
+from terrain import *
+from maze import Maze
 from misc import *
+from pathfinding import shortest_path_length
 
 MIN_ROOMS = 40
 MAX_ROOMS = 80
@@ -28,12 +32,46 @@ ENEMY_TYPES = [MovingEnemy, ChasingEnemy]
 
 FINISH_TILE_DENSITY = 1 / 10
 
+# Bumped whenever the same seed and settings start giving a different maze,
+# so that anything stored by seed (cached mazes, replays) knows it is out of date
+GENERATION_VERSION = 3
+
+@dataclass
+class GenerationSettings:
+    # Everything that controls the shape of a generated maze.
+    # Defaults to the module constants above
+    max_x: int = MAX_X
+    max_y: int = MAX_Y
+    min_rooms: int = MIN_ROOMS
+    max_rooms: int = MAX_ROOMS
+    min_room_size: int = MIN_ROOM_SIZE
+    max_room_size: int = MAX_ROOM_SIZE
+    min_connections_per_room: int = MIN_CONNECTIONS_PER_ROOM
+    max_connections_per_room: int = MAX_CONNECTIONS_PER_ROOM
+    max_passage_length: int = MAX_PASSAGE_LENGTH
+    death_tile_density: float = DEATH_TILE_DENSITY
+    min_enemies_per_room: int = MIN_ENEMIES_PER_ROOM
+    max_enemies_per_room: int = MAX_ENEMIES_PER_ROOM
+    finish_tile_density: float = FINISH_TILE_DENSITY
+
+    def scaled_to(self, max_x: int, max_y: int):
+        # Copy of these settings for a different map size,
+        # with the room counts scaled to keep the same density of rooms
+        area_scale = (max_x * max_y) / (self.max_x * self.max_y)
+        return replace(self,
+            max_x=max_x,
+            max_y=max_y,
+            min_rooms=max(int(self.min_rooms * area_scale), 1),
+            max_rooms=max(int(self.max_rooms * area_scale), 1))
+
 @dataclass
 class Room:
     x: int
     y: int
     width: int
     height: int
+    # Rooms joined to this one by a passage
+    connections: list = field(default_factory=list, compare=False, repr=False)
 
     @property
     def center_x(self):
@@ -55,30 +93,88 @@ class Room:
     def area(self):
         return self.width * self.height
 
-def generate_maze():
-    rooms = generate_rooms()
-    start_x, start_y = generate_start_point(rooms)
-    tiles = generate_tiles(rooms)
-    tiles += generate_passages(rooms)
-    tiles += generate_death_tiles(rooms)
-    tiles += generate_enemies(rooms)
-    tiles += generate_finish_tiles(rooms)
-    return start_x, start_y, tiles
-
-def generate_rooms():
+    def contains(self, x: int, y: int):
+        return self.x <= x <= self.right_x and self.y <= y <= self.bottom_y
+
+    def connect(self, other_room):
+        if other_room not in self.connections:
+            self.connections.append(other_room)
+            other_room.connections.append(self)
+
+class RoomIndex:
+    # Buckets rooms into a coarse grid so that overlap and point queries
+    # only look at the rooms nearby, rather than every room in the maze
+
+    def __init__(self, bucket_size: int):
+        self.bucket_size = bucket_size
+        self.buckets = {}
+
+    def __bucket_range(self, x: int, y: int, right_x: int, bottom_y: int):
+        for bucket_y in range(y // self.bucket_size, bottom_y // self.bucket_size + 1):
+            for bucket_x in range(x // self.bucket_size, right_x // self.bucket_size + 1):
+                yield (bucket_x, bucket_y)
+
+    def add_room(self, room: Room):
+        for bucket in self.__bucket_range(room.x, room.y, room.right_x, room.bottom_y):
+            self.buckets.setdefault(bucket, []).append(room)
+
+    def rooms_near(self, room: Room):
+        # Rooms in any bucket that room (or the 1 tile border around it) falls in.
+        # May contain duplicates
+        for bucket in self.__bucket_range(room.x - 1, room.y - 1,
+            room.right_x + 1, room.bottom_y + 1):
+            yield from self.buckets.get(bucket, ())
+
+    def rooms_at(self, x: int, y: int):
+        bucket = (x // self.bucket_size, y // self.bucket_size)
+        for room in self.buckets.get(bucket, ()):
+            if room.contains(x, y):
+                yield room
+
+    def room_at(self, x: int, y: int):
+        # Rooms never overlap, so there is at most one
+        return next(self.rooms_at(x, y), None)
+
+def generate_maze(settings: GenerationSettings = None, seed: int = None):
+    # The same seed and settings always give the same maze.
+    # If no seed is given a random one is picked (it is stored on the maze)
+    if settings is None:
+        settings = GenerationSettings()
+    if seed is None:
+        seed = new_seed()
+    rng = random.Random(seed)
+    rooms, room_index = generate_rooms(settings, rng)
+    terrain = generate_terrain(rooms)
+    components = generate_passages(terrain, rooms, room_index, settings, rng)
+    # The start and finish go in the biggest group of rooms joined by passages,
+    # so there is always a way from one to the other
+    reachable_rooms = [rooms[number] for number in components.largest_group()]
+    start_x, start_y = generate_start_point(reachable_rooms, rng)
+    generate_finish_tiles(terrain, reachable_rooms, settings, rng, len(rooms))
+    generate_death_tiles(terrain, rooms, settings, rng, [(start_x, start_y)])
+    walkers = generate_enemies(rooms, settings, rng, [(start_x, start_y)])
+    return start_x, start_y, Maze(terrain, walkers, seed, rooms, room_index,
+        find_par(terrain, start_x, start_y))
+
+def new_seed():
+    return random.getrandbits(63)
+
+def generate_rooms(settings: GenerationSettings, rng=random):
     # This will generate a bunch of Room objects which do not intersect or touch
     rooms = []
-    room_count = random.randint(MIN_ROOMS, MAX_ROOMS)
+    room_index = RoomIndex(settings.max_room_size + 1)
+    room_count = rng.randint(settings.min_rooms, settings.max_rooms)
     for room_num in range(room_count):
-        room_width = random.randint(MIN_ROOM_SIZE, MAX_ROOM_SIZE)
-        room_height = random.randint(MIN_ROOM_SIZE, MAX_ROOM_SIZE) // 2
-        room_x = random.randint(0, MAX_X)
-        room_y = random.randint(0, MAX_Y)
+        room_width = rng.randint(settings.min_room_size, settings.max_room_size)
+        room_height = rng.randint(settings.min_room_size, settings.max_room_size) // 2
+        room_x = rng.randint(0, settings.max_x)
+        room_y = rng.randint(0, settings.max_y)
         new_room = Room(room_x, room_y, room_width, room_height)
 
-        if not any(rooms_touch(room, new_room) for room in rooms):
+        if not any(rooms_touch(room, new_room) for room in room_index.rooms_near(new_room)):
             rooms.append(new_room)
-    return rooms
+            room_index.add_room(new_room)
+    return rooms, room_index
 
 def rooms_touch(room_1, room_2):
     # Whether the two rooms overlap or touch by an edge
@@ -88,43 +184,66 @@ def rooms_touch(room_1, room_2):
         room_1.bottom_y + 1 >= room_2.y and \
         room_1.y <= room_2.bottom_y + 1
 
-def generate_start_point(rooms):
+def generate_start_point(rooms, rng=random):
     # If there are no rooms then give up
     if len(rooms) == 0:
         return (0, 0)
     # Else choose a random room and start in the middle of it
     else:
-        room = random.choice(rooms)
+        room = rng.choice(rooms)
         start_x = room.x + room.width // 2
         start_y = room.y + room.height // 2
         return (start_x, start_y)
 
-def generate_tiles(rooms):
-    tiles = []
+def generate_terrain(rooms, width: int = None, height: int = None):
+    # Unless a size is given, make a terrain grid just big enough to hold every room
+    # (passages only ever run between rooms so they fit too)
+    if width is None:
+        width = max((room.right_x + 1 for room in rooms), default=1)
+    if height is None:
+        height = max((room.bottom_y + 1 for room in rooms), default=1)
+    terrain = Terrain(width, height)
 
-    # Fill the rooms with floor tiles
+    # Fill the rooms with floor
     for room in rooms:
-        for col_idx in range(room.width + 1):
-            for row_idx in range(room.height + 1):
-                tiles.append(FloorTile(col_idx + room.x, row_idx + room.y))
+        terrain.fill_rect(room.x, room.y, room.width + 1, room.height + 1, FLOOR)
 
-    return tiles
+    return terrain
 
-def generate_passages(rooms):
+def generate_passages(terrain, rooms, room_index: RoomIndex, settings: GenerationSettings,
+    rng=random):
+    # Returns a DisjointSet of the room numbers (positions in rooms),
+    # grouping rooms that are joined by passages
+    components = DisjointSet(len(rooms))
     # Don't bother building passages if there's only one room (or none)
     if len(rooms) <= 1:
-        return []
+        return components
+    room_numbers = {id(room): number for number, room in enumerate(rooms)}
 
-    tiles = []
     for room in rooms:
         available_directions = [Direction.LEFT, Direction.RIGHT, Direction.UP, Direction.DOWN]
-        for _ in range(random.randint(MIN_CONNECTIONS_PER_ROOM, MAX_CONNECTIONS_PER_ROOM)):
-            passage_direction = random.choice(available_directions)
-            tiles += generate_passage(room, passage_direction, rooms)
+        for _ in range(rng.randint(settings.min_connections_per_room,
+            settings.max_connections_per_room)):
+            passage_direction = rng.choice(available_directions)
+            passage_flags = PASSAGE
+            if passage_direction in (Direction.UP, Direction.DOWN):
+                passage_flags |= PASSAGE_VERTICAL
+            passage_cells = generate_passage(room, passage_direction, terrain,
+                settings.max_passage_length)
+            for x, y in passage_cells:
+                terrain.add_flags(x, y, passage_flags)
+            if len(passage_cells) > 0:
+                # Successful passages end inside the room they hit
+                other_room = room_index.room_at(*passage_cells[-1])
+                room.connect(other_room)
+                components.union(room_numbers[id(room)], room_numbers[id(other_room)])
             available_directions.remove(passage_direction)
-    return tiles
+    return components
 
-def generate_passage(start_room: Room, direction: Direction, rooms):
+def generate_passage(start_room: Room, direction: Direction, terrain: Terrain,
+    max_passage_length: int = MAX_PASSAGE_LENGTH):
+    # The terrain must only have room floors on it so far,
+    # as that is what is used to tell if the passage has hit a room
     # Calc start point of the passage
     if direction == Direction.LEFT:
         crnt_position_x = start_room.x + (PASSAGE_INDENT - 1)
@@ -139,15 +258,15 @@ def generate_passage(start_room: Room, direction: Direction, rooms):
         crnt_position_x = start_room.center_x
         crnt_position_y = start_room.bottom_y - (PASSAGE_INDENT - 1)
     
-    tiles = []
+    cells = []
     success = False
     passage_length = 0
     consecutive_room_hits = 0 # counts how many consecutive steps we've been in a room
 
     while True:
-        tiles.append(PassageFloorTile(crnt_position_x, crnt_position_y, direction))
+        cells.append((crnt_position_x, crnt_position_y))
         passage_length += 1
-        if passage_length > MAX_PASSAGE_LENGTH:
+        if passage_length > max_passage_length:
             break
 
         if direction == Direction.LEFT:
@@ -159,13 +278,8 @@ def generate_passage(start_room: Room, direction: Direction, rooms):
         else:
             crnt_position_y += 1
         
-        in_room = False
-        for room in rooms:
-            if room == start_room:
-                continue
-            if room.x <= crnt_position_x and crnt_position_x <= room.right_x and \
-                room.y <= crnt_position_y and crnt_position_y <= room.bottom_y:
-                in_room = True
+        in_room = terrain.get(crnt_position_x, crnt_position_y) & FLOOR and \
+            not start_room.contains(crnt_position_x, crnt_position_y)
         
         if in_room:
             consecutive_room_hits += 1
@@ -178,36 +292,81 @@ def generate_passage(start_room: Room, direction: Direction, rooms):
     
     # Only add the passage if it hit another room
     if success:
-        return tiles
+        return cells
     else:
         return []
 
-def generate_death_tiles(rooms):
-    tiles = []
+def generate_death_tiles(terrain, rooms, settings: GenerationSettings, rng=random,
+    keep_clear=()):
+    # Death tiles never go where a passage meets a room, on a finish tile
+    # or on a position in keep_clear, so they can't block the way in or out
+    keep_clear = set(keep_clear)
     for room in rooms:
-        death_tile_amount = int(room.area * DEATH_TILE_DENSITY)
+        death_tile_amount = int(room.area * settings.death_tile_density)
         for i in range(death_tile_amount):
-            x = random.randint(0, room.width) + room.x
-            y = random.randint(0, room.height) + room.y
-            tiles.append(DeathTile(x, y))
-    return tiles
+            x = rng.randint(0, room.width) + room.x
+            y = rng.randint(0, room.height) + room.y
+            if terrain.get(x, y) & (PASSAGE | FINISH) or (x, y) in keep_clear:
+                continue
+            terrain.add_flags(x, y, DEATH)
+
+def find_par(terrain, start_x: int, start_y: int):
+    # Move count of the quickest win, ignoring enemies: the shortest path for the player
+    # to a finish tile. The move that reaches the finish isn't counted in the move count
+    steps = shortest_path_length(terrain, start_x, start_y, FINISH, Player.WALKABLE_TILES,
+        Player.COLLIDES_WITH | Player.KILLED_BY)
+    if steps is None:
+        return None
+    return max(steps - 1, 0)
 
-def generate_enemies(rooms):
+def generate_enemies(rooms, settings: GenerationSettings, rng=random, keep_clear=()):
+    keep_clear = set(keep_clear)
     tiles = []
     for room in rooms:
-        enemy_amount = random.randint(MIN_ENEMIES_PER_ROOM, MAX_ENEMIES_PER_ROOM)
+        enemy_amount = rng.randint(settings.min_enemies_per_room,
+            settings.max_enemies_per_room)
         for i in range(enemy_amount):
-            x = random.randint(0, room.width) + room.x
-            y = random.randint(0, room.height) + room.y
-            enemy_type = random.choice(ENEMY_TYPES)
-            tiles.append(enemy_type(x, y))
+            x = rng.randint(0, room.width) + room.x
+            y = rng.randint(0, room.height) + room.y
+            enemy_type = rng.choice(ENEMY_TYPES)
+            if (x, y) in keep_clear:
+                continue
+            if enemy_type == MovingEnemy:
+                tiles.append(MovingEnemy(x, y, rng.choice(list(Direction))))
+            else:
+                tiles.append(enemy_type(x, y))
     return tiles
 
-def generate_finish_tiles(rooms):
-    tiles = []
-    rooms_with_finish_point = random.sample(rooms, int(len(rooms) * FINISH_TILE_DENSITY))
+def pack_enemies(enemies: list):
+    # Flat array of (type number, x, y, direction number) for each enemy,
+    # to store enemies compactly
+    packed = array('i')
+    for enemy in enemies:
+        direction = getattr(enemy, 'direction', Direction.UP)
+        packed.extend((ENEMY_TYPES.index(type(enemy)), enemy.x, enemy.y, direction.value))
+    return packed
+
+def unpack_enemies(packed: array):
+    enemies = []
+    for idx in range(0, len(packed), 4):
+        enemy_type = ENEMY_TYPES[packed[idx]]
+        x = packed[idx + 1]
+        y = packed[idx + 2]
+        if enemy_type == MovingEnemy:
+            enemies.append(MovingEnemy(x, y, Direction(packed[idx + 3])))
+        else:
+            enemies.append(enemy_type(x, y))
+    return enemies
+
+def generate_finish_tiles(terrain, rooms, settings: GenerationSettings, rng=random,
+    total_rooms: int = None):
+    # Finish tiles only go in rooms, but how many there are depends on total_rooms
+    # (defaults to len(rooms)). There is always at least one if there are any rooms
+    if total_rooms is None:
+        total_rooms = len(rooms)
+    finish_tile_amount = max(int(total_rooms * settings.finish_tile_density), 1)
+    rooms_with_finish_point = rng.sample(rooms, min(finish_tile_amount, len(rooms)))
     for room in rooms_with_finish_point:
-        x_pos = random.randint(room.x, room.right_x)
-        y_pos = random.randint(room.y, room.bottom_y)
-        tiles.append(FinishTile(x_pos, y_pos))
-    return tiles
+        x_pos = rng.randint(room.x, room.right_x)
+        y_pos = rng.randint(room.y, room.bottom_y)
+        terrain.add_flags(x_pos, y_pos, FINISH)
@@ -0,0 +1,125 @@
+# A small overview of the explored map for a corner of the screen.
+# It is drawn from levels of the map reduced by powers of two: a cell of level k covers
+# 2^k by 2^k map cells, and holds the most important thing seen in them (see the
+# values below). Levels are only updated for the cells the player has just seen,
+# and only as far up as anything changes, so the cost of a frame depends on the size
+# of the minimap rather than of the maze
+
+from terrain import *
+from tiles import Player
+
+# Values of level cells, in order of importance
+UNKNOWN = 0
+EXPLORED = 1
+FINISH_SEEN = 2
+
+# A cell of the highest level covers 2^MAX_LEVEL cells each way
+MAX_LEVEL = 12
+# Endless mazes have no size to fit, so the minimap is always this level around the player
+ENDLESS_LEVEL = 2
+# Biggest size of the minimap (including its border), also limited to half the screen
+MAX_WIDTH = 42
+MAX_HEIGHT = 14
+
+BORDER_STYLE = 0
+
+class Minimap:
+    def __init__(self, engine, endless: bool = False):
+        self.engine = engine
+        self.endless = endless
+        # levels[k] maps (x >> k, y >> k) to a value, for levels 1 to MAX_LEVEL
+        # (level 0 would just be the map)
+        self.levels = [{} for _ in range(MAX_LEVEL + 1)]
+        for x, y in engine.seen.seen_cells():
+            self.__add_cell(x, y)
+        # The seen map lists newly seen cells here for update() to take
+        engine.seen.new_cells = []
+
+    def update(self):
+        # Add the cells seen since the last update
+        seen = self.engine.seen
+        new_cells = seen.new_cells
+        seen.new_cells = []
+        for x, y in new_cells:
+            self.__add_cell(x, y)
+
+    def __add_cell(self, x: int, y: int):
+        flags = self.engine.maze.terrain.get(x, y)
+        if flags & FINISH:
+            value = FINISH_SEEN
+        elif flags & (FLOOR | PASSAGE):
+            value = EXPLORED
+        else:
+            return
+        # Each level's cell is at least as important as the ones it covers below,
+        # so once a level already has this value every level above does too
+        for level in range(1, MAX_LEVEL + 1):
+            position = (x >> level, y >> level)
+            if self.levels[level].get(position, UNKNOWN) >= value:
+                break
+            self.levels[level][position] = value
+
+    def layout(self, screen_width: int, screen_height: int):
+        # Returns (level, left, top, inner width, inner height) of the part of the map shown:
+        # the whole maze at the most detailed level that fits, or for endless mazes
+        # the area around the player
+        max_width = min(MAX_WIDTH, screen_width // 2) - 2
+        max_height = min(MAX_HEIGHT, screen_height // 2) - 2
+        if max_width <= 0 or max_height <= 0:
+            return None
+        player = self.engine.player
+        if self.endless:
+            level = ENDLESS_LEVEL
+            return (level, (player.x >> level) - max_width // 2,
+                (player.y >> level) - max_height // 2, max_width, max_height)
+
+        terrain = self.engine.maze.terrain
+        for level in range(1, MAX_LEVEL + 1):
+            width = -(-terrain.width >> level)
+            height = -(-terrain.height >> level)
+            if width <= max_width and height <= max_height:
+                return (level, 0, 0, width, height)
+        return (MAX_LEVEL, 0, 0, min(width, max_width), min(height, max_height))
+
+    def size(self, screen_width: int, screen_height: int):
+        # (width, height) of the minimap including its border, or None if it doesn't fit
+        layout = self.layout(screen_width, screen_height)
+        if layout is None:
+            return None
+        return (layout[3] + 2, layout[4] + 2)
+
+    def draw(self, target, x: int, y: int, screen_width: int, screen_height: int):
+        # Draws the minimap with its top left corner at (x, y) on target
+        # (anything with put(x, y, char, style), like a Renderer)
+        layout = self.layout(screen_width, screen_height)
+        if layout is None:
+            return
+        level, left, top, width, height = layout
+        cells = self.levels[level]
+
+        target.put(x, y, '\u250c', BORDER_STYLE)
+        target.put(x + width + 1, y, '\u2510', BORDER_STYLE)
+        target.put(x, y + height + 1, '\u2514', BORDER_STYLE)
+        target.put(x + width + 1, y + height + 1, '\u2518', BORDER_STYLE)
+        for column in range(width):
+            target.put(x + column + 1, y, '\u2500', BORDER_STYLE)
+            target.put(x + column + 1, y + height + 1, '\u2500', BORDER_STYLE)
+
+        for row in range(height):
+            target.put(x, y + row + 1, '\u2502', BORDER_STYLE)
+            target.put(x + width + 1, y + row + 1, '\u2502', BORDER_STYLE)
+            for column in range(width):
+                value = cells.get((left + column, top + row), UNKNOWN)
+                if value == FINISH_SEEN:
+                    target.put(x + column + 1, y + row + 1, '\u2588', FINISH_COLOR_PAIR)
+                elif value == EXPLORED:
+                    # \u2591 is a lightly shaded block
+                    target.put(x + column + 1, y + row + 1, '\u2591', FLOOR_COLOR_PAIR)
+                else:
+                    target.put(x + column + 1, y + row + 1, ' ', BORDER_STYLE)
+
+        player = self.engine.player
+        column = (player.x >> level) - left
+        row = (player.y >> level) - top
+        if 0 <= column < width and 0 <= row < height:
+            target.put(x + column + 1, y + row + 1, player.char, Player.COLOR_PAIR_NUMBER)
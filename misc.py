@@ -1,4 +1,5 @@
 from enum import Enum, unique
+from functools import lru_cache
 
 @unique
 class Direction(Enum):
@@ -18,6 +19,18 @@ class Direction(Enum):
         else:
             return Direction.LEFT
 
+    @staticmethod
+    def offset(direction):
+        # (dx, dy) of a single step in this direction
+        if direction == Direction.UP:
+            return (0, -1)
+        elif direction == Direction.DOWN:
+            return (0, 1)
+        elif direction == Direction.LEFT:
+            return (-1, 0)
+        else:
+            return (1, 0)
+
 def sort_based_on_key(items, key):
     # Sort a list of dicts by the value at dict[key]
     # Order of identical items is not garanteed
@@ -36,4 +49,54 @@ def sort_based_on_key(items, key):
     return items
 
 def distance_squared(x1: int, y1: int, x2: int, y2: int):
-    return (x1 - x2) ** 2 + (y1 - y2) ** 2
\ No newline at end of file
+    return (x1 - x2) ** 2 + (y1 - y2) ** 2
+
+@lru_cache(maxsize=None)
+def view_circle_offsets(view_distance: int):
+    # (dx, dy) of every cell inside a circle of radius view_distance,
+    # row by row. dx is halved in the distance check because characters
+    # are only half as wide as they are tall, so on screen this is a perfect circle.
+    # Cached per radius as this is needed every frame
+    offsets = []
+    for dy in range(-view_distance, view_distance + 1):
+        for dx in range(-view_distance * 2, view_distance * 2 + 1):
+            if distance_squared(dx / 2, dy, 0, 0) < view_distance ** 2:
+                offsets.append((dx, dy))
+    return tuple(offsets)
+class DisjointSet:
+    # Union-find over the numbers 0 to size - 1,
+    # for keeping track of which things are joined up as they get joined
+
+    def __init__(self, size: int):
+        self.parents = list(range(size))
+        self.sizes = [1] * size
+
+    def find(self, item: int):
+        # Number standing for item's group (path halving keeps the trees shallow)
+        parents = self.parents
+        while parents[item] != item:
+            parents[item] = parents[parents[item]]
+            item = parents[item]
+        return item
+
+    def union(self, item_1: int, item_2: int):
+        root_1 = self.find(item_1)
+        root_2 = self.find(item_2)
+        if root_1 == root_2:
+            return
+        # The smaller group goes under the bigger one
+        if self.sizes[root_1] < self.sizes[root_2]:
+            root_1, root_2 = root_2, root_1
+        self.parents[root_2] = root_1
+        self.sizes[root_1] += self.sizes[root_2]
+
+    def largest_group(self):
+        # Items in the biggest group, in order (ties go to the group with the lowest item)
+        if len(self.parents) == 0:
+            return []
+        best_root = None
+        for item in range(len(self.parents)):
+            root = self.find(item)
+            if best_root is None or self.sizes[root] > self.sizes[best_root]:
+                best_root = root
+        return [item for item in range(len(self.parents)) if self.find(item) == best_root]
@@ -0,0 +1,129 @@
+from functools import lru_cache
+
+# Walkers that move diagonally can step to any of these
+NEIGHBOUR_OFFSETS = [
+    (-1, -1), (0, -1), (1, -1),
+    (-1, 0), (1, 0),
+    (-1, 1), (0, 1), (1, 1)
+]
+# The player can only step to these
+ORTHOGONAL_OFFSETS = [(0, -1), (-1, 0), (1, 0), (0, 1)]
+
+class DistanceField:
+    # Number of steps from every cell within max_distance of the origin to the origin,
+    # found with a breadth first search over the terrain.
+    # Only terrain is taken into account, walkers moving around don't change it,
+    # so one field can be shared by everything heading for the same place
+
+    def __init__(self, terrain, origin_x: int, origin_y: int, max_distance: int,
+        walkable_mask: int, blocked_mask: int = 0, neighbour_offsets=NEIGHBOUR_OFFSETS):
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.distances = search_distances(terrain, [(origin_x, origin_y)], max_distance,
+            walkable_mask, blocked_mask, neighbour_offsets)
+
+    def get(self, x: int, y: int):
+        # None if the cell can't reach the origin within max_distance
+        return self.distances.get((x, y))
+
+    def downhill_steps(self, x: int, y: int):
+        # Neighbouring cells that are closer to the origin than (x, y), closest first
+        distance = self.get(x, y)
+        if distance is None:
+            return []
+        steps = []
+        for dx, dy in NEIGHBOUR_OFFSETS:
+            neighbour_distance = self.get(x + dx, y + dy)
+            if neighbour_distance is not None and neighbour_distance < distance:
+                steps.append((neighbour_distance, x + dx, y + dy))
+        steps.sort()
+        return [(step_x, step_y) for _, step_x, step_y in steps]
+
+class NearestDistanceField(DistanceField):
+    # Like DistanceField, but to whichever of several origins is nearest
+    # (eg. the closest of the finish tiles)
+
+    def __init__(self, terrain, origins: list, max_distance: int, walkable_mask: int,
+        blocked_mask: int = 0, neighbour_offsets=NEIGHBOUR_OFFSETS):
+        self.origins = origins
+        self.distances = search_distances(terrain, origins, max_distance, walkable_mask,
+            blocked_mask, neighbour_offsets)
+
+def search_distances(terrain, origins: list, max_distance: int, walkable_mask: int,
+    blocked_mask: int = 0, neighbour_offsets=NEIGHBOUR_OFFSETS):
+    # Breadth first search out from all of origins at once.
+    # Returns a dict of (x, y) to the number of steps to the nearest origin
+    distances = {origin: 0 for origin in origins}
+    get_flags = terrain.get
+
+    # Expand one ring of cells at a time
+    frontier = list(distances)
+    for distance in range(1, max_distance + 1):
+        next_frontier = []
+        for x, y in frontier:
+            for dx, dy in neighbour_offsets:
+                position = (x + dx, y + dy)
+                if position in distances:
+                    continue
+                flags = get_flags(x + dx, y + dy)
+                if flags & walkable_mask and not flags & blocked_mask:
+                    distances[position] = distance
+                    next_frontier.append(position)
+        if not next_frontier:
+            break
+        frontier = next_frontier
+    return distances
+
+def shortest_path_length(terrain, start_x: int, start_y: int, target_mask: int,
+    walkable_mask: int, blocked_mask: int = 0):
+    # Fewest orthogonal steps from the start to any cell with target_mask set,
+    # or None if none can be reached. Made for whole fixed size mazes (a Terrain), so
+    # rather than a dict of positions it searches a flat copy of the grid, with a border
+    # of wall around it so that neighbours are just index offsets and never off the edge
+    width = terrain.width
+    height = terrain.height
+    if not terrain.in_bounds(start_x, start_y):
+        return None
+    stride = width + 1
+    # 0 for cells that can't be entered, 1 for open ones, 2 for targets
+    marks = bytes(terrain.cells).translate(path_marks_table(target_mask, walkable_mask,
+        blocked_mask))
+    rows = [marks[row * width:(row + 1) * width] for row in range(height)]
+    # Each row has a wall cell after it, which is also the one before the next row
+    grid = bytearray(bytes(stride) + b'\0'.join(rows) + bytes(stride + 1))
+    start = (start_y + 1) * stride + start_x
+    if grid[start] == 2:
+        return 0
+    grid[start] = 0
+    offsets = (-stride, -1, 1, stride)
+
+    frontier = [start]
+    distance = 0
+    while frontier:
+        distance += 1
+        next_frontier = []
+        for index in frontier:
+            for offset in offsets:
+                neighbour = index + offset
+                mark = grid[neighbour]
+                if mark:
+                    if mark == 2:
+                        return distance
+                    # Entered cells become walls so they aren't visited again
+                    grid[neighbour] = 0
+                    next_frontier.append(neighbour)
+        frontier = next_frontier
+    return None
+
+@lru_cache(maxsize=None)
+def path_marks_table(target_mask: int, walkable_mask: int, blocked_mask: int):
+    # Translation table from cell flags to the marks used by shortest_path_length()
+    table = bytearray(256)
+    for flags in range(256):
+        if flags & blocked_mask:
+            continue
+        if flags & target_mask:
+            table[flags] = 2
+        elif flags & walkable_mask:
+            table[flags] = 1
+    return bytes(table)
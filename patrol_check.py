@@ -0,0 +1,113 @@
+# Checks the shortcuts PatrolSwarm takes with moving enemies on seeded mazes:
+#     - an enemy on its track is always where stepping it would have taken it,
+#       however often it is woken and put back on its track
+#     - no two enemies ever move onto the same cell, which stepping never allows
+#       (generation can put two on one cell to start with, which isn't counted)
+# Run it after changing how tracks work, it exits with 1 if either check fails:
+#     python patrol_check.py
+#     python patrol_check.py --seeds 50 --ticks 2000
+
+import argparse
+import random
+import sys
+
+from tiles import *
+from maze import Maze
+from engine import MazeEngine
+from maze_generation import GenerationSettings, generate_maze
+from chunks import generate_endless_maze
+from benchmark import choose_direction
+
+DEFAULT_SEEDS = 10
+DEFAULT_TICKS = 500
+# Enemies followed on their own on each maze, and the chance each tick that one is woken
+# (or put back on its track if it is awake)
+TRACK_SAMPLES = 200
+TRACK_TICKS = 150
+SWITCH_CHANCE = 0.1
+
+def check_tracks(maze, rng):
+    # Returns how many times an enemy on its track wasn't where a stepped one was
+    terrain = maze.terrain
+    cells = [(x, y) for y in range(terrain.height) for x in range(terrain.width)
+        if terrain.get(x, y)]
+    mismatches = 0
+    for _ in range(TRACK_SAMPLES):
+        x, y = rng.choice(cells)
+        direction = rng.choice(list(Direction))
+        # Alone on the terrain, so nothing stops it going onto its track
+        tracked_maze = Maze(terrain, [MovingEnemy(x, y, direction)])
+        stepped_maze = Maze(terrain, [MovingEnemy(x, y, direction)])
+        stepped_maze.patrollers.wake_all(stepped_maze)
+        swarm = tracked_maze.patrollers
+        tracked = swarm.enemies[0]
+        stepped = stepped_maze.patrollers.enemies[0]
+        for _ in range(TRACK_TICKS):
+            if rng.random() < SWITCH_CHANCE:
+                if swarm.states[tracked.slot] == PatrolSwarm.ON_TRACK:
+                    swarm.wake(tracked_maze, tracked)
+                else:
+                    swarm.put_on_track(tracked_maze, tracked)
+            if (tracked.x, tracked.y, tracked.direction, tracked.char) != \
+                (stepped.x, stepped.y, stepped.direction, stepped.char):
+                mismatches += 1
+            stepped_maze.patrollers.step(stepped_maze)
+            swarm.step(tracked_maze)
+            swarm.clock += 1
+    return mismatches
+
+def shared_cells(maze):
+    # Sets of enemies (by id) that are on the same cell
+    enemies_at = {}
+    for walker in maze.walkers:
+        if type(walker) in (MovingEnemy, ChasingEnemy):
+            enemies_at.setdefault((walker.x, walker.y), []).append(id(walker))
+    return {frozenset(enemies) for enemies in enemies_at.values() if len(enemies) > 1}
+
+def check_round(maze, start_x: int, start_y: int, ticks: int, rng):
+    # Plays a random walk on the maze (starting again if the round ends) and returns
+    # how many ticks enemies moved onto each other's cells or ended up in the wrong place
+    # for their state (in the tile index only if they aren't on their track)
+    engine = MazeEngine(maze, start_x, start_y, rng.choice([3, 10, 20]))
+    swarm = maze.patrollers
+    failures = 0
+    shared = shared_cells(maze)
+    for _ in range(ticks):
+        if engine.finished:
+            maze.remove_walker(engine.player)
+            engine = MazeEngine(maze, start_x, start_y, rng.choice([3, 10, 20]))
+        engine.tick(choose_direction(engine, rng))
+        now_shared = shared_cells(maze)
+        misplaced = any((swarm.states[enemy.slot] == PatrolSwarm.ON_TRACK) ==
+            (enemy in maze.tile_index.tiles_at(enemy.x, enemy.y)) for enemy in swarm.enemies)
+        if now_shared - shared or misplaced:
+            failures += 1
+        shared = now_shared
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check moving enemies on their tracks against stepping them')
+    parser.add_argument('--seeds', type=int, default=DEFAULT_SEEDS,
+        help='how many seeds to check, from 0 (default: %(default)s)')
+    parser.add_argument('--ticks', type=int, default=DEFAULT_TICKS,
+        help='ticks played on each maze (default: %(default)s)')
+    args = parser.parse_args()
+
+    settings = GenerationSettings()
+    all_passed = True
+    for seed in range(args.seeds):
+        rng = random.Random(seed)
+        start_x, start_y, maze = generate_maze(settings, seed)
+        track_mismatches = check_tracks(maze, rng)
+        fixed_failures = check_round(maze, start_x, start_y, args.ticks, rng)
+        start_x, start_y, maze = generate_endless_maze(seed, settings)
+        endless_failures = check_round(maze, start_x, start_y, args.ticks, rng)
+        passed = track_mismatches == fixed_failures == endless_failures == 0
+        all_passed = all_passed and passed
+        print(f'seed {seed}: {track_mismatches} track mismatches, {fixed_failures} bad ticks, '
+            f'{endless_failures} bad endless ticks{"" if passed else " FAILED"}')
+    sys.exit(0 if all_passed else 1)
+
+if __name__ == '__main__':
+    main()
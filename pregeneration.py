@@ -0,0 +1,53 @@
+# Generates upcoming mazes in another process while the current round is played,
+# so that starting the next round doesn't have to wait for generation.
+# Mazes come back from the worker in the compact maze file format (see maze_cache)
+
+import multiprocessing
+from collections import deque
+
+from maze_generation import GenerationSettings, generate_maze
+from maze_cache import maze_to_bytes, maze_from_buffer
+
+# Number of mazes generated ahead
+QUEUE_SIZE = 2
+
+def generate_maze_bytes(settings: GenerationSettings, seed: int = None):
+    # Run in the worker process
+    start_x, start_y, maze = generate_maze(settings, seed)
+    return maze_to_bytes(maze, start_x, start_y)
+
+class MazePregenerator:
+    def __init__(self, settings: GenerationSettings = None, queue_size: int = QUEUE_SIZE):
+        self.settings = settings
+        self.queue_size = queue_size
+        self.pending = deque()
+        try:
+            self.pool = multiprocessing.Pool(1)
+        except (OSError, ImportError):
+            # No worker processes on this platform, generate when asked instead
+            self.pool = None
+        self.__fill_queue()
+
+    def take(self):
+        # Returns (start_x, start_y, maze) for the next round,
+        # only waiting if the worker hasn't finished it yet
+        if not self.pending:
+            return generate_maze(self.settings)
+        data = self.pending.popleft().get()
+        self.__fill_queue()
+        # Copied so that the terrain can be changed
+        return maze_from_buffer(bytearray(data))
+
+    def close(self):
+        # Stops the worker straight away, even in the middle of a maze
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.pending.clear()
+
+    def __fill_queue(self):
+        if self.pool is None:
+            return
+        while len(self.pending) < self.queue_size:
+            self.pending.append(self.pool.apply_async(generate_maze_bytes, (self.settings,)))
@@ -0,0 +1,96 @@
+# Per-frame timing of the game loop.
+# Each frame records how long its phases took and a few counts (tiles drawn, enemies
+# updated, ...). The last HISTORY_FRAMES frames are kept so that rolling percentiles
+# can be shown or written out, to catch the occasional slow frame
+
+import json
+import math
+import time
+from collections import deque
+
+HISTORY_FRAMES = 1000
+PERCENTILES = (50, 95, 99)
+
+class FrameProfiler:
+    def __init__(self, history_frames: int = HISTORY_FRAMES):
+        # Each frame is a dict of phase name -> seconds, and one of count name -> count
+        self.frame_times = deque(maxlen=history_frames)
+        self.frame_counts = deque(maxlen=history_frames)
+        self.frame_number = 0
+        self.__times = {}
+        self.__counts = {}
+
+    def begin_frame(self):
+        self.__times = {}
+        self.__counts = {}
+
+    def end_frame(self):
+        self.__times['frame'] = sum(self.__times.values())
+        self.frame_times.append(self.__times)
+        self.frame_counts.append(self.__counts)
+        self.frame_number += 1
+
+    def add_time(self, phase: str, seconds: float):
+        self.__times[phase] = self.__times.get(phase, 0) + seconds
+
+    def add_count(self, name: str, amount: int = 1):
+        self.__counts[name] = self.__counts.get(name, 0) + amount
+
+    def timed(self, phase: str):
+        # with profiler.timed('phase'): ... adds the time taken to the phase
+        return PhaseTimer(self, phase)
+
+    def last_frame(self):
+        # (times, counts) of the last finished frame
+        if len(self.frame_times) == 0:
+            return {}, {}
+        return self.frame_times[-1], self.frame_counts[-1]
+
+    def overlay_text(self):
+        times, counts = self.last_frame()
+        parts = [f'{phase} {seconds * 1000:.1f}ms' for phase, seconds in times.items()]
+        parts += [f'{name} {count}' for name, count in counts.items()]
+        return ' | '.join(parts)
+
+    def percentiles(self):
+        # {name: {'p50': ..., 'p95': ..., 'p99': ...}} over the kept frames,
+        # for every phase (in seconds) and every count
+        results = {}
+        for frames in (self.frame_times, self.frame_counts):
+            names = []
+            for frame in frames:
+                for name in frame:
+                    if name not in names:
+                        names.append(name)
+            for name in names:
+                # A phase that didn't happen in a frame counts as 0 for it
+                values = sorted(frame.get(name, 0) for frame in frames)
+                results[name] = {f'p{percentile}': percentile_of(values, percentile)
+                    for percentile in PERCENTILES}
+        return results
+
+    def export(self, path: str, **extra):
+        # Append one JSON line with the percentiles to path, along with anything in extra
+        record = dict(extra)
+        record['frames'] = len(self.frame_times)
+        record['percentiles'] = self.percentiles()
+        with open(path, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+class PhaseTimer:
+    def __init__(self, profiler: FrameProfiler, phase: str):
+        self.profiler = profiler
+        self.phase = phase
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.profiler.add_time(self.phase, time.perf_counter() - self.start_time)
+
+def percentile_of(sorted_values: list, percentile: float):
+    # Nearest-rank percentile of an already sorted list
+    if len(sorted_values) == 0:
+        return None
+    rank = max(math.ceil(len(sorted_values) * percentile / 100), 1)
+    return sorted_values[rank - 1]
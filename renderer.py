@@ -0,0 +1,108 @@
+import curses
+
+BLANK_CHAR = ' '
+# Added to a color pair number to draw it dimmed
+STYLE_DIM = 1 << 8
+# Unchanged cells between two changed ones are rewritten if there are
+# at most this many of them, as that is cheaper than moving the cursor
+MAX_RUN_GAP = 4
+
+class Renderer:
+    # Frames are built up with put() and put_string(),
+    # then flush() only writes the cells that differ from the last frame, in runs.
+    # Styles are color pair numbers, plus STYLE_DIM for dimmed text
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.begin_frame(0, 0)
+        self.invalidate()
+
+    def invalidate(self):
+        # Forget what is on screen (eg. after something else drew over it),
+        # so the next flush clears the screen and draws the frame in full
+        self.screen_chars = [[BLANK_CHAR] * self.width for _ in range(self.height)]
+        self.screen_styles = [[0] * self.width for _ in range(self.height)]
+        self.needs_clear = True
+
+    def begin_frame(self, width: int, height: int, background=None):
+        # background is an optional (chars, styles) pair of rows to start the frame
+        # from instead of a blank screen, which is copied (see RememberedLayer)
+        resized = width != self.width or height != self.height
+        self.width = width
+        self.height = height
+        if resized:
+            self.invalidate()
+        if background is not None:
+            chars, styles = background
+            self.chars = [row[:] for row in chars]
+            self.styles = [row[:] for row in styles]
+        else:
+            self.chars = [[BLANK_CHAR] * width for _ in range(height)]
+            self.styles = [[0] * width for _ in range(height)]
+
+    def put(self, x: int, y: int, char: str, style: int = 0):
+        # Anything outside the screen is ignored
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.chars[y][x] = char
+            self.styles[y][x] = style
+
+    def put_string(self, x: int, y: int, text: str, style: int = 0):
+        for offset, char in enumerate(text):
+            self.put(x + offset, y, char, style)
+
+    def changed_runs(self):
+        # Yields (x, y, text, style) for each run of cells that differ from what is on screen
+        for y in range(self.height):
+            chars = self.chars[y]
+            styles = self.styles[y]
+            old_chars = self.screen_chars[y]
+            old_styles = self.screen_styles[y]
+            if chars == old_chars and styles == old_styles:
+                continue
+
+            run_start = None
+            run_end = None
+            for x in range(self.width):
+                if chars[x] == old_chars[x] and styles[x] == old_styles[x]:
+                    continue
+
+                # Extend the current run over the gap if it is short and all one style
+                if run_start is not None and x - run_end <= MAX_RUN_GAP and \
+                    all(style == styles[run_start] for style in styles[run_end:x + 1]):
+                    run_end = x + 1
+                    continue
+
+                if run_start is not None:
+                    yield (run_start, y, ''.join(chars[run_start:run_end]), styles[run_start])
+                run_start = x
+                run_end = x + 1
+
+            if run_start is not None:
+                yield (run_start, y, ''.join(chars[run_start:run_end]), styles[run_start])
+
+    def present(self):
+        # Mark the current frame as being on screen
+        self.screen_chars = self.chars
+        self.screen_styles = self.styles
+        self.needs_clear = False
+
+    def flush(self, scr):
+        if self.needs_clear:
+            scr.erase()
+        for x, y, text, style in self.changed_runs():
+            try:
+                scr.addstr(y, x, text, style_attributes(style))
+            except curses.error:
+                # Writing the bottom-right cell leaves the cursor off the screen,
+                # which curses reports as an error even though the text was drawn
+                if y != self.height - 1 or x + len(text) != self.width:
+                    raise
+        self.present()
+
+def style_attributes(style: int):
+    # curses attributes to draw a style with
+    attributes = curses.color_pair(style & 0xff)
+    if style & STYLE_DIM:
+        attributes |= curses.A_DIM
+    return attributes
@@ -0,0 +1,267 @@
+# Recording of rounds, and replaying them without a terminal.
+# A round is fully decided by its maze seed, generation settings and the direction
+# given to each tick (enemies draw from a random generator seeded from the maze seed),
+# plus the view distance and any ticks where the time budget cut enemy updates short.
+# So that is all a replay stores, followed by a summary of how the round ended
+# to check a replay against.
+#
+# Layout (little endian):
+#     header      see HEADER below, followed by the settings as JSON
+#     events      one byte per tick (see DIRECTION_CODES), or an event code byte
+#                 followed by its argument, applying from the next tick on
+#     ending      END_CODE followed by ENDING
+#
+# Replay one or more files at full speed with:
+#     python replay.py FILE...
+
+import argparse
+import dataclasses
+import itertools
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+from misc import Direction
+from maze_generation import GenerationSettings, generate_maze, ENEMY_TYPES, \
+    GENERATION_VERSION
+from chunks import generate_endless_maze
+
+MAGIC = b'TMRP'
+# Older versions were recorded before moving enemies away from the player
+# followed their tracks (or while they went through other enemies on them),
+# so they don't play back the same
+FORMAT_VERSION = 5
+# magic, version, maze generation version, seed, endless, whether idle turns count as moves
+# (see MazeEngine), view distance, length of settings JSON
+HEADER = struct.Struct('<4sHHq??HH')
+# outcome number (NO_OUTCOME if unfinished), move count, player x, player y, state digest
+ENDING = struct.Struct('<BIiiI')
+NO_OUTCOME = 255
+# Only the most recent rounds are kept in replay_directory()
+MAX_SAVED_REPLAYS = 50
+
+# Tick bytes: 0 for standing still, else the direction's value + 1
+DIRECTION_CODES = {None: 0}
+DIRECTION_CODES.update({direction: direction.value + 1 for direction in Direction})
+CODE_DIRECTIONS = {code: direction for direction, code in DIRECTION_CODES.items()}
+# Followed by a uint16
+VIEW_DISTANCE_CODE = 0xf0
+# Followed by a uint32, the room tier cutoff of the next tick (see TickScheduler)
+ROOM_CUTOFF_CODE = 0xf1
+END_CODE = 0xff
+VIEW_DISTANCE = struct.Struct('<H')
+ROOM_CUTOFF = struct.Struct('<I')
+EVENT_ARGUMENTS = {
+    VIEW_DISTANCE_CODE: VIEW_DISTANCE,
+    ROOM_CUTOFF_CODE: ROOM_CUTOFF,
+    END_CODE: ENDING
+}
+
+class ReplayRecorder:
+    def __init__(self, seed: int, settings: GenerationSettings, endless: bool,
+        view_distance: int, count_idle_turns: bool = True):
+        self.seed = seed
+        self.settings = settings if settings is not None else GenerationSettings()
+        self.endless = endless
+        self.view_distance = view_distance
+        self.count_idle_turns = count_idle_turns
+        self.events = bytearray()
+        self.ending = None
+
+    def record_view_distance(self, view_distance: int):
+        self.events.append(VIEW_DISTANCE_CODE)
+        self.events += VIEW_DISTANCE.pack(view_distance)
+
+    def record_tick(self, direction: Direction, room_cutoff: int = None):
+        if room_cutoff is not None:
+            self.events.append(ROOM_CUTOFF_CODE)
+            self.events += ROOM_CUTOFF.pack(room_cutoff)
+        self.events.append(DIRECTION_CODES[direction])
+
+    def record_ending(self, engine):
+        self.ending = ending_of(engine)
+
+    def to_bytes(self):
+        settings_json = json.dumps(dataclasses.asdict(self.settings)).encode()
+        data = HEADER.pack(MAGIC, FORMAT_VERSION, GENERATION_VERSION, self.seed, self.endless,
+            self.count_idle_turns, self.view_distance, len(settings_json)) + settings_json + \
+            self.events
+        if self.ending is not None:
+            data += bytes([END_CODE]) + ENDING.pack(*self.ending)
+        return data
+
+    def save(self, path: str):
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+
+class Replay:
+    def __init__(self, seed: int, settings: GenerationSettings, endless: bool,
+        view_distance: int, events: bytes, ending: tuple = None, count_idle_turns: bool = True):
+        self.seed = seed
+        self.settings = settings
+        self.endless = endless
+        self.view_distance = view_distance
+        self.count_idle_turns = count_idle_turns
+        self.events = events
+        # As made by ending_of(), None if the recording stopped before the round ended
+        self.ending = ending
+
+def replay_from_bytes(data: bytes):
+    magic, version, generation_version, seed, endless, count_idle_turns, view_distance, \
+        settings_length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a replay file, or from an incompatible version')
+    if generation_version != GENERATION_VERSION:
+        raise ValueError('Recorded on mazes from a different version of the maze generator')
+    settings_start = HEADER.size
+    events_start = settings_start + settings_length
+    settings = GenerationSettings(**json.loads(data[settings_start:events_start]))
+
+    events = data[events_start:]
+    ending = None
+    for position, code, argument in iter_events(events):
+        if code == END_CODE:
+            ending = argument
+            events = events[:position]
+            break
+    return Replay(seed, settings, endless, view_distance, events, ending, count_idle_turns)
+
+def iter_events(events: bytes):
+    # Yields (position, code, argument) for each event, argument is None for ticks
+    position = 0
+    while position < len(events):
+        code = events[position]
+        if code in CODE_DIRECTIONS:
+            yield position, code, None
+            position += 1
+            continue
+        argument_format = EVENT_ARGUMENTS.get(code)
+        if argument_format is None:
+            raise ValueError(f'Unknown replay event {code:#x}')
+        argument = argument_format.unpack_from(events, position + 1)
+        if len(argument) == 1:
+            argument, = argument
+        yield position, code, argument
+        position += 1 + argument_format.size
+
+def load_replay(path: str):
+    with open(path, 'rb') as file:
+        return replay_from_bytes(file.read())
+
+def state_digest(engine):
+    # Checksum of where every walker is, to catch replays that go differently
+    # even if they end up with the same outcome
+    digest = 0
+    for walker in engine.maze.walkers:
+        digest = zlib.crc32(struct.pack('<Bii', type(walker) in ENEMY_TYPES, walker.x, walker.y),
+            digest)
+    return digest
+
+def ending_of(engine):
+    outcome = engine.outcome.value if engine.outcome is not None else NO_OUTCOME
+    return (outcome, engine.move_count, engine.player.x, engine.player.y, state_digest(engine))
+
+def replay_engine(replay: Replay):
+    # A fresh engine on the replay's maze
+    # (imported here as the engine records rounds with this module)
+    from engine import MazeEngine
+
+    if replay.endless:
+        start_x, start_y, maze = generate_endless_maze(replay.seed, replay.settings)
+    else:
+        start_x, start_y, maze = generate_maze(replay.settings, replay.seed)
+    # Room tier cutoffs come from the recording rather than the clock
+    return MazeEngine(maze, start_x, start_y, replay.view_distance, tick_budget=None,
+        count_idle_turns=replay.count_idle_turns)
+
+def run_replay(replay: Replay, engine=None):
+    # Play the replay on engine (a new one from replay_engine() if None) and return the engine
+    from engine import Outcome
+
+    if engine is None:
+        engine = replay_engine(replay)
+    for _, code, argument in iter_events(replay.events):
+        if code == VIEW_DISTANCE_CODE:
+            engine.view_distance = argument
+        elif code == ROOM_CUTOFF_CODE:
+            engine.scheduler.next_room_cutoff = argument
+        else:
+            engine.tick(CODE_DIRECTIONS[code])
+    # Quitting isn't an event, it only shows in the ending
+    if replay.ending is not None and replay.ending[0] == Outcome.QUIT.value and \
+        not engine.finished:
+        engine.quit()
+    return engine
+
+def replay_directory():
+    base = os.environ.get('XDG_STATE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'terminal-maze-game', 'replays')
+
+def save_replay(recorder: ReplayRecorder):
+    # Save the round to replay_directory(), removing the oldest ones beyond MAX_SAVED_REPLAYS.
+    # Returns the path it was saved to
+    directory = replay_directory()
+    os.makedirs(directory, exist_ok=True)
+    # Rounds on the same seed can end within a second of each other (as in the server started
+    # with --seed, where every session plays one seed), so a number is added until the name is
+    # unused.
+    # The file is made with 'x' so that another process can't take the name first either
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}-{recorder.seed}'
+    data = recorder.to_bytes()
+    for number in itertools.count(1):
+        suffix = '' if number == 1 else f'-{number}'
+        path = os.path.join(directory, f'{name}{suffix}.replay')
+        try:
+            with open(path, 'xb') as file:
+                file.write(data)
+            break
+        except FileExistsError:
+            pass
+
+    # The names start with the time, so they sort oldest first
+    saved = sorted(name for name in os.listdir(directory) if name.endswith('.replay'))
+    for name in saved[:-MAX_SAVED_REPLAYS]:
+        # Another session saving at the same time may have removed it already
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded rounds without a terminal')
+    parser.add_argument('replays', nargs='+', metavar='FILE')
+    args = parser.parse_args()
+
+    all_match = True
+    for path in args.replays:
+        try:
+            replay = load_replay(path)
+        except (OSError, ValueError, struct.error) as error:
+            print(f'{path}: can\'t replay ({error})')
+            all_match = False
+            continue
+        # Only time the ticks, not generating the maze
+        engine = replay_engine(replay)
+        start_time = time.perf_counter()
+        run_replay(replay, engine)
+        elapsed = time.perf_counter() - start_time
+        ticks = engine.scheduler.tick_number
+
+        if replay.ending is None:
+            result = 'no ending recorded'
+        elif ending_of(engine) == replay.ending:
+            result = 'matches'
+        else:
+            result = f'MISMATCH: recorded {replay.ending}, replayed {ending_of(engine)}'
+            all_match = False
+        print(f'{path}: {ticks} ticks in {elapsed:.3f}s ' +
+            f'({ticks / elapsed if elapsed else 0:.0f} ticks/s), {result}')
+    sys.exit(0 if all_match else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Decides which enemies get updated each tick, so that the cost of a tick depends on
+# what is near the player rather than on how many enemies are in the whole maze.
+#
+# Enemies are put in one of three tiers:
+#     near        within the near distance of the player, updated every tick
+#     room        in the player's room or a room connected to it by a passage,
+#                 updated every ROOM_TICK_INTERVAL ticks
+#     dormant     everything else, not updated until the player gets closer
+#
+# Moving enemies outside the near tier are on their tracks (see PatrolSwarm), where they
+# keep moving without being updated, so only chasing enemies end up in the other tiers
+
+import time
+
+from tiles import *
+from misc import *
+
+ROOM_TICK_INTERVAL = 4
+# Room tier updates stop for this tick once it has taken this long,
+# and the rest carry over to the next tick. None for no limit
+# (which makes ticks depend only on the game state, not on timing)
+TICK_BUDGET_SECONDS = 0.004
+
+class TickScheduler:
+    def __init__(self, maze, near_distance: int, room_tick_interval: int = ROOM_TICK_INTERVAL,
+        tick_budget: float = TICK_BUDGET_SECONDS):
+        self.maze = maze
+        self.near_distance = near_distance
+        self.room_tick_interval = room_tick_interval
+        self.tick_budget = tick_budget
+        self.tick_number = 0
+        # Room tier enemies still waiting for their update
+        self.pending = []
+        # If the budget stopped the room tier early last tick, how many
+        # pending enemies it got through (else None)
+        self.last_room_cutoff = None
+        # Set to stop the room tier after this many pending enemies on the next tick
+        # instead of going by the budget, to repeat a recorded cutoff exactly
+        self.next_room_cutoff = None
+
+    def near_enemies(self, player):
+        # Enemies inside the (aspect corrected) circle around the player
+        enemies = []
+        for walker in self.maze.tile_index.tiles_in_rect(
+            player.x - self.near_distance * 2, player.y - self.near_distance,
+            player.x + self.near_distance * 2, player.y + self.near_distance):
+            if walker is not player and \
+                distance_squared(walker.x / 2, walker.y, player.x / 2, player.y) < \
+                self.near_distance ** 2:
+                enemies.append(walker)
+        return enemies
+
+    def room_enemies(self, player):
+        room = self.maze.room_at(player.x, player.y)
+        if room is None:
+            return []
+        enemies = []
+        for nearby_room in [room] + room.connections:
+            for walker in self.maze.tile_index.tiles_in_rect(nearby_room.x, nearby_room.y,
+                nearby_room.right_x, nearby_room.bottom_y):
+                if walker is not player:
+                    enemies.append(walker)
+        return enemies
+
+    def tick(self, player, update):
+        # Calls update(enemy) for each enemy due this tick,
+        # and returns the number of enemies updated
+        start_time = time.perf_counter()
+        updated = set()
+        # Near enemies are found before any of them move,
+        # so one that moves further into the circle isn't updated twice
+        for enemy in self.near_enemies(player):
+            update(enemy)
+            updated.add(enemy)
+
+        if len(self.pending) == 0 and self.tick_number % self.room_tick_interval == 0:
+            self.pending = self.room_enemies(player)
+            self.pending.reverse()
+        self.last_room_cutoff = None
+        room_cutoff = self.next_room_cutoff
+        self.next_room_cutoff = None
+        pending_done = 0
+        while self.pending:
+            if room_cutoff is not None:
+                if pending_done == room_cutoff:
+                    break
+            elif self.tick_budget is not None and \
+                time.perf_counter() - start_time >= self.tick_budget:
+                self.last_room_cutoff = pending_done
+                break
+            pending_done += 1
+            enemy = self.pending.pop()
+            if enemy not in updated and enemy in self.maze.tile_index.tiles_at(enemy.x, enemy.y):
+                update(enemy)
+                updated.add(enemy)
+
+        self.tick_number += 1
+        return len(updated)
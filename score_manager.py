@@ -1,28 +1,188 @@
+import json
+import os
+import struct
+import tempfile
 from enum import Enum, unique
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import datetime
 
-# wrote this file without intellisense or testing it so have no idea if it is correct.
-# also need to figure out how to properly do data typing
+# Scores are kept in two files in score_directory():
+#     scores.log      every score ever made, as fixed size records that are only appended
+#     scores.index    JSON of the best scores of each profile, and how much of the log
+#                     it covers
+# Loading reads the index and only the part of the log written since the index was,
+# so it doesn't get slower as the history grows.
+# If the index is missing or broken it is rebuilt from the log
+
+# profile number, whether the seed is known, score, unix time, seed.
+# Every int64 is a valid seed, so an unknown one needs its own flag
+SCORE_RECORD = struct.Struct('<HBiqq')
+INDEX_VERSION = 1
+# Number of best scores kept in the index for each profile
+TOP_SCORES = 10
 
 @unique
 class ScoreProfile(Enum):
-    Defualt = 0
-
-@dataclass
-class ScoreHistory:
-    profiles: dict # dict of ScoreProfile to list of Score    
+    DEFAULT = 0
 
 @dataclass
 class Score:
     value: int
-    date = 5 # todo: how do dates work in python?
+    date: datetime = field(default_factory=datetime.now)
+    # Seed of the maze the score was made on, if known
+    seed: int = None
+
+@dataclass
+class ScoreHistory:
+    # Every score of each profile, oldest first
+    profiles: dict = field(default_factory=dict)
+
+class ProfileIndex:
+    # Best scores of one profile, best first
+    def __init__(self, count: int = 0, top: list = None):
+        self.count = count
+        self.top = top if top is not None else []
+
+    def add(self, score: Score):
+        self.count += 1
+        # Ties keep the earlier score first
+        position = len(self.top)
+        while position > 0 and self.top[position - 1].value < score.value:
+            position -= 1
+        self.top.insert(position, score)
+        del self.top[TOP_SCORES:]
+
+def score_directory():
+    base = os.environ.get('XDG_DATA_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'terminal-maze-game')
+
+def pack_score(score: Score, profile: ScoreProfile):
+    has_seed = score.seed is not None
+    return SCORE_RECORD.pack(profile.value, has_seed, score.value, int(score.date.timestamp()),
+        score.seed if has_seed else 0)
+
+def unpack_score(buffer, offset: int = 0):
+    # Returns (profile, score)
+    profile_number, has_seed, value, timestamp, seed = SCORE_RECORD.unpack_from(buffer, offset)
+    score = Score(value, datetime.fromtimestamp(timestamp), seed if has_seed else None)
+    return ScoreProfile(profile_number), score
 
 class ScoreManager:
-    # should this class be static or not?
-    score_file_path = os.path.join(get_settings_dir_somehow(), 'terminal-maze-game.json',  # todo: import os or maybe use proper paths instead
+    def __init__(self, directory: str = None):
+        if directory is None:
+            directory = score_directory()
+        self.log_path = os.path.join(directory, 'scores.log')
+        self.index_path = os.path.join(directory, 'scores.index')
+        self.profiles = {}
+        # Bytes of the log that self.profiles covers
+        self.log_size = 0
+        self.__load_index()
+        self.__catch_up()
+
+    def add_score(self, score: Score, profile: ScoreProfile = ScoreProfile.DEFAULT):
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        # A single write to a file opened for appending can't be interleaved with
+        # another process's, and a record cut short by a crash is ignored when reading
+        file_descriptor = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # Drop a record left half written by a crash, so the new one lines up
+            log_size = os.fstat(file_descriptor).st_size
+            if log_size % SCORE_RECORD.size != 0:
+                os.ftruncate(file_descriptor, log_size - log_size % SCORE_RECORD.size)
+            os.write(file_descriptor, pack_score(score, profile))
+            os.fsync(file_descriptor)
+        finally:
+            os.close(file_descriptor)
+        # Picks up the new score along with anything other games have added
+        self.__catch_up()
+        self.__save_index()
+
+    def top_scores(self, profile: ScoreProfile = ScoreProfile.DEFAULT, count: int = TOP_SCORES):
+        return list(self.__profile(profile).top[:count])
+
+    def personal_best(self, profile: ScoreProfile = ScoreProfile.DEFAULT):
+        top = self.__profile(profile).top
+        return top[0] if top else None
+
+    def score_count(self, profile: ScoreProfile = ScoreProfile.DEFAULT):
+        return self.__profile(profile).count
 
     def load_score_history(self) -> ScoreHistory:
-        return ScoreHistory()
+        # Reads the whole log, so only for when the full history is wanted
+        history = ScoreHistory()
+        for profile, score in self.__read_log(0):
+            history.profiles.setdefault(profile, []).append(score)
+        return history
+
+    def __profile(self, profile: ScoreProfile):
+        return self.profiles.get(profile, ProfileIndex())
+
+    def __read_log(self, start: int):
+        # Yields (profile, score) for each whole record from byte start onwards
+        try:
+            with open(self.log_path, 'rb') as file:
+                file.seek(start)
+                data = file.read()
+        except FileNotFoundError:
+            return
+        whole_records = len(data) // SCORE_RECORD.size
+        for idx in range(whole_records):
+            yield unpack_score(data, idx * SCORE_RECORD.size)
+
+    def __catch_up(self):
+        # Add the scores written to the log since self.log_size
+        try:
+            log_size = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            log_size = 0
+        if log_size < self.log_size:
+            # The log was replaced, start again
+            self.profiles = {}
+            self.log_size = 0
+        for profile, score in self.__read_log(self.log_size):
+            self.profiles.setdefault(profile, ProfileIndex()).add(score)
+            self.log_size += SCORE_RECORD.size
+
+    def __load_index(self):
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+            if index['version'] != INDEX_VERSION:
+                return
+            profiles = {}
+            for profile_number, profile_index in index['profiles'].items():
+                top = [Score(value, datetime.fromtimestamp(timestamp), seed)
+                    for value, timestamp, seed in profile_index['top']]
+                profiles[ScoreProfile(int(profile_number))] = \
+                    ProfileIndex(profile_index['count'], top)
+            self.profiles = profiles
+            self.log_size = index['log_size']
+        except (OSError, ValueError, KeyError, TypeError):
+            # Rebuilt from the log
+            self.profiles = {}
+            self.log_size = 0
 
-    def save_score_history(self, score_history)
-        pass
+    def __save_index(self):
+        index = {
+            'version': INDEX_VERSION,
+            'log_size': self.log_size,
+            'profiles': {
+                profile.value: {
+                    'count': profile_index.count,
+                    'top': [[score.value, int(score.date.timestamp()), score.seed]
+                        for score in profile_index.top]
+                }
+                for profile, profile_index in self.profiles.items()
+            }
+        }
+        # Write to a temporary file first so the index is never seen half written
+        directory = os.path.dirname(self.index_path)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'w') as file:
+                json.dump(index, file)
+            os.replace(temporary_path, self.index_path)
+        except:
+            os.remove(temporary_path)
+            raise
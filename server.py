@@ -0,0 +1,509 @@
+# Hosts many games at once in one process, for terminals connecting over TCP with telnet
+# (eg. `telnet localhost 4000`). Every connection is a session with its own maze, seed
+# and state, drawn with ANSI escape codes instead of curses. Sessions are asyncio tasks,
+# so one waiting for input (or with a slow connection) never holds up the others,
+# and mazes are generated in worker processes so that doesn't either.
+#
+# The server reports each session's latency (from a key arriving to the frame it caused
+# being written) every REPORT_SECONDS, and P in a session shows its own
+
+import argparse
+import asyncio
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from tiles import *
+from terrain import *
+from renderer import Renderer, STYLE_DIM
+from view import *
+from minimap import Minimap
+from engine import Outcome, engine_for_maze, round_score
+from replay import save_replay
+from game import TerminalMazeGame
+from main import add_game_arguments
+from maze_generation import GenerationSettings
+from maze_cache import maze_from_buffer
+from chunks import generate_endless_maze
+from pregeneration import generate_maze_bytes
+from clock import FixedTimestep, TICK_RATE
+from profiling import percentile_of, PERCENTILES
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 4000
+# Used until the client says how big its screen is
+DEFAULT_SCREEN_SIZE = (80, 24)
+# Clients can claim screens of up to 65535x65535, and every frame is made of
+# lists as big as the screen, so bigger sizes are cut down to these
+MAX_SCREEN_WIDTH = 400
+MAX_SCREEN_HEIGHT = 200
+REPORT_SECONDS = 10
+# Latencies kept per session for the percentiles
+LATENCY_HISTORY = 1000
+READ_SIZE = 1024
+
+# Telnet commands and options (RFC 854, 857, 858, 1073)
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+OPTION_ECHO = 1
+OPTION_SUPPRESS_GO_AHEAD = 3
+OPTION_NAWS = 31
+# Subnegotiations still without an end after this many bytes are dropped,
+# rather than waiting for the rest forever (a screen size takes at most 13)
+MAX_SUBNEGOTIATION_LENGTH = 64
+# The server echoes (ie. nothing is echoed) and there are no go aheads, which puts
+# clients in character at a time mode, and clients are asked for their screen size
+TELNET_NEGOTIATION = bytes([IAC, WILL, OPTION_ECHO, IAC, WILL, OPTION_SUPPRESS_GO_AHEAD,
+    IAC, DO, OPTION_NAWS])
+
+ESCAPE = 0x1b
+HIDE_CURSOR = '\x1b[?25l'
+SHOW_CURSOR = '\x1b[?25h'
+CLEAR_SCREEN = '\x1b[2J'
+RESET_STYLE = '\x1b[0m'
+# Key names are the same as curses' getkey() gives
+ANSI_KEYS = {
+    b'\x1b[A' : 'KEY_UP',
+    b'\x1b[B' : 'KEY_DOWN',
+    b'\x1b[C' : 'KEY_RIGHT',
+    b'\x1b[D' : 'KEY_LEFT',
+    b'\x1bOA' : 'KEY_UP',
+    b'\x1bOB' : 'KEY_DOWN',
+    b'\x1bOC' : 'KEY_RIGHT',
+    b'\x1bOD' : 'KEY_LEFT'
+}
+# Sent to the session instead of a key when the client's screen size changes
+RESIZE_KEY = 'KEY_RESIZE'
+# SGR codes of each color pair, the same colors as TerminalMazeGame sets up in curses
+ANSI_COLOR_PAIRS = {
+    FLOOR_COLOR_PAIR : '37;40',
+    DEATH_COLOR_PAIR : '31;47',
+    Player.COLOR_PAIR_NUMBER : '34;47',
+    FINISH_COLOR_PAIR : '32;47'
+}
+
+class TelnetInput:
+    # Turns the bytes a telnet client sends into keys and screen sizes,
+    # dropping the rest of the protocol. Sequences can be split across reads
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes):
+        # Returns a list of keys, and (width, height) tuples for screen sizes
+        self.buffer += data
+        events = []
+        buffer = self.buffer
+        position = 0
+        while position < len(buffer):
+            byte = buffer[position]
+            if byte == IAC:
+                length = self.__command_length(position)
+                if length is None:
+                    break
+                if buffer[position + 1] == SB:
+                    size = self.__screen_size(buffer[position + 2:position + length - 2])
+                    if size is not None:
+                        events.append(size)
+                position += length
+            elif byte == ESCAPE:
+                sequence = bytes(buffer[position:position + 3])
+                if sequence in ANSI_KEYS:
+                    events.append(ANSI_KEYS[sequence])
+                    position += 3
+                elif len(sequence) < 3 and \
+                    any(known.startswith(sequence) for known in ANSI_KEYS):
+                    # The rest of it hasn't arrived yet
+                    break
+                else:
+                    position += 1
+            else:
+                # Telnet ends lines with \r\0 or \r\n, which nothing uses
+                if byte < 0x80 and byte not in b'\r\n\0':
+                    events.append(chr(byte))
+                position += 1
+        del buffer[:position]
+        return events
+
+    def __command_length(self, position: int):
+        # Length of the telnet command starting at position, or None if it isn't all here
+        buffer = self.buffer
+        if position + 1 >= len(buffer):
+            return None
+        command = buffer[position + 1]
+        if command in (WILL, WONT, DO, DONT):
+            return 3 if position + 2 < len(buffer) else None
+        if command == SB:
+            end = position + 2
+            limit = min(len(buffer), position + MAX_SUBNEGOTIATION_LENGTH)
+            while end + 1 < limit:
+                if buffer[end] == IAC:
+                    if buffer[end + 1] == SE:
+                        return end + 2 - position
+                    # IAC IAC is an escaped 255 in the data
+                    end += 2
+                else:
+                    end += 1
+            if len(buffer) - position >= MAX_SUBNEGOTIATION_LENGTH:
+                # Too long to be anything the server uses, so it is skipped as it is
+                return MAX_SUBNEGOTIATION_LENGTH
+            return None
+        return 2
+
+    @staticmethod
+    def __screen_size(subnegotiation: bytes):
+        data = subnegotiation.replace(bytes([IAC, IAC]), bytes([IAC]))
+        if len(data) != 5 or data[0] != OPTION_NAWS:
+            return None
+        width = data[1] << 8 | data[2]
+        height = data[3] << 8 | data[4]
+        if width == 0 or height == 0:
+            # Client doesn't know
+            return None
+        return (min(width, MAX_SCREEN_WIDTH), min(height, MAX_SCREEN_HEIGHT))
+
+def ansi_style(style: int):
+    codes = ['0']
+    color_codes = ANSI_COLOR_PAIRS.get(style & 0xff)
+    if color_codes is not None:
+        codes.append(color_codes)
+    if style & STYLE_DIM:
+        codes.append('2')
+    return f'\x1b[{";".join(codes)}m'
+
+def ansi_frame(renderer: Renderer):
+    # Escape codes for the cells of the renderer's frame that differ from what is
+    # on the client's screen (like Renderer.flush() does with curses)
+    parts = []
+    if renderer.needs_clear:
+        parts.append(RESET_STYLE + CLEAR_SCREEN)
+    current_style = None
+    for x, y, text, style in renderer.changed_runs():
+        parts.append(f'\x1b[{y + 1};{x + 1}H')
+        if style != current_style:
+            parts.append(ansi_style(style))
+            current_style = style
+        parts.append(text)
+    renderer.present()
+    return ''.join(parts)
+
+class ClientGone(Exception):
+    pass
+
+class MazeSession:
+    def __init__(self, server, number: int, reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter):
+        self.server = server
+        self.number = number
+        self.reader = reader
+        self.writer = writer
+        self.screen_width, self.screen_height = DEFAULT_SCREEN_SIZE
+        self.telnet_input = TelnetInput()
+        # (key, time it arrived), with a key of None when the client has gone
+        self.keys = asyncio.Queue()
+        self.renderer = Renderer()
+        self.remembered = RememberedLayer()
+        self.view_distance = TerminalMazeGame.VIEW_DISTANCE
+        self.show_latency = False
+        self.show_minimap = False
+        self.engine = None
+        # Seconds from each key arriving to its frame being written
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+        self.inputs_since_report = 0
+
+    async def run(self):
+        read_task = asyncio.create_task(self.__read_input())
+        try:
+            self.writer.write(TELNET_NEGOTIATION + HIDE_CURSOR.encode())
+            while await self.__play_round():
+                pass
+            self.writer.write((RESET_STYLE + CLEAR_SCREEN + '\x1b[H' + SHOW_CURSOR).encode())
+            await self.writer.drain()
+        except (ConnectionError, ClientGone):
+            pass
+        finally:
+            read_task.cancel()
+            self.writer.close()
+
+    async def __read_input(self):
+        while True:
+            try:
+                data = await self.reader.read(READ_SIZE)
+            except ConnectionError:
+                data = b''
+            received = time.perf_counter()
+            if not data:
+                await self.keys.put((None, received))
+                return
+            for event in self.telnet_input.feed(data):
+                if isinstance(event, tuple):
+                    self.screen_width, self.screen_height = event
+                    event = RESIZE_KEY
+                await self.keys.put((event, received))
+
+    async def __next_key(self, timeout: float = None):
+        # Returns (key, time it arrived), or (None, None) if timeout runs out first
+        try:
+            key, received = await asyncio.wait_for(self.keys.get(), timeout)
+        except asyncio.TimeoutError:
+            return None, None
+        if key is None:
+            raise ClientGone()
+        return key, received
+
+    async def __play_round(self):
+        # Returns whether to play another round
+        self.engine = await self.server.new_engine(self.view_distance)
+        self.player = self.engine.player
+        self.engine.update_seen()
+        self.minimap = Minimap(self.engine, self.server.endless)
+        self.pan_x = self.player.x - self.screen_width // 2
+        self.pan_y = self.player.y - self.screen_height // 2
+        self.renderer.invalidate()
+        await self.__draw_frame()
+
+        try:
+            await self.__play_turns()
+        except (ConnectionError, ClientGone):
+            # Losing the client part way through counts as quitting the round
+            if not self.engine.finished:
+                self.engine.quit()
+            await self.__save_replay()
+            raise
+        await self.__save_replay()
+        return await self.__show_outcome()
+
+    async def __play_turns(self):
+        timestep = FixedTimestep(self.server.tick_rate) if self.server.realtime else None
+        direction = None
+        while not self.engine.finished:
+            timeout = timestep.seconds_until_next_tick() if timestep is not None else None
+            key, received = await self.__next_key(timeout)
+            if key is not None:
+                if key.lower() == 'q':
+                    self.engine.quit()
+                    break
+                if self.__keybinds(key):
+                    # Changing options doesn't use up a turn
+                    pass
+                elif timestep is None and key != RESIZE_KEY:
+                    self.__tick(self.__key_to_direction(key))
+                else:
+                    direction = self.__key_to_direction(key) or direction
+            if timestep is not None:
+                for _ in range(timestep.due_ticks()):
+                    self.__tick(direction)
+                    direction = None
+                    if self.engine.finished:
+                        break
+            await self.__draw_frame(received)
+
+    async def __save_replay(self):
+        # Every round is recorded, as in the game. Saved in a thread so that a slow disk
+        # doesn't hold up the other sessions
+        try:
+            await asyncio.to_thread(save_replay, self.engine.recorder)
+        except (OSError, struct.error):
+            pass
+
+    def __tick(self, direction: Direction):
+        self.engine.tick(direction)
+        self.engine.update_seen()
+        self.pan_x, self.pan_y = pan_to_follow(self.pan_x, self.pan_y, self.player.x,
+            self.player.y, self.screen_width, self.screen_height)
+
+    def __keybinds(self, key: str):
+        # Keys that change options rather than moving. Returns whether key was one of them
+        step = TerminalMazeGame.VIEW_DISTANCE_STEP
+        if key in ('+', '='):
+            self.__set_view_distance(self.view_distance + step)
+        elif key in ('-', '_'):
+            self.__set_view_distance(self.view_distance - step)
+        elif key in ('p', 'P'):
+            self.show_latency = not self.show_latency
+        elif key in ('m', 'M'):
+            self.show_minimap = not self.show_minimap
+        else:
+            return False
+        return True
+
+    def __set_view_distance(self, view_distance: int):
+        self.view_distance = min(max(view_distance, TerminalMazeGame.MIN_VIEW_DISTANCE),
+            TerminalMazeGame.MAX_VIEW_DISTANCE)
+        self.engine.view_distance = self.view_distance
+
+    def __key_to_direction(self, key: str):
+        keybinds = TerminalMazeGame.KEYBINDS
+        if key in keybinds:
+            return keybinds[key]
+        return keybinds.get(key.lower())
+
+    async def __draw_frame(self, key_received: float = None):
+        width = self.screen_width
+        height = self.screen_height
+        self.renderer.begin_frame(width, height,
+            self.remembered.update(self.engine, self.pan_x, self.pan_y, width, height))
+        draw_lit_tiles(self.renderer, self.engine, self.player.x, self.player.y,
+            pan_x=self.pan_x, pan_y=self.pan_y, remembered=self.remembered)
+        self.minimap.update()
+        if self.show_minimap:
+            minimap_size = self.minimap.size(width, height)
+            if minimap_size is not None:
+                self.minimap.draw(self.renderer, width - minimap_size[0], 0, width, height)
+        lines = hud_lines(self.engine, width)
+        if self.show_latency:
+            lines.insert(0, self.latency_text()[:width])
+        for idx, line in enumerate(lines):
+            self.renderer.put_string(0, height - (len(lines) - idx), line, 0)
+        self.writer.write(ansi_frame(self.renderer).encode())
+        if key_received is not None:
+            self.latencies.append(time.perf_counter() - key_received)
+            self.inputs_since_report += 1
+        # Only waits if this client isn't keeping up, which holds up nobody else
+        await self.writer.drain()
+
+    async def __show_outcome(self):
+        if self.engine.outcome == Outcome.QUIT:
+            return False
+        if self.engine.outcome == Outcome.WIN:
+            text = f'Yay you won in {self.engine.move_count} moves. ' + \
+                f'You scored {round_score(self.engine.move_count, self.engine.maze.par)}'
+            if self.engine.maze.par is not None:
+                text += f'\nPar was {self.engine.maze.par}'
+        else:
+            text = 'Haha you died'
+        text += '\nPress Q to exit'
+        text += '\nPress R to play again'
+        screen = RESET_STYLE + CLEAR_SCREEN
+        for idx, line in enumerate(center_text(text, self.screen_width).split('\n')):
+            screen += f'\x1b[{self.screen_height // 2 + idx + 1};1H' + line
+        self.writer.write(screen.encode())
+        await self.writer.drain()
+
+        while True:
+            key, _ = await self.__next_key()
+            if key.lower() == 'q':
+                return False
+            elif key.lower() == 'r':
+                return True
+
+    def latency_text(self):
+        # eg. 'latency ms p50 0.31 p95 0.52 p99 0.80'
+        latencies = sorted(self.latencies)
+        if len(latencies) == 0:
+            return 'latency: no input yet'
+        text = 'latency ms'
+        for percentile in PERCENTILES:
+            text += f' p{percentile} {percentile_of(latencies, percentile) * 1000:.2f}'
+        return text
+
+class MazeServer:
+    def __init__(self, settings: GenerationSettings = None, endless: bool = False,
+        seed: int = None, realtime: bool = False, tick_rate: float = TICK_RATE,
+        workers: int = None, report_seconds: float = REPORT_SECONDS, report_file=sys.stderr):
+        self.settings = settings
+        self.endless = endless
+        # If set, every session plays the maze from this seed, else each round gets its own
+        self.seed = seed
+        self.realtime = realtime
+        self.tick_rate = tick_rate
+        self.report_seconds = report_seconds
+        self.report_file = report_file
+        self.sessions = set()
+        self.sessions_started = 0
+        # Endless mazes are generated a chunk at a time as they are played,
+        # so only fixed size ones go to the workers
+        self.executor = ProcessPoolExecutor(workers) if not endless else None
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        server = await asyncio.start_server(self.__handle_connection, host, port)
+        report_task = asyncio.create_task(self.__report_loop())
+        print(f'Serving on {host}:{port}', file=self.report_file, flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            report_task.cancel()
+            self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    async def new_engine(self, view_distance: int):
+        if self.endless:
+            start_x, start_y, maze = generate_endless_maze(self.seed, self.settings)
+        else:
+            data = await asyncio.get_running_loop().run_in_executor(self.executor,
+                generate_maze_bytes, self.settings, self.seed)
+            # Copied so that the terrain can be changed
+            start_x, start_y, maze = maze_from_buffer(bytearray(data))
+        return engine_for_maze(start_x, start_y, maze, view_distance, self.settings,
+            self.endless, count_idle_turns=not self.realtime)
+
+    async def __handle_connection(self, reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter):
+        self.sessions_started += 1
+        session = MazeSession(self, self.sessions_started, reader, writer)
+        self.sessions.add(session)
+        try:
+            await session.run()
+        finally:
+            self.sessions.remove(session)
+            self.__report_session(session)
+
+    async def __report_loop(self):
+        while True:
+            await asyncio.sleep(self.report_seconds)
+            self.report()
+
+    def report(self):
+        # A line for each session that had input since the last report
+        print(f'{len(self.sessions)} sessions', file=self.report_file)
+        for session in sorted(self.sessions, key=lambda session: session.number):
+            if session.inputs_since_report > 0:
+                self.__report_session(session)
+        self.report_file.flush()
+
+    def __report_session(self, session: MazeSession):
+        seed = session.engine.maze.seed if session.engine is not None else None
+        print(f'session {session.number} (seed {seed}): {session.inputs_since_report} inputs, '
+            f'{session.latency_text()}', file=self.report_file, flush=True)
+        session.inputs_since_report = 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Host many games of the maze game for telnet clients')
+    add_game_arguments(parser)
+    parser.add_argument('--host', default=DEFAULT_HOST,
+        help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+        help='port to listen on (default: %(default)s)')
+    parser.add_argument('--workers', type=int,
+        help='processes generating mazes (default: one per CPU)')
+    parser.add_argument('--report-seconds', type=float, default=REPORT_SECONDS,
+        help='how often to report session latencies (default: %(default)s)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    settings = GenerationSettings().scaled_to(args.width, args.height)
+    server = MazeServer(settings, args.endless, args.seed, args.realtime, args.tick_rate,
+        args.workers, args.report_seconds)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# Snapshots of a round in progress, so that it can be carried on after quitting
+# (or after the terminal went away, as the game saves one every few moves).
+# Everything the round needs to go on exactly as it would have is stored: the terrain,
+# every walker, the scheduler's place, the enemies' random generator and the replay so far,
+# so a resumed round still replays correctly. Only fixed size mazes can be saved.
+#
+# Walkers are referred to by number: the moving enemies by their slot in the maze's
+# PatrolSwarm, then the other enemies, then the player. Moving enemies on their track
+# aren't in the tile index, so it has fewer walkers (index_count) than the maze.
+#
+# Layout (little endian):
+#     header      see HEADER below, followed by the settings as JSON
+#     terrain     width * height bytes of terrain flags, row by row
+#     rooms       room_count * 4 int32s and connection_count * 2 int32s, as in maze_cache
+#     patrollers  the PatrolSwarm's arrays, one after another (see SWARM_COLUMNS)
+#     others      other_count bytes of the enemy's number in ENEMY_TYPES,
+#                 then other_count int32 xs and other_count int32 ys
+#     order       walker_count int32s, walker numbers in the order of maze.walkers
+#     index       index_count int32s, walker numbers in the tile index's order
+#     pending     pending_count int32s, walker numbers of the scheduler's pending enemies
+#     random      RANDOM_STATE_SIZE uint32s, the state of the enemies' random generator
+#     seen        seen_block_count pairs of int32s (block x, block y),
+#                 then the blocks themselves (see SeenMap)
+#     events      the replay events recorded so far
+
+import dataclasses
+import json
+import os
+import struct
+import tempfile
+from array import array
+
+from tiles import *
+from terrain import Terrain
+from maze import Maze
+from maze_generation import GenerationSettings, ENEMY_TYPES
+from maze_cache import pack_rooms, unpack_rooms, index_rooms
+from engine import MazeEngine
+from fov import SeenMap
+from replay import ReplayRecorder
+
+MAGIC = b'TMSS'
+FORMAT_VERSION = 4
+# magic, version, seed, width, height, par (-1 if not known), view distance,
+# view distance the replay started with, move count, whether idle turns count as moves
+# (see MazeEngine), scheduler tick number, pan x, pan y,
+# player x, player y, patroller count, patrol clock, other enemy count, room count,
+# connection count, index count, pending count, seen block count, length of replay events,
+# length of settings JSON
+HEADER = struct.Struct('<4sHqIIiHHI?IiiiiIIIIIIIIII')
+# (name, array type code, values for each enemy) of each PatrolSwarm array,
+# in the order they are stored
+SWARM_COLUMNS = [('xs', 'i', 1), ('ys', 'i', 1), ('dxs', 'b', 1), ('dys', 'b', 1),
+    ('moved', 'b', 1), ('states', 'b', 1), ('tracks', 'i', PatrolSwarm.TRACK_FIELDS)]
+# Words in the state of a random.Random (the Mersenne Twister state and its position)
+RANDOM_STATE_SIZE = 625
+
+SNAPSHOT_FILE_NAME = 'round.snapshot'
+
+def snapshot_to_bytes(engine, pan_x: int = 0, pan_y: int = 0):
+    # The engine must have a ReplayRecorder, and a maze that isn't endless
+    maze = engine.maze
+    recorder = engine.recorder
+    if recorder is None or recorder.endless:
+        raise ValueError('Only rounds on fixed size mazes can be saved')
+
+    swarm = maze.patrollers
+    others = [walker for walker in maze.walkers
+        if type(walker) != MovingEnemy and walker is not engine.player]
+    walker_numbers = {id(walker): number
+        for number, walker in enumerate(swarm.enemies + others + [engine.player])}
+    other_types = bytes(ENEMY_TYPES.index(type(walker)) for walker in others)
+    other_xs = array('i', (walker.x for walker in others))
+    other_ys = array('i', (walker.y for walker in others))
+    walker_order = array('i', (walker_numbers[id(walker)] for walker in maze.walkers))
+    # Walkers are found in this order, so it is kept for the round to go on the same way
+    index_order = array('i', (walker_numbers[id(walker)]
+        for bucket in maze.tile_index.buckets.values() for walker in bucket))
+    pending = array('i', (walker_numbers[id(walker)] for walker in engine.scheduler.pending))
+
+    # Enemies only use the generator through uniform(), so there is never a cached
+    # gauss() value to store
+    _, random_state, _ = engine.rng.getstate()
+    random_state = array('I', random_state)
+
+    seen_blocks = engine.seen.blocks
+    seen_positions = array('i')
+    for block_x, block_y in seen_blocks:
+        seen_positions.extend((block_x, block_y))
+
+    rooms, connections = pack_rooms(maze.rooms)
+    settings_json = json.dumps(dataclasses.asdict(recorder.settings)).encode()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, maze.seed or 0, maze.terrain.width,
+        maze.terrain.height, -1 if maze.par is None else maze.par, engine.view_distance,
+        recorder.view_distance, engine.move_count, engine.count_idle_turns,
+        engine.scheduler.tick_number, pan_x, pan_y,
+        engine.player.x, engine.player.y, len(swarm), swarm.clock, len(others),
+        len(rooms) // 4, len(connections) // 2, len(index_order), len(pending),
+        len(seen_blocks), len(recorder.events), len(settings_json))
+    return b''.join([header, settings_json, bytes(maze.terrain.cells), rooms.tobytes(),
+        connections.tobytes()] +
+        [getattr(swarm, name).tobytes() for name, _, _ in SWARM_COLUMNS] +
+        [other_types, other_xs.tobytes(), other_ys.tobytes(), walker_order.tobytes(),
+        index_order.tobytes(), pending.tobytes(), random_state.tobytes(),
+        seen_positions.tobytes()] + list(seen_blocks.values()) + [recorder.events])
+
+def snapshot_from_buffer(buffer):
+    # Returns (engine, pan_x, pan_y) with the round just as it was saved
+    magic, version, seed, width, height, par, view_distance, recorded_view_distance, \
+        move_count, count_idle_turns, tick_number, pan_x, pan_y, player_x, player_y, \
+        patroller_count, patrol_clock, other_count, room_count, connection_count, index_count, \
+        pending_count, seen_block_count, events_length, settings_length = \
+        HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a snapshot file, or from an incompatible version')
+    walker_count = patroller_count + other_count + 1
+
+    position = HEADER.size
+    def take(length: int):
+        nonlocal position
+        start = position
+        position += length
+        if position > len(buffer):
+            raise ValueError('Snapshot file is truncated')
+        return buffer[start:position]
+    def take_array(type_code: str, count: int):
+        values = array(type_code)
+        values.frombytes(take(count * values.itemsize))
+        return values
+
+    settings = GenerationSettings(**json.loads(take(settings_length)))
+    terrain = Terrain(width, height, bytearray(take(width * height)))
+    rooms = unpack_rooms(take_array('i', room_count * 4), take_array('i', connection_count * 2))
+    swarm_columns = [take_array(type_code, patroller_count * values_each)
+        for _, type_code, values_each in SWARM_COLUMNS]
+    other_types = take(other_count)
+    other_xs = take_array('i', other_count)
+    other_ys = take_array('i', other_count)
+    walker_order = take_array('i', walker_count)
+    index_order = take_array('i', index_count)
+    pending = take_array('i', pending_count)
+    random_state = take_array('I', RANDOM_STATE_SIZE)
+    seen_positions = take_array('i', seen_block_count * 2)
+    block_length = SeenMap.BLOCK_SIZE * SeenMap.BLOCK_SIZE
+    seen_blocks = {(seen_positions[idx * 2], seen_positions[idx * 2 + 1]):
+        bytearray(take(block_length)) for idx in range(seen_block_count)}
+    events = bytearray(take(events_length))
+
+    # The walkers are put in after the engine has added the player,
+    # so that the walker list and tile index can be made in the saved order in one go
+    maze = Maze(terrain, [], seed, rooms, index_rooms(rooms), None if par == -1 else par)
+    engine = MazeEngine(maze, player_x, player_y, view_distance,
+        count_idle_turns=count_idle_turns)
+    walkers = maze.patrollers.add_packed(*swarm_columns)
+    maze.patrollers.clock = patrol_clock
+    walkers += [ENEMY_TYPES[enemy_type](x, y)
+        for enemy_type, x, y in zip(other_types, other_xs, other_ys)]
+    walkers.append(engine.player)
+    maze.walkers = [walkers[number] for number in walker_order]
+    maze.tile_index = TileIndex(walkers[number] for number in index_order)
+
+    engine.move_count = move_count
+    engine.scheduler.tick_number = tick_number
+    engine.scheduler.pending = [walkers[number] for number in pending]
+    engine.rng.setstate((3, tuple(random_state), None))
+    engine.seen.blocks = seen_blocks
+    engine.recorder = ReplayRecorder(seed, settings, False, recorded_view_distance,
+        count_idle_turns)
+    engine.recorder.events = events
+    return engine, pan_x, pan_y
+
+def snapshot_path():
+    base = os.environ.get('XDG_STATE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'terminal-maze-game', SNAPSHOT_FILE_NAME)
+
+def save_snapshot(engine, pan_x: int = 0, pan_y: int = 0, path: str = None):
+    # Written to a temporary file first, so that a crash while saving
+    # leaves the previous snapshot rather than half of this one
+    if path is None:
+        path = snapshot_path()
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file:
+            file.write(snapshot_to_bytes(engine, pan_x, pan_y))
+        os.replace(temporary_path, path)
+    except:
+        os.remove(temporary_path)
+        raise
+
+def load_snapshot(path: str = None):
+    # Returns (engine, pan_x, pan_y), or None if there is no snapshot
+    if path is None:
+        path = snapshot_path()
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+    return snapshot_from_buffer(data)
+
+def remove_snapshot(path: str = None):
+    # For when the round has ended, so it can't be resumed
+    if path is None:
+        path = snapshot_path()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,111 @@
+# Static maze terrain, stored as one byte of flags per cell
+
+from functools import lru_cache
+
+# Cell flags
+FLOOR = 1 << 0
+PASSAGE = 1 << 1
+# Set alongside PASSAGE when the passage runs up/down (only changes how it is drawn)
+PASSAGE_VERTICAL = 1 << 2
+DEATH = 1 << 3
+FINISH = 1 << 4
+
+FLOOR_COLOR_PAIR = 1
+DEATH_COLOR_PAIR = 2
+FINISH_COLOR_PAIR = 4
+
+class Terrain:
+    def __init__(self, width: int, height: int, cells=None):
+        self.width = width
+        self.height = height
+        if cells is None:
+            cells = bytearray(width * height)
+        self.cells = cells
+
+    def in_bounds(self, x: int, y: int):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x: int, y: int):
+        # Anything outside the grid is solid wall
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[y * self.width + x]
+        return 0
+
+    def find_flags(self, flags: int):
+        # Yields (x, y) of every cell with any of flags set, row by row.
+        # The cells are first turned into 0s and 1s so that find() can skip between them
+        marks = bytes(self.cells).translate(has_flags_table(flags))
+        position = marks.find(1)
+        while position != -1:
+            yield (position % self.width, position // self.width)
+            position = marks.find(1, position + 1)
+
+    def run_through(self, x: int, y: int, vertical: bool, table: bytes):
+        # (first, last) x (or y if vertical) of the unbroken run of cells through (x, y)
+        # along its row (or column) that table (see run_table) maps to 1,
+        # or None if (x, y) isn't one of them
+        if not self.in_bounds(x, y):
+            return None
+        if vertical:
+            line = self.cells[x::self.width]
+            position = y
+        else:
+            line = self.cells[y * self.width:(y + 1) * self.width]
+            position = x
+        marks = bytes(line).translate(table)
+        if not marks[position]:
+            return None
+        end = marks.find(0, position)
+        if end == -1:
+            end = len(marks)
+        return (marks.rfind(0, 0, position) + 1, end - 1)
+
+    def add_flags(self, x: int, y: int, flags: int):
+        if self.in_bounds(x, y):
+            self.cells[y * self.width + x] |= flags
+
+    def fill_rect(self, x: int, y: int, width: int, height: int, flags: int):
+        # Set flags on every cell in the rectangle, clipped to the grid.
+        # Each row is done in one go with a lookup table that ORs in the flags
+        left = max(x, 0)
+        right = min(x + width, self.width)
+        if left >= right:
+            return
+        table = or_table(flags)
+        for row in range(max(y, 0), min(y + height, self.height)):
+            start = row * self.width
+            self.cells[start + left:start + right] = \
+                self.cells[start + left:start + right].translate(table)
+
+@lru_cache(maxsize=None)
+def has_flags_table(flags: int):
+    # Translation table mapping every byte to 1 if it has any of flags set, else 0
+    return bytes(1 if value & flags else 0 for value in range(256))
+
+@lru_cache(maxsize=None)
+def run_table(walkable_mask: int, blocked_mask: int):
+    # Translation table mapping every byte to 1 if a walker with these masks can stand there
+    return bytes(1 if value & walkable_mask and not value & blocked_mask else 0
+        for value in range(256))
+
+@lru_cache(maxsize=None)
+def or_table(flags: int):
+    # Translation table mapping every byte to itself with flags set
+    return bytes(value | flags for value in range(256))
+
+def cell_appearance(flags: int):
+    # Returns (char, color pair number) for a cell, or None if there is nothing to draw.
+    # Priority matches the order the old tile list was drawn in
+    if flags & FINISH:
+        return ('\u2588', FINISH_COLOR_PAIR)
+    elif flags & DEATH:
+        return ('X', DEATH_COLOR_PAIR)
+    elif flags & PASSAGE:
+        # \u2587 and \u2589 are a nearly-filled-in-rectangle characters
+        if flags & PASSAGE_VERTICAL:
+            return ('\u2587', FLOOR_COLOR_PAIR)
+        return ('\u2589', FLOOR_COLOR_PAIR)
+    elif flags & FLOOR:
+        # \u2588 is a filled-in-rectangle character
+        return ('\u2588', FLOOR_COLOR_PAIR)
+    return None
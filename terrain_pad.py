@@ -0,0 +1,95 @@
+import curses
+
+from renderer import BLANK_CHAR, style_attributes
+
+# Mazes with more cells than this (or endless ones) are drawn with the Renderer instead,
+# as the pad would take up too much memory
+MAX_PAD_CELLS = 4000000
+# curses can't make pads bigger than this either way
+MAX_PAD_SIZE = 32767
+
+class TerrainPad:
+    # The whole map drawn into a curses pad in map coordinates, so that panning is just
+    # showing a different part of it rather than redrawing the screen.
+    # The pad holds the base layer (what base_appearance(x, y) gives, eg. remembered
+    # terrain) with the frame's changing cells (what is lit, walkers) drawn over it.
+    # Each frame only the changing cells that differ from last frame are written,
+    # and cells that stopped changing go back to their base appearance.
+    # The pad reaches margin cells past each edge of the map so the view can pan
+    # past the edges
+
+    def __init__(self, width: int, height: int, margin_x: int, margin_y: int,
+        base_appearance, base_cells=()):
+        # base_appearance(x, y) gives (char, style) or None for blank,
+        # base_cells are the cells that aren't blank to start with
+        self.width = width
+        self.height = height
+        self.margin_x = margin_x
+        self.margin_y = margin_y
+        self.base_appearance = base_appearance
+        self.pad = curses.newpad(height + margin_y * 2, width + margin_x * 2)
+        self.cells = {}
+        self.last_cells = {}
+        for x, y in base_cells:
+            self.__restore(x, y)
+
+    @staticmethod
+    def fits(width: int, height: int, margin_x: int, margin_y: int):
+        pad_width = width + margin_x * 2
+        pad_height = height + margin_y * 2
+        return pad_width * pad_height <= MAX_PAD_CELLS and \
+            pad_width <= MAX_PAD_SIZE and pad_height <= MAX_PAD_SIZE
+
+    def begin_frame(self):
+        self.cells = {}
+
+    def put(self, x: int, y: int, char: str, style: int = 0):
+        # Draw over the base layer at map position (x, y) for this frame
+        self.cells[(x, y)] = (char, style)
+
+    def end_frame(self):
+        # Write the frame's changes into the pad
+        last_cells = self.last_cells
+        for position, appearance in self.cells.items():
+            if last_cells.get(position) != appearance:
+                self.__write(position[0], position[1], *appearance)
+        for position in last_cells:
+            if position not in self.cells:
+                self.__restore(*position)
+        self.last_cells = self.cells
+
+    def touch(self):
+        # Make the next show() copy all of the pad to the screen,
+        # not just what changed (eg. after another window covered part of it)
+        self.pad.touchwin()
+
+    def show(self, pan_x: int, pan_y: int, screen_top: int, screen_width: int,
+        screen_height: int):
+        # Queue the part of the map with its top left at (pan_x, pan_y) to be shown
+        # on screen_height rows starting at screen_top (call curses.doupdate() to show it).
+        # Panning further than the margins stops at the edge of the pad
+        if screen_height <= 0 or screen_width <= 0:
+            return
+        pad_height, pad_width = self.pad.getmaxyx()
+        pad_y = min(max(pan_y + self.margin_y, 0), max(pad_height - screen_height, 0))
+        pad_x = min(max(pan_x + self.margin_x, 0), max(pad_width - screen_width, 0))
+        self.pad.noutrefresh(pad_y, pad_x, screen_top, 0,
+            screen_top + screen_height - 1, screen_width - 1)
+
+    def __restore(self, x: int, y: int):
+        appearance = self.base_appearance(x, y)
+        if appearance is None:
+            self.__write(x, y, BLANK_CHAR, 0)
+        else:
+            self.__write(x, y, *appearance)
+
+    def __write(self, x: int, y: int, char: str, style: int):
+        pad_x = x + self.margin_x
+        pad_y = y + self.margin_y
+        if 0 <= pad_x < self.width + self.margin_x * 2 and \
+            0 <= pad_y < self.height + self.margin_y * 2:
+            try:
+                self.pad.addstr(pad_y, pad_x, char, style_attributes(style))
+            except curses.error:
+                # Same as the bottom-right cell of the screen (see Renderer.flush)
+                pass
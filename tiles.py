@@ -1,9 +1,9 @@
 import random
+from array import array
 from abc import ABC, abstractmethod
 
-import curses
-
 from misc import *
+from terrain import *
 
 class Tile:
     COLOR_PAIR_NUMBER = 1
@@ -13,83 +13,133 @@ class Tile:
         self.y = y
         self.char = char
     
-    def update(self, scr, tiles, *args):
+    def update(self, scr, maze, *args):
         pass
     
-    def draw(self, scr, pan_x=0, pan_y=0):
-        # Drawing outside the screen will throw an error so catch that
-        try:
-            scr.move(self.y - pan_y, self.x - pan_x)
-            scr.addch(self.char, curses.color_pair(self.COLOR_PAIR_NUMBER))
-        except:
-            pass
+    def draw(self, renderer, pan_x=0, pan_y=0):
+        renderer.put(self.x - pan_x, self.y - pan_y, self.char, self.COLOR_PAIR_NUMBER)
     
     def get_true_pos(self, pan_x=0, pan_y=0):
         return (self.x - pan_x, self.y - pan_y)
 
-class FloorTile(Tile):
-    def __init__(self, x: int, y: int):
-        # \u2588 is a filled-in-rectangle character
-        super().__init__(x, y, '\u2588')
-
-class PassageFloorTile(Tile):
-    # A floor tile used for in and around entrances of passages
-    def __init__(self, x: int, y: int, direction: Direction):
-        # \u2587 and \u2589 are a nearly-filled-in-rectangle characters
-        if direction == direction.UP or direction == direction.DOWN:
-            char = '\u2587'
+class TileIndex:
+    # Maps each cell to the tiles standing on it, so that position queries
+    # don't have to scan the whole maze.
+    # Tiles are also kept in coarse buckets of cells for area queries.
+    # Walkers must move through move_tile() (see TileWalker.move_to) to keep it correct
+    BUCKET_SIZE = 16
+
+    def __init__(self, tiles=()):
+        self.cells = {}
+        self.buckets = {}
+        for tile in tiles:
+            self.add_tile(tile)
+
+    def __bucket_of(self, x: int, y: int):
+        return (x // self.BUCKET_SIZE, y // self.BUCKET_SIZE)
+
+    def add_tile(self, tile: Tile):
+        self.cells.setdefault((tile.x, tile.y), []).append(tile)
+        # Buckets are dicts used as ordered sets, so that walkers are always
+        # found in the same order (keeping the game deterministic)
+        self.buckets.setdefault(self.__bucket_of(tile.x, tile.y), {})[tile] = None
+
+    def remove_tile(self, tile: Tile):
+        position = (tile.x, tile.y)
+        tiles = self.cells[position]
+        tiles.remove(tile)
+        if len(tiles) == 0:
+            del self.cells[position]
+
+        bucket = self.__bucket_of(tile.x, tile.y)
+        bucket_tiles = self.buckets[bucket]
+        del bucket_tiles[tile]
+        if len(bucket_tiles) == 0:
+            del self.buckets[bucket]
+
+    def move_tile(self, tile: Tile, new_x: int, new_y: int):
+        old_x = tile.x
+        old_y = tile.y
+        tiles = self.cells[(old_x, old_y)]
+        if len(tiles) == 1:
+            del self.cells[(old_x, old_y)]
         else:
-            char = '\u2589'
-        super().__init__(x, y, char)
+            tiles.remove(tile)
+        self.cells.setdefault((new_x, new_y), []).append(tile)
+        # Most steps stay inside a bucket
+        if self.__bucket_of(old_x, old_y) != self.__bucket_of(new_x, new_y):
+            self.move_bucket(tile, old_x, old_y, new_x, new_y)
+        tile.x = new_x
+        tile.y = new_y
 
-class DeathTile(Tile):
-    COLOR_PAIR_NUMBER = 2
-    def __init__(self, x: int, y: int):
-        super().__init__(x, y, 'X')
+    def move_bucket(self, tile: Tile, old_x: int, old_y: int, new_x: int, new_y: int):
+        # Only the bucket part of a move, for walkers that update cells themselves
+        old_bucket = self.__bucket_of(old_x, old_y)
+        bucket_tiles = self.buckets[old_bucket]
+        del bucket_tiles[tile]
+        if len(bucket_tiles) == 0:
+            del self.buckets[old_bucket]
+        self.buckets.setdefault(self.__bucket_of(new_x, new_y), {})[tile] = None
 
-class FinishTile(Tile):
-    COLOR_PAIR_NUMBER = 4
-    def __init__(self, x: int, y: int):
-        super().__init__(x, y, '\u2588')
+    def tiles_at(self, x: int, y: int):
+        return self.cells.get((x, y), ())
+
+    def tiles_in_rect(self, left: int, top: int, right: int, bottom: int):
+        # Every tile with left <= x <= right and top <= y <= bottom
+        left_bucket, top_bucket = self.__bucket_of(left, top)
+        right_bucket, bottom_bucket = self.__bucket_of(right, bottom)
+        tiles = []
+        for bucket_y in range(top_bucket, bottom_bucket + 1):
+            for bucket_x in range(left_bucket, right_bucket + 1):
+                for tile in self.buckets.get((bucket_x, bucket_y), ()):
+                    if left <= tile.x <= right and top <= tile.y <= bottom:
+                        tiles.append(tile)
+        return tiles
 
 class TileWalker(ABC, Tile):
     # Abstract class for anything that can walk on the tiles
-    KILLED_BY = []
-    COLLIDES_WITH = []
-    WALKABLE_TILES = []
+    # Terrain rules are masks of terrain flags,
+    # the *_WALKERS lists hold the types of other walkers that count
+    KILLED_BY = 0
+    COLLIDES_WITH = 0
+    WALKABLE_TILES = 0
+    KILLED_BY_WALKERS = []
+    COLLIDES_WITH_WALKERS = []
 
     def __init__(self, x: int, y: int, char='W'):
         super().__init__(x, y, char)
     
-    def can_walk_to(self, new_x, new_y, tiles):
-        is_floor = False
-        no_obstacles = True
-        for tile in tiles:
-            if tile.x == new_x and tile.y == new_y:
-                if type(tile) in self.WALKABLE_TILES:
-                    is_floor = True
-                elif type(tile) in self.COLLIDES_WITH:
-                    no_obstacles = False
-                    break
-        return is_floor and no_obstacles
-
-    def check_if_dead(self, new_x, new_y, tiles):
-        touching_death_tile = False
-        for tile in tiles:
-            if tile.x == new_x and \
-                tile.y == new_y and \
-                type(tile) in self.KILLED_BY:
+    def can_walk_to(self, new_x, new_y, maze):
+        maze.collision_checks += 1
+        flags = maze.terrain.get(new_x, new_y)
+        if not flags & self.WALKABLE_TILES or flags & self.COLLIDES_WITH:
+            return False
+        for tile in maze.tile_index.tiles_at(new_x, new_y):
+            if type(tile) in self.COLLIDES_WITH_WALKERS:
+                return False
+        return True
 
-                touching_death_tile = True
-                break
-        return touching_death_tile
+    def check_if_dead(self, new_x, new_y, maze):
+        maze.collision_checks += 1
+        if maze.terrain.get(new_x, new_y) & self.KILLED_BY:
+            return True
+        for tile in maze.tile_index.tiles_at(new_x, new_y):
+            if type(tile) in self.KILLED_BY_WALKERS:
+                return True
+        return False
+
+    def move_to(self, new_x, new_y, maze):
+        maze.tile_index.move_tile(self, new_x, new_y)
 
     @abstractmethod
-    def update(self, src, tiles, *args):
+    def update(self, src, maze, *args):
         pass
 
 class Player(TileWalker):
     COLOR_PAIR_NUMBER = 3
+    KILLED_BY = DEATH
+    COLLIDES_WITH = DEATH
+    WALKABLE_TILES = FLOOR | PASSAGE
 
     def __init__(self, x: int, y: int, char='@'):
         super().__init__(x, y, char)
@@ -97,137 +147,641 @@ class Player(TileWalker):
         self.health = 1
         self.finished = False
 
-        # These are in __init__ so they can reference stuff defined later
-        self.KILLED_BY = [DeathTile, MovingEnemy, ChasingEnemy]
-        self.COLLIDES_WITH = [DeathTile, MovingEnemy, ChasingEnemy]
-        self.WALKABLE_TILES = [FloorTile, PassageFloorTile]
-
-    def check_if_finished(self, tiles):
-        finished = False
-        for tile in tiles:
-            if tile.x == self.x and \
-                tile.y == self.y and \
-                type(tile) == FinishTile:
-
-                finished = True
-                break
-        return finished
+    def check_if_finished(self, maze):
+        return bool(maze.terrain.get(self.x, self.y) & FINISH)
     
-    def keybinds(self, scr, tiles):
-        curses.flushinp()
-        key = scr.getkey()
-        new_x = self.x
-        new_y = self.y
-        moved = False
-        if key == 'KEY_UP' or key.lower() == 'w' :
-            new_y -= 1
-            moved = True
-        elif key == 'KEY_DOWN' or key.lower() == 's':
-            new_y += 1
-            moved = True
-        elif key == 'KEY_LEFT' or key.lower() == 'a':
-            new_x -= 1
-            moved = True
-        elif key == 'KEY_RIGHT' or key.lower() == 'd':
-            new_x += 1
-            moved = True
-        elif key.lower() == 'q':
-            raise KeyboardInterrupt()
-
-        return (new_x, new_y, moved)
-
     def update(*args):
         pass
 
-    def player_update(self, scr, tiles):
-        new_x, new_y, moved = self.keybinds(scr, tiles)
-        if moved:
-            if self.can_walk_to(new_x, new_y, tiles):
-                self.x = new_x
-                self.y = new_y
-            else:
-                curses.beep()
+    def player_update(self, direction, maze):
+        # Try to step in direction (None to stand still).
+        # Returns False if the step was blocked
+        could_move = True
+        if direction is not None:
+            dx, dy = Direction.offset(direction)
+            new_x = self.x + dx
+            new_y = self.y + dy
+            could_move = self.can_walk_to(new_x, new_y, maze)
+            if could_move:
+                self.move_to(new_x, new_y, maze)
             # Check both the current position and the new one
             # In case death things have moved while player stood still
-            if self.check_if_dead(new_x, new_y, tiles) or \
-                self.check_if_dead(self.x, self.y, tiles):
+            if self.check_if_dead(new_x, new_y, maze) or \
+                self.check_if_dead(self.x, self.y, maze):
                 self.alive = False
-        self.finished = self.check_if_finished(tiles)
+        elif self.check_if_dead(self.x, self.y, maze):
+            # Standing still doesn't stop enemies walking into the player
+            self.alive = False
+        self.finished = self.check_if_finished(maze)
+        return could_move
 
 class ChasingEnemy(TileWalker):
     COLOR_PAIR_NUMBER = 2
+    COLLIDES_WITH = DEATH | PASSAGE | FINISH
+    WALKABLE_TILES = FLOOR
     MOVEMENT_CHANCE = 0.5
     PLAYER_DETECTION_DIST = 30
 
     def __init__(self, x: int, y: int):
         super().__init__(x, y, char='!')
-
-        self.COLLIDES_WITH = [MovingEnemy, ChasingEnemy, DeathTile, PassageFloorTile, FinishTile]
-        self.WALKABLE_TILES = [FloorTile]
     
     def can_see_player(self, player):
         return distance_squared(self.x, self.y, player.x, player.y) < \
             self.PLAYER_DETECTION_DIST ** 2
     
-    def update(self, scr, tiles, player):
-        if random.uniform(0, 1) < self.MOVEMENT_CHANCE:
+    def update(self, scr, maze, player, chase_field=None, rng=random):
+        # chase_field is a DistanceField leading to the player, shared by all chasers.
+        # Without one (or if the player can't be reached in it) head straight for the player
+        if rng.uniform(0, 1) < self.MOVEMENT_CHANCE:
             if self.can_see_player(player):
-                new_x = self.x
-                new_y = self.y
-                if player.x < self.x:
-                    new_x -= 1
-                elif player.x > self.x:
-                    new_x += 1
-                if player.y < self.y:
-                    new_y -= 1
-                elif player.y > self.y:
-                    new_y += 1
-
-                if self.can_walk_to(new_x, new_y, tiles):
-                    self.x = new_x
-                    self.y = new_y
-                elif self.can_walk_to(new_x, self.y, tiles):
-                    self.x = new_x
-                elif self.can_walk_to(self.x, new_y, tiles):
-                    self.y = new_y
+                if chase_field is not None and chase_field.get(self.x, self.y) is not None:
+                    self.follow_field(maze, chase_field)
+                else:
+                    self.move_towards(maze, player)
+
+    def follow_field(self, maze, chase_field):
+        for new_x, new_y in chase_field.downhill_steps(self.x, self.y):
+            if self.can_walk_to(new_x, new_y, maze):
+                self.move_to(new_x, new_y, maze)
+                break
+
+    def move_towards(self, maze, player):
+        new_x = self.x
+        new_y = self.y
+        if player.x < self.x:
+            new_x -= 1
+        elif player.x > self.x:
+            new_x += 1
+        if player.y < self.y:
+            new_y -= 1
+        elif player.y > self.y:
+            new_y += 1
+
+        if self.can_walk_to(new_x, new_y, maze):
+            self.move_to(new_x, new_y, maze)
+        elif self.can_walk_to(new_x, self.y, maze):
+            self.move_to(new_x, self.y, maze)
+        elif self.can_walk_to(self.x, new_y, maze):
+            self.move_to(self.x, new_y, maze)
 
 class MovingEnemy(TileWalker):
+    # Walks in a straight line, turning back when something is in the way.
+    # Its position and direction live in a PatrolSwarm (see below),
+    # so that every moving enemy in a maze can be stepped in one batch
     COLOR_PAIR_NUMBER = 2
+    COLLIDES_WITH = DEATH | PASSAGE | FINISH
+    WALKABLE_TILES = FLOOR
     DIRECTION_TO_CHAR = {
         Direction.LEFT : '<',
         Direction.RIGHT : '>',
         Direction.UP : '^',
         Direction.DOWN : 'v'
     }
+    OFFSET_TO_DIRECTION = {Direction.offset(direction): direction for direction in Direction}
 
     def __init__(self, x: int, y: int, direction: Direction = None):
-        # \u25c6 is a square tilted 45°
-        super().__init__(x, y, char='\u25c6')
-
-        self.COLLIDES_WITH = [MovingEnemy, ChasingEnemy, DeathTile, PassageFloorTile, FinishTile]
-        self.WALKABLE_TILES = [FloorTile]
-
+        # Tile.__init__ isn't called as x, y and char are all stored in the swarm.
+        # Until a maze takes it, the enemy is the only member of a swarm of its own
         if direction is None:
             direction = random.choice(list(Direction))
-        self.direction = direction
-    
-    def update(self, src, tiles, player):
-        self.char = self.DIRECTION_TO_CHAR[self.direction]
+        PatrolSwarm().add(self, x, y, direction)
 
-        new_x = self.x
-        new_y = self.y
-        if self.direction == Direction.LEFT:
-            new_x -= 1
-        elif self.direction == Direction.RIGHT:
-            new_x += 1
-        elif self.direction == Direction.UP:
-            new_y -= 1
-        elif self.direction == Direction.DOWN:
-            new_y += 1
+    @property
+    def x(self):
+        if self.swarm.states[self.slot] == PatrolSwarm.ON_TRACK:
+            self.swarm.sync(self.slot)
+        return self.swarm.xs[self.slot]
+
+    @x.setter
+    def x(self, x: int):
+        self.swarm.xs[self.slot] = x
+
+    @property
+    def y(self):
+        if self.swarm.states[self.slot] == PatrolSwarm.ON_TRACK:
+            self.swarm.sync(self.slot)
+        return self.swarm.ys[self.slot]
+
+    @y.setter
+    def y(self, y: int):
+        self.swarm.ys[self.slot] = y
+
+    @property
+    def direction(self):
+        if self.swarm.states[self.slot] == PatrolSwarm.ON_TRACK:
+            self.swarm.sync(self.slot)
+        return self.OFFSET_TO_DIRECTION[(self.swarm.dxs[self.slot], self.swarm.dys[self.slot])]
+
+    @direction.setter
+    def direction(self, direction: Direction):
+        self.swarm.dxs[self.slot], self.swarm.dys[self.slot] = Direction.offset(direction)
+
+    @property
+    def char(self):
+        # \u25c6 is a square tilted 45°, shown until the enemy first moves
+        if self.swarm.states[self.slot] == PatrolSwarm.ON_TRACK:
+            self.swarm.sync(self.slot)
+        if not self.swarm.moved[self.slot]:
+            return '\u25c6'
+        return self.DIRECTION_TO_CHAR[self.direction]
+
+    def update(self, src, maze, player, *args):
+        self.swarm.step(maze, [self.slot])
+
+class PatrolSwarm:
+    # Every MovingEnemy of a maze, stored as parallel arrays indexed by slot
+    # rather than as attributes of each enemy.
+    # The arrays are what step() works on, the enemy objects are only views of their slot
+    # for the tile index and everything else that wants a walker.
+    #
+    # An enemy can only ever be on its track: the run of cells along its line that terrain
+    # allows it on. With nothing but terrain in the way it goes back and forth along it
+    # forever, so its position at any tick can be worked out straight away rather than
+    # stepping it there. Enemies away from the player are left to do that (they are on their
+    # track, not in the tile index, and cost nothing until they are looked at or woken),
+    # as long as nothing else could get in their way:
+    #     - no other moving enemy's track crosses theirs. Two enemies on tracks that cross
+    #       nearly always meet sooner or later (it takes track lengths with a big enough
+    #       common factor for them not to), so it isn't worth working out if they would
+    #     - no walker of BLOCKING_WALKERS is on their track. Those walkers call
+    #       wake_around() before moving, so that enemies whose track they could step onto
+    #       are put back in the tile index first
+    # Enemies that can't be left are held: in the tile index, and updated by the scheduler
+    # like any other enemy, so they stand still while they are outside its tiers.
+    # Enemies near the player are awake: in the tile index, and put back on their track
+    # (or held) once the player is far enough away.
+    #
+    # A track of length L is followed in 2L ticks, starting from one end of it.
+    # Its phase (0 to 2L - 1) is the place in that cycle: the first L are its cells heading
+    # away from the start, the next L the same cells coming back (each end cell appears
+    # twice, as turning round takes a tick).
+    # An enemy standing somewhere it can't walk (on a death tile, say) steps off it onto
+    # a track that starts next to it, either straight away (phase -1) or after turning
+    # round (phase -2). If it can't step off either way it turns round every tick forever,
+    # which is a track of length 0
+    AWAKE = 0
+    ON_TRACK = 1
+    HELD = 2
+    # Lines up with the tile index's buckets, so that they can be looked up with the same key
+    TRACK_BUCKET_SIZE = TileIndex.BUCKET_SIZE
+    # Values in tracks for each enemy: the first cell's x (or y, for enemies going up and
+    # down), the direction along the axis from there (1 or -1), the number of cells,
+    # the phase the enemy was at when it was last put on its track, the clock then,
+    # and TRACK_* flags. The first three and the flags are worked out when a maze takes
+    # the enemy, as it is always somewhere on the same track
+    TRACK_FIELDS = 6
+    # The enemy started off next to its track (see above)
+    TRACK_LEAD_IN = 1
+    # Another enemy's track crosses it. Never cleared, as enemies only leave a maze
+    # along with the chunk they are in, which takes any enemies whose tracks cross theirs too
+    TRACK_CROSSED = 2
+
+    def __init__(self):
+        self.xs = array('i')
+        self.ys = array('i')
+        # Direction as a step along each axis, so turning round is just negating them
+        self.dxs = array('b')
+        self.dys = array('b')
+        self.moved = array('b')
+        # AWAKE, ON_TRACK or HELD. For enemies on their track, xs, ys, dxs and dys
+        # are only brought up to date when they are asked for (see sync())
+        self.states = array('b')
+        # TRACK_FIELDS values for each enemy.
+        # One array rather than a column each, as every enemy starts in a swarm of its own
+        self.tracks = array('i')
+        self.enemies = []
+        # Ticks the swarm has been through
+        self.clock = 0
+        # Awake enemies in a maze, as an ordered set
+        self.awake = {}
+        # Every enemy in a maze, by every bucket of cells its track goes through
+        self.track_buckets = {}
+
+    def __len__(self):
+        return len(self.enemies)
+
+    def __columns(self):
+        # The arrays with one value for each enemy
+        return (self.xs, self.ys, self.dxs, self.dys, self.moved, self.states)
+
+    def add(self, enemy: MovingEnemy, x: int, y: int, direction: Direction):
+        # The enemy starts off its track, but only counts as awake once adopt()
+        # or wake() has put it in a maze
+        dx, dy = Direction.offset(direction)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.dxs.append(dx)
+        self.dys.append(dy)
+        self.moved.append(0)
+        self.states.append(self.AWAKE)
+        self.tracks.extend((0,) * self.TRACK_FIELDS)
+        enemy.swarm = self
+        enemy.slot = len(self.enemies)
+        self.enemies.append(enemy)
+
+    def add_packed(self, xs: array, ys: array, dxs: array, dys: array, moved: array,
+        states: array, tracks: array):
+        # Adds enemies of a maze straight from arrays of their state (eg. from a snapshot)
+        # and returns them. Like MovingEnemy.__init__, but without a swarm for each
+        first_slot = len(self.enemies)
+        new_enemies = []
+        for slot in range(first_slot, first_slot + len(xs)):
+            enemy = MovingEnemy.__new__(MovingEnemy)
+            enemy.swarm = self
+            enemy.slot = slot
+            new_enemies.append(enemy)
+        for column, values in zip(self.__columns(), (xs, ys, dxs, dys, moved, states)):
+            column.extend(values)
+        self.tracks.extend(tracks)
+        self.enemies += new_enemies
+        for enemy in new_enemies:
+            self.__index_track(enemy)
+            if self.states[enemy.slot] == self.AWAKE:
+                self.awake[enemy] = None
+        return new_enemies
+
+    def adopt(self, enemy: MovingEnemy, maze=None):
+        # Take the enemy (and its state) over from the swarm it is in, which it must be
+        # awake in. If maze is given (the maze this swarm belongs to) the enemy goes onto
+        # its track, or into the tile index if it has to be held,
+        # so it mustn't be in the tile index already
+        old_swarm = enemy.swarm
+        slot = enemy.slot
+        moved = old_swarm.moved[slot]
+        direction = enemy.direction
+        x = enemy.x
+        y = enemy.y
+        old_swarm.remove(enemy)
+        self.add(enemy, x, y, direction)
+        self.moved[enemy.slot] = moved
+        if maze is None:
+            self.awake[enemy] = None
+            return
+        self.__find_track(maze.terrain, enemy)
+        self.__index_track(enemy)
+        self.__mark_crossings(maze, enemy)
+        if self.__track_is_clear(maze, enemy.slot):
+            self.__lay_track(enemy)
+        else:
+            self.states[enemy.slot] = self.HELD
+            maze.tile_index.add_tile(enemy)
+
+    def release(self, enemy: MovingEnemy):
+        # Move the enemy back into a swarm of its own, keeping its state
+        PatrolSwarm().adopt(enemy)
+
+    def remove(self, enemy: MovingEnemy):
+        # The last enemy takes the removed one's slot, so the arrays stay packed
+        self.awake.pop(enemy, None)
+        # Only the enemies of a maze have their tracks indexed
+        if self.track_buckets:
+            self.__unindex_track(enemy)
+        slot = enemy.slot
+        last = len(self.enemies) - 1
+        fields = self.TRACK_FIELDS
+        if slot != last:
+            moved_enemy = self.enemies[last]
+            for column in self.__columns():
+                column[slot] = column[last]
+            self.tracks[slot * fields:(slot + 1) * fields] = \
+                self.tracks[last * fields:(last + 1) * fields]
+            self.enemies[slot] = moved_enemy
+            moved_enemy.slot = slot
+        for column in self.__columns():
+            column.pop()
+        del self.tracks[last * fields:]
+        self.enemies.pop()
+
+    def sync(self, slot: int):
+        # Bring the position and direction of an enemy on its track up to date
+        start, step, length, phase, clock, _ = \
+            self.tracks[slot * self.TRACK_FIELDS:(slot + 1) * self.TRACK_FIELDS]
+        phase += self.clock - clock
+        if self.clock != clock:
+            self.moved[slot] = 1
+        position = None
+        if length == 0:
+            direction = step if phase % 2 == 0 else -step
+        elif phase < 0:
+            # Not on the track yet, but facing it for the last tick before
+            if phase < -1:
+                return
+            direction = step
+        else:
+            phase %= length * 2
+            if phase < length:
+                position = start + phase * step
+                direction = step
+            else:
+                position = start + (length * 2 - 1 - phase) * step
+                direction = -step
+        if self.dxs[slot] != 0:
+            self.dxs[slot] = direction
+            if position is not None:
+                self.xs[slot] = position
+        else:
+            self.dys[slot] = direction
+            if position is not None:
+                self.ys[slot] = position
 
-        if self.can_walk_to(new_x, new_y, tiles):
-            self.x = new_x
-            self.y = new_y
+    def __find_track(self, terrain, enemy: MovingEnemy):
+        slot = enemy.slot
+        vertical = self.dxs[slot] == 0
+        direction = self.dxs[slot] + self.dys[slot]
+        position = self.ys[slot] if vertical else self.xs[slot]
+        table = run_table(MovingEnemy.WALKABLE_TILES, MovingEnemy.COLLIDES_WITH)
+
+        def run_through(position: int):
+            if vertical:
+                return terrain.run_through(self.xs[slot], position, True, table)
+            return terrain.run_through(position, self.ys[slot], False, table)
+
+        flags = 0
+        run = run_through(position)
+        if run is not None:
+            # Starting from whichever end is behind the enemy
+            start = run[0] if direction > 0 else run[1]
+            step = direction
+        elif run_through(position + direction) is not None:
+            run = run_through(position + direction)
+            start = position + direction
+            step = direction
+            flags = self.TRACK_LEAD_IN
+        elif run_through(position - direction) is not None:
+            run = run_through(position - direction)
+            start = position - direction
+            step = -direction
+            flags = self.TRACK_LEAD_IN
+        else:
+            start = position
+            step = direction
+        length = 0 if run is None else run[1] - run[0] + 1
+        self.tracks[slot * self.TRACK_FIELDS:(slot + 1) * self.TRACK_FIELDS] = \
+            array('i', (start, step, length, 0, 0, flags))
+
+    def __lay_track(self, enemy: MovingEnemy):
+        # Work out the phase the enemy is at from where it is on its track and which way
+        # it is facing
+        slot = enemy.slot
+        fields_start = slot * self.TRACK_FIELDS
+        start, step, length = self.tracks[fields_start:fields_start + 3]
+        direction = self.dxs[slot] + self.dys[slot]
+        position = self.xs[slot] if self.dxs[slot] != 0 else self.ys[slot]
+        offset = (position - start) * step
+        if length == 0:
+            phase = 0 if direction == step else 1
+        elif offset < 0:
+            # Still on the cell it steps onto the track from
+            phase = -1 if direction == step else -2
         else:
-            old_dir = self.direction.name
-            self.direction = Direction.opposite(self.direction)
+            phase = offset if direction == step else length * 2 - 1 - offset
+        self.tracks[fields_start + 3] = phase
+        self.tracks[fields_start + 4] = self.clock
+        self.states[slot] = self.ON_TRACK
+        self.awake.pop(enemy, None)
+
+    def put_on_track(self, maze, enemy: MovingEnemy):
+        # Take an awake enemy out of the tile index, leaving it to follow its track
+        maze.tile_index.remove_tile(enemy)
+        self.__lay_track(enemy)
+
+    def wake(self, maze, enemy: MovingEnemy):
+        # Take the enemy off its track and put it in the tile index where it is now
+        self.sync(enemy.slot)
+        self.states[enemy.slot] = self.AWAKE
+        self.awake[enemy] = None
+        maze.tile_index.add_tile(enemy)
+
+    def __hold(self, maze, enemy: MovingEnemy):
+        self.sync(enemy.slot)
+        self.states[enemy.slot] = self.HELD
+        maze.tile_index.add_tile(enemy)
+
+    def wake_all(self, maze):
+        # Held enemies are already in the tile index, and only need to count as awake
+        for enemy in self.enemies:
+            if self.states[enemy.slot] == self.ON_TRACK:
+                self.wake(maze, enemy)
+            elif self.states[enemy.slot] == self.HELD:
+                self.states[enemy.slot] = self.AWAKE
+                self.awake[enemy] = None
+
+    def wake_around(self, maze, x: int, y: int):
+        # Hold every enemy on its track whose track goes within a cell of (x, y), for a walker
+        # of BLOCKING_WALKERS that is about to move from (x, y) or has just been put there
+        # Called for every chaser update, so it is kept quick when there is nothing to hold
+        bucket_size = self.TRACK_BUCKET_SIZE
+        states = self.states
+        on_track = self.ON_TRACK
+        holding = {}
+        for bucket_y in range((y - 1) // bucket_size, (y + 1) // bucket_size + 1):
+            for bucket_x in range((x - 1) // bucket_size, (x + 1) // bucket_size + 1):
+                for enemy in self.track_buckets.get((bucket_x, bucket_y), ()):
+                    if states[enemy.slot] == on_track and \
+                        self.__track_is_near(enemy.slot, x, y, 1):
+                        holding[enemy] = None
+        if not holding:
+            return
+        # In slot order, so that they go into the tile index in the same order
+        # however the track buckets were filled
+        for enemy in sorted(holding, key=lambda enemy: enemy.slot):
+            self.__hold(maze, enemy)
+
+    def update_awake(self, maze, x: int, y: int, radius: int):
+        # Only keep the enemies inside the (aspect corrected) circle around (x, y) awake
+        radius_squared = radius ** 2
+        for enemy in list(self.awake):
+            slot = enemy.slot
+            if distance_squared(self.xs[slot] / 2, self.ys[slot], x / 2, y) >= radius_squared:
+                if self.__track_is_clear(maze, slot):
+                    self.put_on_track(maze, enemy)
+                else:
+                    del self.awake[enemy]
+                    self.states[slot] = self.HELD
+        left = x - radius * 2
+        top = y - radius
+        right = x + radius * 2
+        bottom = y + radius
+        waking = []
+        for enemy in self.on_track_in_rect(left, top, right, bottom):
+            # Already brought up to date by on_track_in_rect()
+            slot = enemy.slot
+            if distance_squared(self.xs[slot] / 2, self.ys[slot], x / 2, y) < radius_squared:
+                waking.append(enemy)
+        waking.sort(key=lambda enemy: enemy.slot)
+        for enemy in waking:
+            self.wake(maze, enemy)
+        # Held enemies that come near count as awake, so that they are looked at again
+        # once they are far away
+        for walker in maze.tile_index.tiles_in_rect(left, top, right, bottom):
+            if type(walker) == MovingEnemy and self.states[walker.slot] == self.HELD and \
+                distance_squared(walker.x / 2, walker.y, x / 2, y) < radius_squared:
+                self.states[walker.slot] = self.AWAKE
+                self.awake[walker] = None
+
+    def on_track_in_rect(self, left: int, top: int, right: int, bottom: int):
+        # Enemies on their track that are now in the rectangle (edges included).
+        # Tracks can go through several of the buckets, so each enemy is only looked at once
+        found = []
+        checked = set()
+        bucket_size = self.TRACK_BUCKET_SIZE
+        xs = self.xs
+        ys = self.ys
+        states = self.states
+        on_track = self.ON_TRACK
+        for bucket_y in range(top // bucket_size, bottom // bucket_size + 1):
+            for bucket_x in range(left // bucket_size, right // bucket_size + 1):
+                for enemy in self.track_buckets.get((bucket_x, bucket_y), ()):
+                    slot = enemy.slot
+                    if states[slot] != on_track or enemy in checked:
+                        continue
+                    checked.add(enemy)
+                    self.sync(slot)
+                    if left <= xs[slot] <= right and top <= ys[slot] <= bottom:
+                        found.append(enemy)
+        return found
+
+    def __track_is_clear(self, maze, slot: int):
+        # Whether the enemy in slot can be left on its track (see above)
+        if self.tracks[slot * self.TRACK_FIELDS + 5] & self.TRACK_CROSSED:
+            return False
+        buckets = maze.tile_index.buckets
+        blocking_walkers = self.BLOCKING_WALKERS
+        for bucket in self.__track_buckets_of(slot):
+            for walker in buckets.get(bucket, ()):
+                if type(walker) in blocking_walkers and \
+                    self.__track_is_near(slot, walker.x, walker.y, 0):
+                    return False
+        return True
+
+    def __track_is_near(self, slot: int, x: int, y: int, distance: int):
+        # Whether (x, y) is within distance cells (diagonals included) of any cell
+        # the enemy in slot can be in
+        vertical, across, first, last = self.__reach(slot)
+        if vertical:
+            x, y = y, x
+        return abs(y - across) <= distance and first - distance <= x <= last + distance
+
+    def __mark_crossings(self, maze, enemy: MovingEnemy):
+        # Flag the enemy's track and any it crosses, holding the enemies on those
+        # as they can't be left on them any more
+        slot = enemy.slot
+        fields = self.TRACK_FIELDS
+        checked = {enemy}
+        holding = []
+        for bucket in self.__track_buckets_of(slot):
+            for other in self.track_buckets[bucket]:
+                if other in checked:
+                    continue
+                checked.add(other)
+                if not self.__tracks_cross(slot, other.slot):
+                    continue
+                self.tracks[slot * fields + 5] |= self.TRACK_CROSSED
+                self.tracks[other.slot * fields + 5] |= self.TRACK_CROSSED
+                if self.states[other.slot] == self.ON_TRACK:
+                    holding.append(other)
+        holding.sort(key=lambda enemy: enemy.slot)
+        for other in holding:
+            self.__hold(maze, other)
+
+    def __reach(self, slot: int):
+        # (whether the enemy in slot goes up and down, its x if it does (else its y),
+        # first, last) where first to last are the y (or x) of every cell it can be in
+        start, step, length, _, _, flags = \
+            self.tracks[slot * self.TRACK_FIELDS:(slot + 1) * self.TRACK_FIELDS]
+        # Including the cell it steps onto the track from, if it does
+        first = start - step if flags & self.TRACK_LEAD_IN else start
+        last = start + (length - 1) * step if length > 0 else start
+        if self.dxs[slot] != 0:
+            return False, self.ys[slot], min(first, last), max(first, last)
+        return True, self.xs[slot], min(first, last), max(first, last)
+
+    def __tracks_cross(self, slot: int, other_slot: int):
+        vertical, across, first, last = self.__reach(slot)
+        other_vertical, other_across, other_first, other_last = self.__reach(other_slot)
+        if vertical == other_vertical:
+            return across == other_across and first <= other_last and other_first <= last
+        return first <= other_across <= last and other_first <= across <= other_last
+
+    def __track_buckets_of(self, slot: int):
+        # Buckets of every cell the enemy in slot can be in
+        bucket_size = self.TRACK_BUCKET_SIZE
+        vertical, across, first, last = self.__reach(slot)
+        if vertical:
+            bucket_x = across // bucket_size
+            return [(bucket_x, bucket_y)
+                for bucket_y in range(first // bucket_size, last // bucket_size + 1)]
+        bucket_y = across // bucket_size
+        return [(bucket_x, bucket_y)
+            for bucket_x in range(first // bucket_size, last // bucket_size + 1)]
+
+    def __index_track(self, enemy: MovingEnemy):
+        for bucket in self.__track_buckets_of(enemy.slot):
+            self.track_buckets.setdefault(bucket, {})[enemy] = None
+
+    def __unindex_track(self, enemy: MovingEnemy):
+        for bucket in self.__track_buckets_of(enemy.slot):
+            enemies = self.track_buckets[bucket]
+            del enemies[enemy]
+            if len(enemies) == 0:
+                del self.track_buckets[bucket]
+
+    def step(self, maze, slots=None):
+        # Move the enemies in slots (all of the awake ones if None) one step each, in order.
+        # An enemy blocked by terrain or by a walker it collides with turns round instead.
+        # This is the hot loop for mazes full of enemies, so it works on the arrays
+        # and the tile index's cells directly rather than going through the enemy objects
+        if slots is None:
+            slots = [enemy.slot for enemy in self.awake]
+        maze.collision_checks += len(slots)
+        xs, ys, dxs, dys, moved = self.xs, self.ys, self.dxs, self.dys, self.moved
+        enemies = self.enemies
+        get_flags = maze.terrain.get
+        tile_index = maze.tile_index
+        occupied = tile_index.cells
+        bucket_size = tile_index.BUCKET_SIZE
+        walkable_mask = MovingEnemy.WALKABLE_TILES
+        blocked_mask = MovingEnemy.COLLIDES_WITH
+        blocking_walkers = MovingEnemy.COLLIDES_WITH_WALKERS
+        for slot in slots:
+            moved[slot] = 1
+            x = xs[slot]
+            y = ys[slot]
+            new_x = x + dxs[slot]
+            new_y = y + dys[slot]
+            flags = get_flags(new_x, new_y)
+            if not flags & walkable_mask or flags & blocked_mask:
+                dxs[slot] = -dxs[slot]
+                dys[slot] = -dys[slot]
+                continue
+            new_position = (new_x, new_y)
+            tiles = occupied.get(new_position)
+            if tiles is not None:
+                if any(type(tile) in blocking_walkers for tile in tiles):
+                    dxs[slot] = -dxs[slot]
+                    dys[slot] = -dys[slot]
+                    continue
+                tiles.append(enemies[slot])
+            else:
+                occupied[new_position] = [enemies[slot]]
+
+            enemy = enemies[slot]
+            tiles = occupied[(x, y)]
+            if len(tiles) == 1:
+                del occupied[(x, y)]
+            else:
+                tiles.remove(enemy)
+            if x // bucket_size != new_x // bucket_size or y // bucket_size != new_y // bucket_size:
+                tile_index.move_bucket(enemy, x, y, new_x, new_y)
+            xs[slot] = new_x
+            ys[slot] = new_y
+
+# These refer to classes defined after the ones they belong to
+Player.KILLED_BY_WALKERS = [MovingEnemy, ChasingEnemy]
+Player.COLLIDES_WITH_WALKERS = [MovingEnemy, ChasingEnemy]
+ChasingEnemy.COLLIDES_WITH_WALKERS = [MovingEnemy, ChasingEnemy]
+MovingEnemy.COLLIDES_WITH_WALKERS = [MovingEnemy, ChasingEnemy]
+# Walkers that moving enemies on their track would go through (see PatrolSwarm).
+# The player isn't one, as enemies are always awake near it
+PatrolSwarm.BLOCKING_WALKERS = [walker_type for walker_type in MovingEnemy.COLLIDES_WITH_WALKERS
+    if walker_type != MovingEnemy]
@@ -0,0 +1,141 @@
+# Drawing a round, shared by the curses game and the server.
+# Anything with put(x, y, char, style) can be drawn to (a Renderer or a TerrainPad);
+# pan_x and pan_y are subtracted from map positions, so pass 0 to draw in map coordinates
+
+import textwrap
+
+from misc import *
+from terrain import *
+from renderer import BLANK_CHAR, STYLE_DIM
+
+# Pan when this close to a screen edge
+PAN_TRIGGER_DIST_X = 20
+PAN_TRIGGER_DIST_Y = 10
+# Move this far each time pan is triggered
+# (may take multiple frames to move fully)
+PAN_INCREMENT = 1
+
+def draw_remembered_tiles(target, engine, pan_x: int, pan_y: int, width: int, height: int):
+    # Draws the terrain the player has seen that is on screen, dimmed.
+    # Returns the number of tiles drawn
+    terrain = engine.maze.terrain
+    seen = engine.seen
+    tiles_drawn = 0
+    for screen_y in range(height):
+        y = screen_y + pan_y
+        for x in seen.seen_in_row(y, pan_x, pan_x + width):
+            appearance = cell_appearance(terrain.get(x, y))
+            if appearance is not None:
+                char, color_pair_number = appearance
+                target.put(x - pan_x, screen_y, char, color_pair_number | STYLE_DIM)
+                tiles_drawn += 1
+    return tiles_drawn
+
+class RememberedLayer:
+    # The dimmed remembered terrain on screen, kept between frames to start each one from
+    # (see Renderer.begin_frame). Everything seen since the last frame was lit in it,
+    # so only those cells are added to the layer. It is drawn again in full when the
+    # view pans, the screen is resized or the terrain changes
+
+    def __init__(self):
+        self.view = None
+        self.chars = []
+        self.styles = []
+        # (x, y, radius) of the lit area of the last frame drawn with line of sight
+        self.lit_from = None
+
+    def update(self, engine, pan_x: int, pan_y: int, width: int, height: int):
+        # Returns the layer as (chars, styles)
+        view = (engine.maze, engine.maze.terrain_version, pan_x, pan_y, width, height)
+        if view != self.view:
+            self.view = view
+            self.chars = [[BLANK_CHAR] * width for _ in range(height)]
+            self.styles = [[0] * width for _ in range(height)]
+            draw_remembered_tiles(self, engine, pan_x, pan_y, width, height)
+        elif self.lit_from is not None:
+            lit_area_x, lit_area_y, radius = self.lit_from
+            terrain = engine.maze.terrain
+            for dx, dy in engine.fov.visible_offsets(lit_area_x, lit_area_y, radius):
+                x = lit_area_x + dx
+                y = lit_area_y + dy
+                appearance = cell_appearance(terrain.get(x, y))
+                if appearance is not None:
+                    char, color_pair_number = appearance
+                    self.put(x - pan_x, y - pan_y, char, color_pair_number | STYLE_DIM)
+        self.lit_from = None
+        return (self.chars, self.styles)
+
+    def put(self, x: int, y: int, char: str, style: int = 0):
+        if 0 <= y < len(self.chars) and 0 <= x < len(self.chars[y]):
+            self.chars[y][x] = char
+            self.styles[y][x] = style
+
+def draw_lit_tiles(target, engine, lit_area_x: int, lit_area_y: int,
+    line_of_sight: bool = True, pan_x: int = 0, pan_y: int = 0, remembered=None):
+    # Draws what can be seen from the lit area, with the walkers on top.
+    # Without line_of_sight (when the camera is flying about rather than following
+    # the player) everything in the view circle can be seen.
+    # remembered is the RememberedLayer the frame started from, if any.
+    # Returns the number of tiles drawn
+    terrain = engine.maze.terrain
+    tile_index = engine.maze.tile_index
+    tiles_drawn = 0
+    lit_walkers = []
+    if line_of_sight:
+        visible_offsets = engine.fov.visible_offsets(lit_area_x, lit_area_y,
+            engine.view_distance)
+        if remembered is not None:
+            remembered.lit_from = (lit_area_x, lit_area_y, engine.view_distance)
+    else:
+        visible_offsets = view_circle_offsets(engine.view_distance)
+        # Moving enemies away from the player are on their tracks rather than in the tile
+        # index (see PatrolSwarm), so they have to be looked for separately
+        radius = engine.view_distance
+        for enemy in engine.maze.patrollers.on_track_in_rect(lit_area_x - radius * 2,
+            lit_area_y - radius, lit_area_x + radius * 2, lit_area_y + radius):
+            if distance_squared(enemy.x / 2, enemy.y, lit_area_x / 2, lit_area_y) < radius ** 2:
+                lit_walkers.append(enemy)
+
+    for dx, dy in visible_offsets:
+        x = lit_area_x + dx
+        y = lit_area_y + dy
+        appearance = cell_appearance(terrain.get(x, y))
+        if appearance is not None:
+            char, color_pair_number = appearance
+            target.put(x - pan_x, y - pan_y, char, color_pair_number)
+            tiles_drawn += 1
+        lit_walkers += tile_index.tiles_at(x, y)
+
+    for tile in lit_walkers:
+        tile.draw(target, pan_x, pan_y)
+    return tiles_drawn + len(lit_walkers)
+
+def hud_lines(engine, width: int):
+    # Lines of text for the bottom of the screen
+    message = 'Arrow keys to move. Q to quit. ' + \
+        'Your goal: get to the green square without dying. ' + \
+        '+/- to change view distance. M to show the map. P to show timings. ' + \
+        f'Move count: {engine.move_count}'
+    return textwrap.wrap(message, width)
+
+def pan_to_follow(pan_x: int, pan_y: int, x: int, y: int, width: int, height: int):
+    # Returns the new (pan_x, pan_y) after moving towards (x, y) if it is near an edge
+    true_x = x - pan_x
+    true_y = y - pan_y
+    if true_x < PAN_TRIGGER_DIST_X:
+        pan_x -= PAN_INCREMENT
+    elif true_x >= width - PAN_TRIGGER_DIST_X:
+        pan_x += PAN_INCREMENT
+    if true_y < PAN_TRIGGER_DIST_Y:
+        pan_y -= PAN_INCREMENT
+    elif true_y >= height - PAN_TRIGGER_DIST_Y:
+        pan_y += PAN_INCREMENT
+    return pan_x, pan_y
+
+def center_text(text: str, total_width: int):
+    lines = []
+    for line in text.split('\n'):
+        padding_total = total_width - len(line)
+        padding_l = padding_total // 2
+        lines.append(' ' * padding_l + line)
+    return '\n'.join(lines)